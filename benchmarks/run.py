@@ -0,0 +1,288 @@
+import os
+import sys
+import json
+import time
+import argparse
+import asyncio
+import platform
+import resource
+import subprocess
+import tempfile
+from datetime import datetime, timezone
+import numpy as np
+
+# ベンチマーク中に作成するキャッシュは一時ディレクトリに保存し、通常のキャッシュに影響しないようにする
+os.environ.setdefault("RAG_CACHE_DIR", tempfile.mkdtemp(prefix="rag-bench-cache-"))
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.append(ROOT_DIR)
+from rag_common.document_intelligence import analyze_document
+from rag_common.fakes import FakeDocumentIntelligenceClient, FakeEmbeddings, FakeSearchClient, FakeChatModel
+from rag_common.incremental import chunk_documents, with_embeddings
+from rag_common.local_search import LocalBM25Retriever, LocalSearchClient
+from rag_common.pipeline import RagPipeline
+from rag_common.semantic_chunker import JAPANESE_SENTENCE_SPLIT_REGEX, FastSemanticChunker
+from rag_common.streaming import iter_pdf_pages
+from rag_common.uploader import BulkUploader
+from rag_common.vector_search import LocalHybridRetriever, LocalVectorRetriever
+from rag_chunking.sweep import create_chunk as sweep_create_chunk
+from rag_sample.indexer import create_chunk as indexer_create_chunk
+
+# ネットワークに接続せず、Azure OpenAI / Document Intelligence / AI Searchをrag_common.fakesのスタンドインに置き換えて
+# チャンキング・インデックス登録・検索の各処理の性能を計測する
+
+SOURCE_PDF = os.path.join(ROOT_DIR, "rag_source_docs", "syugyo-kisoku.pdf")
+SEPARATORS = ["\n\n", "\n", "。", "、", " ", ""]
+QUESTIONS = [
+    "年次有給休暇は何日付与されますか？",
+    "始業時刻と終業時刻を教えてください。",
+    "休職期間はどのくらいですか？",
+    "退職する場合は何日前までに申し出る必要がありますか？",
+    "時間外労働の割増賃金について教えてください。",
+    "育児休業を取得できる対象者は誰ですか？",
+    "懲戒の種類にはどのようなものがありますか？",
+    "賃金の支払日はいつですか？",
+]
+SUITES = ["extraction", "chunking", "upload", "retrieval", "predict"]
+
+
+# 実行中のプロセスと子プロセスのうち最大の物理メモリ使用量(MB)
+def peak_rss_mb() -> float:
+    rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+              resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # Linuxではキロバイト単位、macOSではバイト単位で返る
+    return rss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def summarize(name: str, latencies: list[float], items: int, elapsed: float) -> dict:
+    ms = np.array(latencies) * 1000
+    result = {
+        "name": name,
+        "iterations": len(latencies),
+        "items": items,
+        "elapsed_sec": round(elapsed, 4),
+        "throughput": round(items / elapsed, 2) if elapsed else None,
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+    print(f"{name:<40} p50={result['p50_ms']:>10.3f}ms p95={result['p95_ms']:>10.3f}ms "
+          f"p99={result['p99_ms']:>10.3f}ms throughput={result['throughput']:>10.2f}/s "
+          f"rss={result['peak_rss_mb']:.1f}MB")
+    return result
+
+
+# fnを繰り返し実行して1回ごとの処理時間を計測する。fnは処理した件数を返す(Noneの場合は1件とする)
+def measure(name: str, fn, iterations: int, warmup: int = 1) -> dict:
+    for _ in range(warmup):
+        fn()
+    latencies, items = [], 0
+    start = time.perf_counter()
+    for _ in range(iterations):
+        t = time.perf_counter()
+        n = fn()
+        latencies.append(time.perf_counter() - t)
+        items += 1 if n is None else n
+    return summarize(name, latencies, items, time.perf_counter() - start)
+
+
+# 非同期関数をconcurrency件まで同時に実行し、1件ごとの処理時間と全体のスループットを計測する
+async def ameasure(name: str, fn, args: list, concurrency: int = 1) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def run(arg):
+        async with semaphore:
+            t = time.perf_counter()
+            await fn(arg)
+            latencies.append(time.perf_counter() - t)
+
+    await fn(args[0])
+    start = time.perf_counter()
+    await asyncio.gather(*(run(arg) for arg in args))
+    return summarize(name, latencies, len(args), time.perf_counter() - start)
+
+
+def bench_extraction(args) -> list[dict]:
+    from pypdf import PdfReader
+
+    def serial():
+        return len([page.extract_text() for page in PdfReader(args.source).pages])
+
+    def parallel():
+        return len(list(iter_pdf_pages(args.source, workers=args.workers)))
+
+    client = FakeDocumentIntelligenceClient(latency=args.service_latency)
+    return [
+        measure("extraction/pypdf_serial", serial, args.iterations),
+        measure("extraction/pypdf_parallel", parallel, args.iterations),
+        measure("extraction/document_intelligence_uncached",
+                lambda: analyze_document(args.source, client=client, use_cache=False) and 1, args.iterations),
+        measure("extraction/document_intelligence_cached",
+                lambda: analyze_document(args.source, client=client) and 1, args.iterations),
+    ]
+
+
+def bench_chunking(args, pages: list[str]) -> list[dict]:
+    text = "".join(pages)
+    results = []
+    for chunk_size, overlap in [(500, 0), (1500, 128)]:
+        results.append(measure(
+            f"chunking/recursive_stream_{chunk_size}_{overlap}",
+            lambda: len(list(indexer_create_chunk(iter(pages), SEPARATORS, chunk_size, overlap))),
+            args.iterations,
+        ))
+        results.append(measure(
+            f"chunking/recursive_{chunk_size}_{overlap}",
+            lambda: len(sweep_create_chunk("recursive", {"chunk_size": chunk_size, "chunk_overlap": overlap,
+                                                         "separators": SEPARATORS}, text)),
+            args.iterations,
+        ))
+    results.append(measure(
+        "chunking/markdown",
+        lambda: len(sweep_create_chunk("markdown", {"headers_to_split_on": [["#", "Header 1"], ["##", "Header 2"]]},
+                                       text)),
+        args.iterations,
+    ))
+    chunker = FastSemanticChunker(FakeEmbeddings(latency=args.service_latency), breakpoint_threshold_amount=95,
+                                  sentence_split_regex=JAPANESE_SENTENCE_SPLIT_REGEX, min_chunk_size=100)
+    results.append(measure("chunking/semantic", lambda: len(chunker.split_text(text)), args.iterations))
+    return results
+
+
+# チャンクを複製してn件のドキュメントを作成する
+def make_documents(chunks: list[str], n: int) -> list[dict]:
+    contents = [f"{chunks[i % len(chunks)]}\n({i // len(chunks)})" for i in range(n)]
+    return list(chunk_documents("bench", contents))
+
+
+def bench_upload(args, documents: list[dict]) -> list[dict]:
+    results = []
+    for batch_size, concurrency in [(100, 1), (1000, 1), (1000, 4)]:
+        def upload():
+            uploader = BulkUploader(FakeSearchClient(latency=args.service_latency), batch_size=batch_size,
+                                    max_concurrency=concurrency)
+            return uploader.upload(documents).succeeded
+
+        results.append(measure(f"upload/batch_{batch_size}_concurrency_{concurrency}", upload,
+                               max(1, args.iterations // 10), warmup=0))
+    return results
+
+
+def build_local_index(path: str, documents: list[dict], embeddings) -> dict:
+    start = time.perf_counter()
+    with LocalSearchClient(path) as client:
+        BulkUploader(client).upload(with_embeddings(documents, embeddings))
+    elapsed = time.perf_counter() - start
+    return summarize("retrieval/build_local_index", [elapsed], len(documents), elapsed)
+
+
+def bench_retrieval(args, index_path: str, embeddings) -> list[dict]:
+    questions = [QUESTIONS[i % len(QUESTIONS)] for i in range(args.iterations * 5)]
+    retrievers = {
+        "keyword": LocalBM25Retriever(index_path=index_path, top_k=3),
+        "vector": LocalVectorRetriever(index_path=index_path, embeddings=embeddings, top_k=3),
+        "hybrid": LocalHybridRetriever(index_path=index_path, embeddings=embeddings, top_k=3),
+    }
+    results = []
+    for mode, retriever in retrievers.items():
+        it = iter(questions)
+        results.append(measure(f"retrieval/{mode}", lambda: retriever.invoke(next(it)) and 1, len(questions) - 1))
+    return results
+
+
+async def bench_predict(args, index_path: str) -> list[dict]:
+    llm = FakeChatModel(latency=args.llm_latency)
+    pipeline = RagPipeline(LocalBM25Retriever(index_path=index_path, top_k=3), llm)
+
+    # evaluate.pyのpredictと同じ処理
+    async def predict(question: str):
+        return await pipeline.ainvoke(question)
+
+    questions = [QUESTIONS[i % len(QUESTIONS)] for i in range(args.iterations * 2)]
+    return [
+        await ameasure("predict/sequential", predict, questions, concurrency=1),
+        await ameasure(f"predict/concurrency_{args.concurrency}", predict, questions, concurrency=args.concurrency),
+    ]
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+# 以前の結果と比較し、p50とスループットの変化率を表示する
+def compare(results: list[dict], baseline_file: str):
+    with open(baseline_file, encoding="utf-8") as f:
+        baseline = {r["name"]: r for r in json.load(f)["results"]}
+    print(f"\ncompare with {baseline_file}")
+    for result in results:
+        base = baseline.get(result["name"])
+        if not base:
+            continue
+        p50 = (result["p50_ms"] / base["p50_ms"] - 1) * 100 if base["p50_ms"] else 0.0
+        throughput = (result["throughput"] / base["throughput"] - 1) * 100 if base["throughput"] else 0.0
+        print(f"{result['name']:<40} p50 {p50:+7.1f}%  throughput {throughput:+7.1f}%")
+
+
+def main(args):
+    suites = args.suites or SUITES
+    commit = git_commit()
+    results = []
+
+    if "extraction" in suites:
+        results.extend(bench_extraction(args))
+
+    pages = list(iter_pdf_pages(args.source, workers=args.workers))
+    if "chunking" in suites:
+        results.extend(bench_chunking(args, pages))
+
+    chunks = list(indexer_create_chunk(iter(pages), SEPARATORS, 500, 0))
+    documents = make_documents(chunks, args.documents)
+    if "upload" in suites:
+        results.extend(bench_upload(args, documents))
+
+    if "retrieval" in suites or "predict" in suites:
+        embeddings = FakeEmbeddings()
+        with tempfile.TemporaryDirectory(prefix="rag-bench-index-") as index_path:
+            results.append(build_local_index(index_path, documents, embeddings))
+            if "retrieval" in suites:
+                results.extend(bench_retrieval(args, index_path, embeddings))
+            if "predict" in suites:
+                results.extend(asyncio.run(bench_predict(args, index_path)))
+
+    output = args.output or os.path.join(ROOT_DIR, "benchmarks", "results", f"{commit[:12]}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({
+            "commit": commit,
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+            "results": results,
+        }, f, ensure_ascii=False, indent=2)
+    print(f"\nresults saved to {output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ネットワークに接続せずにRAGパイプラインの各処理の性能を計測する")
+    parser.add_argument("--suites", nargs="*", choices=SUITES, help="実行するベンチマーク(省略時はすべて)")
+    parser.add_argument("--source", default=SOURCE_PDF, help="対象のPDFファイル")
+    parser.add_argument("--iterations", type=int, default=20, help="各ベンチマークの繰り返し回数")
+    parser.add_argument("--documents", type=int, default=5000, help="登録・検索に利用するドキュメント数")
+    parser.add_argument("--workers", type=int, default=None, help="PDF抽出のプロセス数")
+    parser.add_argument("--concurrency", type=int, default=8, help="predictの同時実行数")
+    parser.add_argument("--service-latency", type=float, default=0.01,
+                        help="AI Search / Document Intelligence / Embeddingのスタンドインの応答時間(秒)")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="チャットモデルのスタンドインの応答時間(秒)")
+    parser.add_argument("--output", help="結果のJSONファイル(省略時はbenchmarks/results/<commit>.json)")
+    parser.add_argument("--compare", help="比較対象の結果のJSONファイル")
+    main(parser.parse_args())
@@ -1,17 +1,20 @@
 import os
+import sys
 from dotenv import load_dotenv
 from ragas.llms import LangchainLLMWrapper
-from langchain_openai import AzureChatOpenAI
 from ragas.metrics import ContextEntityRecall
 from ragas import SingleTurnSample
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from rag_common.azure_openai import create_azure_chat_openai
+
 load_dotenv()
 
 os.environ["AZURE_OPENAI_API_KEY"] = os.getenv("AZURE_OPENAI_API_KEY")
 os.environ["AZURE_OPENAI_ENDPOINT"] = os.getenv("AZURE_OPENAI_ENDPOINT")
 os.environ["OPENAI_API_VERSION"] = os.getenv("OPENAI_API_VERSION")
 
-evaluator_llm = LangchainLLMWrapper(AzureChatOpenAI(
+evaluator_llm = LangchainLLMWrapper(create_azure_chat_openai(
     azure_deployment=os.getenv("LLM_DEPLOYMENT_NAME"),
     temperature=0,
 ))
@@ -1,28 +1,35 @@
 import os
+import sys
+import argparse
+import asyncio
 from dotenv import load_dotenv
 from ragas.llms import LangchainLLMWrapper
 from ragas.embeddings import LangchainEmbeddingsWrapper
 from ragas.metrics import ResponseRelevancy, ContextPrecision
-from langchain_openai import AzureChatOpenAI
-from langchain_openai import AzureOpenAIEmbeddings
-from ragas import evaluate
-from ragas import EvaluationDataset
 from ragas import SingleTurnSample
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from rag_common.azure_openai import create_azure_chat_openai, create_azure_openai_embeddings
+from rag_common.embedding_cache import CachedEmbeddings
+from rag_common.ragas_evaluator import RagasEvaluator
+from rag_common.results_store import ResultsStore
+
 load_dotenv()
 
 os.environ["AZURE_OPENAI_API_KEY"] = os.getenv("AZURE_OPENAI_API_KEY")
 os.environ["AZURE_OPENAI_ENDPOINT"] = os.getenv("AZURE_OPENAI_ENDPOINT")
 os.environ["OPENAI_API_VERSION"] = os.getenv("OPENAI_API_VERSION")
 
-evaluator_llm = LangchainLLMWrapper(AzureChatOpenAI(
+evaluator_llm = LangchainLLMWrapper(create_azure_chat_openai(
     azure_deployment=os.getenv("LLM_DEPLOYMENT_NAME"),
     temperature=0,
 ))
 
-evaluator_embeddings = LangchainEmbeddingsWrapper(AzureOpenAIEmbeddings(
+# 一度Embeddingした質問文はキャッシュから取得する
+cached_embeddings = CachedEmbeddings(create_azure_openai_embeddings(
     azure_deployment=os.getenv("EMBEDDING_DEPLOYMENT_NAME"),
 ))
+evaluator_embeddings = LangchainEmbeddingsWrapper(cached_embeddings)
 
 metrics = [
     ContextPrecision(llm=evaluator_llm),
@@ -51,13 +58,27 @@ sample2 = SingleTurnSample(
     reference="標高は3776.12mです。"
 )
 
-dataset = EvaluationDataset(samples=[sample1, sample2])
+samples = {"sample1": sample1, "sample2": sample2}
+
+parser = argparse.ArgumentParser(description="複数のMetricsで評価する")
+parser.add_argument("--run-id", default=None, help="中断した評価の実行ID(指定した実行の続きから評価する)")
+args = parser.parse_args()
+
+# (サンプル, Metric)ごとの評価結果は完了した時点でローカルに記録し、--run-idで再開した場合は評価済みの結果を再利用する
+results = ResultsStore().open_run(args.run_id, script="multi_metrics")
+evaluator = RagasEvaluator(metrics, results=results)
+
+
+async def main():
+    await asyncio.gather(*(evaluator.evaluate_sample(sample, sample_id) for sample_id, sample in samples.items()))
 
-results = evaluate(dataset=dataset, metrics=metrics)
+asyncio.run(main())
 
 # データセット全体の評価値を出力
-print(results)
+print(results.summary())
 
 # データセットごとの評価を表示
-df = results.to_pandas()
-print(df)
\ No newline at end of file
+df = results.load(wide=True)
+print(df)
+print(results.stats)
+print(cached_embeddings.stats)
\ No newline at end of file
@@ -1,25 +1,31 @@
 import os
+import sys
 from dotenv import load_dotenv
 from ragas.llms import LangchainLLMWrapper
 from ragas.embeddings import LangchainEmbeddingsWrapper
-from langchain_openai import AzureChatOpenAI, AzureOpenAIEmbeddings
 from ragas.metrics import ResponseRelevancy
 from ragas import SingleTurnSample
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from rag_common.azure_openai import create_azure_chat_openai, create_azure_openai_embeddings
+from rag_common.embedding_cache import CachedEmbeddings
+
 load_dotenv()
 
 os.environ["AZURE_OPENAI_API_KEY"] = os.getenv("AZURE_OPENAI_API_KEY")
 os.environ["AZURE_OPENAI_ENDPOINT"] = os.getenv("AZURE_OPENAI_ENDPOINT")
 os.environ["OPENAI_API_VERSION"] = os.getenv("OPENAI_API_VERSION")
 
-evaluator_llm = LangchainLLMWrapper(AzureChatOpenAI(
+evaluator_llm = LangchainLLMWrapper(create_azure_chat_openai(
     azure_deployment=os.getenv("LLM_DEPLOYMENT_NAME"),
     temperature=0.8,
 ))
 
-evaluator_embeddings = LangchainEmbeddingsWrapper(AzureOpenAIEmbeddings(
+# 一度Embeddingした質問文はキャッシュから取得する
+cached_embeddings = CachedEmbeddings(create_azure_openai_embeddings(
     azure_deployment=os.getenv("EMBEDDING_DEPLOYMENT_NAME"),
 ))
+evaluator_embeddings = LangchainEmbeddingsWrapper(cached_embeddings)
 
 single_turn_sample = SingleTurnSample(
     user_input="富士山は何県にある山で、標高は何mですか？",
@@ -29,4 +35,5 @@ single_turn_sample = SingleTurnSample(
 metric = ResponseRelevancy(llm=evaluator_llm, embeddings=evaluator_embeddings)
 score = metric.single_turn_score(single_turn_sample)
 
-print(f"{metric.name} : {score}")
\ No newline at end of file
+print(f"{metric.name} : {score}")
+print(cached_embeddings.stats)
\ No newline at end of file
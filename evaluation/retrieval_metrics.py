@@ -0,0 +1,24 @@
+import os
+import sys
+from ragas import SingleTurnSample
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from rag_common.retrieval_metrics import retrieval_metrics, retrieval_scores
+
+# LLMを利用しないため、Azure OpenAIの接続情報は不要
+single_turn_sample = SingleTurnSample(
+    user_input="富士山について教えてください。",
+    retrieved_contexts=[
+        "懸垂曲線の山容を有した玄武岩質成層火山で構成され、その山体は駿河湾の海岸まで及ぶ。",
+        "富士山は山梨県と静岡県に跨る活火山である。標高3776.12 m、日本最高峰の独立峰である。",
+    ],
+    reference_contexts=["富士山は山梨県と静岡県に跨る活火山である。標高3776.12 m、日本最高峰（剣ヶ峰）の独立峰で、その優美な風貌は日本国外でも日本の象徴として広く知られている。"]
+)
+
+for metric in retrieval_metrics(k=2):
+    score = metric.single_turn_score(single_turn_sample)
+    print(f"{metric.name} : {score}")
+
+# データセット全体をまとめて計算する場合は、retrieved_contexts / reference_contextsのリストを渡す
+scores = retrieval_scores([single_turn_sample.retrieved_contexts], [single_turn_sample.reference_contexts], k=2)
+print({name: values.mean() for name, values in scores.items()})
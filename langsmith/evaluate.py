@@ -1,15 +1,22 @@
 import os
+import sys
+import argparse
 from typing import Any
 import asyncio
 from dotenv import load_dotenv
-from ragas.metrics.base import Metric
-from langsmith.schemas import Example, Run
 from langsmith.evaluation import aevaluate
-from langchain_openai import AzureChatOpenAI, AzureOpenAIEmbeddings
 from ragas.llms import LangchainLLMWrapper
 from ragas.embeddings import LangchainEmbeddingsWrapper
 from ragas.metrics import ContextPrecision, ResponseRelevancy
-from ragas import SingleTurnSample
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from rag_common.azure_openai import create_azure_chat_openai, create_azure_openai_embeddings
+from rag_common.concurrency import set_judge_concurrency
+from rag_common.dataset_mirror import DatasetMirror
+from rag_common.embedding_cache import CachedEmbeddings
+from rag_common.ragas_evaluator import RagasEvaluator
+from rag_common.results_store import ResultsStore, resume_dataset_version
+from rag_common.score_cache import ScoreCache
 
 # .envファイルの読み込み
 load_dotenv()
@@ -19,31 +26,6 @@ os.environ["AZURE_OPENAI_API_KEY"] = os.getenv("AZURE_OPENAI_API_KEY")
 os.environ["AZURE_OPENAI_ENDPOINT"] = os.getenv("AZURE_OPENAI_ENDPOINT")
 os.environ["OPENAI_API_VERSION"] = os.getenv("OPENAI_API_VERSION")
 
-class RagasEvaluator:
-    # 対象となるMetricsを設定
-    def __init__(self, metrics:list[Metric]):
-        self.metrics = metrics
-
-    # 実際に引き渡す評価用の関数
-    # runはtargetの返り値, exampleはDatasetに登録された値を示す
-    async def evaluate(self, run: Run, example: Example) -> dict[str, Any]:
-        context_strs = run.outputs["retrieved_contexts"] #RAGシステムから得られた関連情報
-
-        single_turn_sample = SingleTurnSample(
-            user_input=example.inputs["user_input"],#テストセットから得られた質問文
-            retrieved_contexts=context_strs,
-            response=run.outputs["response"], #RAGシステムから得られた回答
-            reference=example.outputs["reference"] #テストセットから得られた真の回答
-        )
-        
-        results = []
-        # 各Metricに対して評価を実行
-        for metric in self.metrics:
-            score = await metric.single_turn_ascore(single_turn_sample)
-            results.append({"key": metric.name, "score": score})
-        
-        return results
-
 async def predict(inputs: dict[str, Any]) -> dict[str, Any]:
     return {
         # RAGからの回答(ダミー)
@@ -59,14 +41,16 @@ async def predict(inputs: dict[str, Any]) -> dict[str, Any]:
 async def main():
     dataset_name = os.getenv("DATASET_NAME")
         
-    evaluator_llm = LangchainLLMWrapper(AzureChatOpenAI(
+    evaluator_llm = LangchainLLMWrapper(create_azure_chat_openai(
         azure_deployment="gpt-4o-mini",
         temperature=0.8,
     ))
 
-    evaluator_embeddings = LangchainEmbeddingsWrapper(AzureOpenAIEmbeddings(
+    # 一度Embeddingした質問文はキャッシュから取得する
+    cached_embeddings = CachedEmbeddings(create_azure_openai_embeddings(
         azure_deployment="text-embedding-3-small-deploy"
     ))
+    evaluator_embeddings = LangchainEmbeddingsWrapper(cached_embeddings)
 
     # 評価を実行するMetricsを定義
     metrics = [
@@ -74,14 +58,54 @@ async def main():
         ResponseRelevancy(llm=evaluator_llm, embeddings=evaluator_embeddings)
     ]
 
+    # 前回までと同じサンプルに対する評価結果はキャッシュから取得する
+    score_cache = ScoreCache(bypass=args.no_score_cache)
+
+    # 評価用LLMの同時呼び出し数の上限。Exampleの並列数にも同じ値を利用する
+    set_judge_concurrency(args.max_concurrency)
+
+    # (Example, Metric)ごとの結果は完了した時点でローカルに記録する
+    # --run-idで中断した実行を指定した場合は、すべてのMetricを評価済みのExampleを除いて続きから評価する
+    # 再開時は実行の開始時に利用したスナップショットのバージョンに固定する
+    store = ResultsStore()
+    dataset_version = resume_dataset_version(store, args.run_id, args.dataset_version)
+
+    # DatasetのExampleはローカルのスナップショットから読み込む(更新されている場合は差分のみ取得する)
+    mirror = DatasetMirror(dataset_name)
+    examples = mirror.examples(version=dataset_version, refresh=not args.offline)
+    results = store.open_run(args.run_id, dataset=dataset_name, **mirror.describe(dataset_version))
+    metric_names = [metric.name for metric in metrics]
+    pending = [e for e in examples if not results.is_completed(str(e.id), metric_names)]
+    print(f"run {results.run_id}: {len(examples) - len(pending)}/{len(examples)} examples already evaluated")
     # 評価の実行
-    await aevaluate(
-        predict,
-        data=dataset_name,
-        evaluators=[
-            RagasEvaluator(metrics).evaluate
-        ],
-    )
+    if pending:
+        await aevaluate(
+            predict,
+            data=pending,
+            metadata={**mirror.describe(dataset_version), "run_id": results.run_id},
+            upload_results=not args.offline,
+            evaluators=[
+                RagasEvaluator(metrics, score_cache=score_cache, metric_timeout=args.metric_timeout,
+                               results=results).evaluate
+            ],
+            max_concurrency=args.max_concurrency,
+        )
+
+    # 中断前の結果を含めた実行全体の結果を表示する
+    print(results.summary())
+    print(results.stats)
+    print(cached_embeddings.stats)
+    print(score_cache.stats)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="LangSmith上で評価を行う")
+    parser.add_argument("--no-score-cache", action="store_true", help="評価結果のキャッシュを参照せずに評価する")
+    parser.add_argument("--max-concurrency", type=int, default=8, help="評価用LLMの同時呼び出し数の上限")
+    parser.add_argument("--metric-timeout", type=float, default=None, help="Metricごとのタイムアウト(秒)")
+    parser.add_argument("--dataset-version", type=int, default=None,
+                        help="利用するDatasetのローカルのスナップショットのバージョン(省略時は最新)")
+    parser.add_argument("--offline", action="store_true",
+                        help="LangSmithに接続せず、保存済みのスナップショットで評価する(評価結果は登録しない)")
+    parser.add_argument("--run-id", default=None, help="中断した評価の実行ID(指定した実行の続きから評価する)")
+    args = parser.parse_args()
     asyncio.run(main())
\ No newline at end of file
@@ -1,115 +1,163 @@
 import os
+import sys
+import shutil
+import argparse
 import asyncio
 from dotenv import load_dotenv
 from langsmith import Client
 from ragas.llms import LangchainLLMWrapper
 from ragas.embeddings import LangchainEmbeddingsWrapper
+from ragas.run_config import RunConfig
 from ragas.testset import TestsetGenerator
 from ragas.testset.persona import Persona
-from langchain_openai import AzureChatOpenAI, AzureOpenAIEmbeddings
 from langchain_community.document_loaders import DirectoryLoader
 from ragas.testset.synthesizers import SingleHopSpecificQuerySynthesizer
 from ragas.testset.transforms.extractors.llm_based import NERExtractor
 from ragas.testset.transforms.splitters import HeadlineSplitter
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from rag_common.azure_openai import create_azure_chat_openai, create_azure_openai_embeddings
+from rag_common.knowledge_graph_cache import adapt_prompts, build_knowledge_graph
+from rag_common.paths import cache_path
+from rag_common.testset_checkpoint import TestsetCheckpoint, is_finished
+
 load_dotenv()
 
 os.environ["AZURE_OPENAI_API_KEY"] = os.getenv("AZURE_OPENAI_API_KEY")
 os.environ["AZURE_OPENAI_ENDPOINT"] = os.getenv("AZURE_OPENAI_ENDPOINT")
 os.environ["OPENAI_API_VERSION"] = os.getenv("OPENAI_API_VERSION")
 
-async def main():
-    
-    generator_llm = LangchainLLMWrapper(AzureChatOpenAI(
+
+# Ragasで生成したテストセットの1件をLangSmithのExampleの形式に変換する
+def to_example(testset_record: dict) -> dict:
+    return {
+        "inputs": {
+            "user_input": testset_record["user_input"]
+        },
+        "outputs": {
+            "reference_contexts": testset_record["reference_contexts"],
+            "reference": testset_record["reference"]
+        },
+        # metadataとして今回はRagasの持つsynthesizerの情報を付与
+        "metadata": {
+            "synthesizer_name": testset_record["synthesizer_name"]
+        },
+    }
+
+
+# 未登録の行をbatch_size件ずつDatasetへ登録する(final=Falseの場合はbatch_sizeに満たない残りは次回に回す)
+def upload_pending(client: Client, dataset_name: str, checkpoint: TestsetCheckpoint, batch_size: int, final: bool):
+    rows = checkpoint.pending_rows()
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        if len(batch) < batch_size and not final:
+            break
+        ids = [checkpoint.example_id(shard, i) for shard, i, _ in batch]
+        # 前回の実行で登録済みだがstate.jsonに記録される前に中断したExampleは登録しない
+        existing = {str(e.id) for e in client.list_examples(dataset_name=dataset_name, example_ids=ids)}
+        new = [(example_id, row) for example_id, (_, _, row) in zip(ids, batch) if example_id not in existing]
+        if new:
+            client.create_examples(
+                inputs=[row["inputs"] for _, row in new],
+                outputs=[row["outputs"] for _, row in new],
+                metadata=[row["metadata"] for _, row in new],
+                ids=[example_id for example_id, _ in new],
+                dataset_name=dataset_name
+            )
+        checkpoint.mark_uploaded(batch)
+        print(f"uploaded {checkpoint.uploaded_count} examples")
+
+
+async def main(args):
+    dataset_name = os.getenv("DATASET_NAME")
+    checkpoint_dir = args.checkpoint_dir or cache_path(os.path.join("testsets", dataset_name))
+    # 途中で中断したチェックポイントのみ再開し、前回の生成・登録が終わっている場合は新しいテストセットを生成する
+    if os.path.exists(checkpoint_dir) and not args.restart and is_finished(checkpoint_dir):
+        print(f"previous testset in {checkpoint_dir} was fully generated and uploaded; generating a new testset")
+        args.restart = True
+    if args.restart and os.path.exists(checkpoint_dir):
+        shutil.rmtree(checkpoint_dir)
+    checkpoint = TestsetCheckpoint(checkpoint_dir, args.testset_size, args.shard_size)
+
+    # シャード内で同時に実行するLLMの呼び出し数はmax_workersまでとする
+    run_config = RunConfig(max_workers=args.max_workers)
+
+    generator_llm = LangchainLLMWrapper(create_azure_chat_openai(
         azure_deployment="gpt-4o-mini-deploy",
         temperature=0.8,
     ))
 
-    generator_embeddings = LangchainEmbeddingsWrapper(AzureOpenAIEmbeddings(
+    generator_embeddings = LangchainEmbeddingsWrapper(create_azure_openai_embeddings(
         azure_deployment="text-embedding-3-small-deploy"
     ))
 
-    generator = TestsetGenerator(llm=generator_llm, embedding_model=generator_embeddings)
-
     # 対象ファイルの読み込み
     loader = DirectoryLoader("rag_source_docs/", glob="syugyo-kisoku.txt")
     docs = loader.load()
-    
+
     personas = [
         Persona(
             name="Employee",
             role_description="様々な社内規約について知りたい社員",
             )
     ]
-    
-    # Generator初期化時に各モデルとペルソナ情報を引数として渡す
+
+    transforms = [HeadlineSplitter(), NERExtractor(llm=generator_llm)]
+
+    # Generator初期化時に各モデルとペルソナ情報、作成済みのナレッジグラフを引数として渡す
+    # ナレッジグラフはドキュメントごとにキャッシュし、追加・変更されたドキュメントのみtransformsを適用する
     generator = TestsetGenerator(
-        llm=generator_llm, embedding_model=generator_embeddings, persona_list=personas
+        llm=generator_llm, embedding_model=generator_embeddings, persona_list=personas,
+        knowledge_graph=build_knowledge_graph(docs, transforms, run_config, args.knowledge_graph_cache_dir),
     )
-    
-    transforms = [HeadlineSplitter(), NERExtractor(llm=generator_llm)]
-    
 
     distribution = [
         (SingleHopSpecificQuerySynthesizer(llm=generator_llm), 1.0),
     ]
 
-    # 日本語化対応
+    # 日本語化対応(変換済みのプロンプトはキャッシュから読み込む)
     for query, _ in distribution:
-        prompts = await query.adapt_prompts("japanese", llm=generator_llm)
+        prompts = await adapt_prompts(query, "japanese", llm=generator_llm)
         query.set_prompts(**prompts)
 
-    # テストセット生成
-    dataset = generator.generate_with_langchain_docs(
-        docs[:],
-        testset_size=5, #生成するテストセットの数
-        transforms=transforms,
-        query_distribution=distribution,
-    )   
-
-    df = dataset.to_pandas()
-    dataset_name = os.getenv("DATASET_NAME")
-    
     # LangSmithクライアントを構築
     client = Client()
     if client.has_dataset(dataset_name=dataset_name):
         client.read_dataset(dataset_name=dataset_name)
     else:
         client.create_dataset(dataset_name=dataset_name)
-    
-    # 利用するパラメータの初期化
-    inputs = []
-    outputs = []
-    metadatas = []
-
-    # Ragasで生成したテストセット(df)から内容を読み取り、パラメータに追加
-    for _, testset_record in df.iterrows():
-        inputs.append(
-            {
-                "user_input": testset_record['user_input']
-            }
-        )
-        outputs.append(
-            {
-                "reference_contexts": testset_record['reference_contexts'],
-                "reference": testset_record['reference']
-            }
-        )
-        # metadataとして今回はRagasの持つsynthesizerの情報を付与
-        metadatas.append(
-            {
-                "synthesizer_name": testset_record['synthesizer_name']
-            }
+
+    # 前回の実行で生成済み・未登録の行があれば先に登録する
+    upload_pending(client, dataset_name, checkpoint, args.upload_batch_size, final=False)
+
+    # シャードごとにテストセットを生成し、生成が終わるたびにファイルへ保存する
+    # AzureChatOpenAIの非同期クライアントを同じイベントループで使い続けるため、シャードは順に生成する
+    shard_sizes = checkpoint.shard_sizes
+    pending = checkpoint.pending_shards()
+    print(f"{len(shard_sizes) - len(pending)}/{len(shard_sizes)} shards already generated")
+    for shard in pending:
+        dataset = generator.generate(
+            testset_size=shard_sizes[shard],
+            query_distribution=distribution,
+            run_config=run_config,
         )
-        
-     # Datasetへの登録   
-    client.create_examples(
-        inputs=inputs,
-        outputs=outputs,
-        metadata=metadatas,
-        dataset_name=dataset_name
-    )
+        checkpoint.save_shard(shard, [to_example(record) for record in dataset.to_list()])
+        print(f"shard {shard + 1}/{len(shard_sizes)} generated")
+
+        # Datasetへの登録(batch_size件たまるごとに登録する)
+        upload_pending(client, dataset_name, checkpoint, args.upload_batch_size, final=False)
+
+    upload_pending(client, dataset_name, checkpoint, args.upload_batch_size, final=True)
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="テストセットを生成してLangSmithのDatasetに登録する")
+    parser.add_argument("--testset-size", type=int, default=5, help="生成するテストセットの数")
+    parser.add_argument("--shard-size", type=int, default=50, help="1シャードで生成するテストセットの数")
+    parser.add_argument("--max-workers", type=int, default=8, help="同時に実行するLLMの呼び出し数")
+    parser.add_argument("--upload-batch-size", type=int, default=100, help="Datasetへ1度に登録するExampleの数")
+    parser.add_argument("--checkpoint-dir", help="途中経過の保存先(省略時は.cache/testsets/<DATASET_NAME>)")
+    parser.add_argument("--restart", action="store_true", help="途中経過を破棄して最初から生成する")
+    parser.add_argument("--knowledge-graph-cache-dir",
+                        help="ナレッジグラフのキャッシュの保存先(省略時は.cache/knowledge_graphs)")
+    asyncio.run(main(parser.parse_args()))
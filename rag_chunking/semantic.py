@@ -1,24 +1,32 @@
 import os
+import sys
 from azure.search.documents.indexes import SearchIndexClient
-from azure.search.documents import SearchClient
 from azure.core.credentials import AzureKeyCredential
 from azure.search.documents.indexes.models import *
-from ragas.embeddings import LangchainEmbeddingsWrapper
-from langchain_openai import AzureOpenAIEmbeddings
-from langchain_experimental.text_splitter import SemanticChunker
 from dotenv import load_dotenv
-from azure.ai.documentintelligence import DocumentIntelligenceClient
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from rag_common.azure_openai import create_azure_openai_embeddings
+from rag_common.document_intelligence import analyze_document
+from rag_common.incremental import IndexManifest, sync_chunks
+from rag_common.search import create_search_client, index_embeddings, use_local_index
+from rag_common.embedding_cache import CachedEmbeddings
+from rag_common.semantic_chunker import JAPANESE_SENTENCE_SPLIT_REGEX, FastSemanticChunker
 
 filepath = "../rag_source_docs/syugyo-kisoku.pdf"  # 対象ファイルパス
 
 # .envファイルの読み込み
 load_dotenv()
 
-search_endpoint = os.environ["SEARCH_SERVICE_ENDPOINT"]
-search_api_key = os.environ["SEARCH_API_KEY"]
+search_endpoint = os.getenv("SEARCH_SERVICE_ENDPOINT")
+search_api_key = os.getenv("SEARCH_API_KEY")
 
 #インデックスの作成
 def create_index():
+    # ローカルのインデックスを利用する場合はインデックスの定義は不要
+    if use_local_index():
+        return
+
     client = SearchIndexClient(endpoint= search_endpoint, credential=AzureKeyCredential(search_api_key))
     name = "docs_semantic_chunking"
 
@@ -37,46 +45,37 @@ def create_index():
     index = SearchIndex(name=name, fields=fields)
     client.create_index(index)
 
+    # 新しく作成したインデックスには何も登録されていないため、登録済みの記録を削除する
+    IndexManifest(name).clear()
+
 def extract_text_from_docs(filepath):
-    load_dotenv()  # Load environment variables from .env file
-    endpoint = os.getenv("AZURE_FORM_RECOGNIZER_ENDPOINT")
-    key = os.getenv("AZURE_FORM_RECOGNIZER_KEY")
-
-    client = DocumentIntelligenceClient(endpoint=endpoint, credential=AzureKeyCredential(key))
-    with open(filepath, "rb") as f:
-        poller = client.begin_analyze_document(
-            model_id="prebuilt-layout",
-            body=f,
-            content_type="application/octet-stream"
-        )
-        content = poller.result().content
-    return content
+    # DocumentIntelligenceで解析する。同じファイル・同じ設定での解析結果はキャッシュから取得する
+    result = analyze_document(filepath, model_id="prebuilt-layout")
+    return result.content
 
 def create_chunk(content):
-    text_splitter = SemanticChunker(
-        LangchainEmbeddingsWrapper(
-            AzureOpenAIEmbeddings(
+    # 文の分割・Embedding・距離の計算をまとめて行うチャンカーで分割する
+    text_splitter = FastSemanticChunker(
+        # 一度Embeddingした文はキャッシュから取得する
+        CachedEmbeddings(
+            create_azure_openai_embeddings(
                 azure_deployment=os.getenv("EMBEDDING_DEPLOYMENT_NAME")
             )
         ),
-        sentence_split_regex=r"(?<=[。！？\.\?\\n])\s*|\n",  # Adjusted regex for Japanese sentence boundaries
+        sentence_split_regex=JAPANESE_SENTENCE_SPLIT_REGEX,
         min_chunk_size=100
     )
     docs = text_splitter.create_documents([content])
     return docs
 
-def index_docs(chunks: list):
-    searchClient = SearchClient(
-        endpoint=search_endpoint,
-        index_name="docs_semantic_chunking",
-        credential=AzureKeyCredential(search_api_key)
-    )
+def index_docs(chunks: list, filepath: str):
+    # LOCAL_INDEX_DIRが設定されている場合はローカルのインデックスに書き込む
+    searchClient = create_search_client("docs_semantic_chunking")
 
-    # チャンク化されたテキストとそのテキストのベクトルをAzure AI Searchにアップロードする
-    for i, chunk in enumerate(chunks):
-        document = {"id": str(i), "content": chunk.page_content}
-        searchClient.upload_documents([document])
-        print(i)
+    # チャンクの内容から作成したIDで、前回から追加・削除されたチャンクのみをAzure AI Searchに反映する
+    with searchClient:
+        stats = sync_chunks(searchClient, "docs_semantic_chunking", filepath, [chunk.page_content for chunk in chunks], embeddings=index_embeddings())
+    print(stats)
 
 def main():
     # インデックスを作成する
@@ -89,7 +88,7 @@ def main():
     chunks = create_chunk(content)
     
     # テキストをAzure AI Searchにインデックスする
-    index_docs(chunks)
+    index_docs(chunks, filepath)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
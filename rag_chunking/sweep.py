@@ -0,0 +1,158 @@
+import os
+import re
+import sys
+import json
+import hashlib
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from dotenv import load_dotenv
+from langchain.text_splitter import MarkdownHeaderTextSplitter, RecursiveCharacterTextSplitter
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from rag_common.document_intelligence import analyze_document
+from rag_common.incremental import IndexManifest, sync_chunks
+from rag_common.search import create_search_client, ensure_index, index_embeddings
+from rag_common.streaming import iter_pdf_pages
+
+# .envファイルの読み込み
+load_dotenv()
+
+# 試行するチャンキングの種類とパラメータの組み合わせ(--gridで同じ形式のJSONファイルを指定できる)
+DEFAULT_GRID = {
+    "recursive": {
+        "chunk_size": [500, 1000, 1500],
+        "chunk_overlap": [0, 128],
+        "separators": [["\n\n", "\n", "。", "、", " ", ""]],
+    },
+    "markdown": {
+        "headers_to_split_on": [[["#", "Header 1"], ["##", "Header 2"], ["###", "Header 3"]]],
+    },
+    "semantic": {
+        "breakpoint_threshold_type": ["percentile"],
+        "breakpoint_threshold_amount": [90, 95],
+        "min_chunk_size": [100],
+        "max_chunk_size": [2000],
+    },
+}
+
+
+# グリッドを(チャンキングの種類, パラメータ)の一覧に展開する
+def expand_grid(grid: dict) -> list[tuple[str, dict]]:
+    configs = []
+    for splitter, params in grid.items():
+        names = list(params)
+        for values in itertools.product(*(params[name] for name in names)):
+            configs.append((splitter, dict(zip(names, values))))
+    return configs
+
+
+# パラメータから一意なインデックス名を作成する
+# 名前にはスカラー値のみを含め、リスト等を含むすべてのパラメータのハッシュを末尾に付けて区別する
+# Azure AI Searchのインデックス名は英小文字・数字・ダッシュのみ(先頭・末尾・連続のダッシュは不可)、128文字まで
+def index_name(prefix: str, splitter: str, params: dict) -> str:
+    values = [str(v) for v in params.values() if isinstance(v, (int, float, str))]
+    parts = [re.sub(r"[^a-z0-9]+", "-", part.lower()).strip("-") for part in [prefix, splitter, *values]]
+    digest = hashlib.sha256(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()[:8]
+    return f"{'-'.join(part for part in parts if part)[:119].rstrip('-')}-{digest}"
+
+
+def extract_text(filepath: str, extractor: str) -> str:
+    if extractor == "pypdf":
+        return "".join(iter_pdf_pages(filepath))
+    return analyze_document(filepath, model_id="prebuilt-layout", output_content_format="markdown").content
+
+
+# ワーカープロセスで実行するチャンク化処理
+def create_chunk(splitter: str, params: dict, content: str) -> list[str]:
+    if splitter == "recursive":
+        text_splitter = RecursiveCharacterTextSplitter(**params)
+        return text_splitter.split_text(content)
+    if splitter == "markdown":
+        text_splitter = MarkdownHeaderTextSplitter([tuple(h) for h in params["headers_to_split_on"]])
+        return [doc.page_content for doc in text_splitter.split_text(content)]
+    if splitter == "semantic":
+        from rag_common.azure_openai import create_azure_openai_embeddings
+        from rag_common.embedding_cache import CachedEmbeddings
+        from rag_common.semantic_chunker import FastSemanticChunker
+
+        text_splitter = FastSemanticChunker(
+            CachedEmbeddings(
+                create_azure_openai_embeddings(
+                    azure_deployment=os.getenv("EMBEDDING_DEPLOYMENT_NAME")
+                )
+            ),
+            **params
+        )
+        return [doc.page_content for doc in text_splitter.create_documents([content])]
+    raise ValueError(f"Unknown splitter: {splitter}")
+
+
+def size_distribution(chunks: list[str]) -> dict:
+    if not chunks:
+        return {"count": 0}
+    sizes = np.array([len(c) for c in chunks])
+    return {
+        "count": len(chunks),
+        "min": int(sizes.min()),
+        "mean": round(float(sizes.mean()), 1),
+        "p50": int(np.percentile(sizes, 50)),
+        "p95": int(np.percentile(sizes, 95)),
+        "max": int(sizes.max()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="チャンキングのパラメータを変えて複数のインデックスを作成する")
+    parser.add_argument("--source", nargs="+", default=["../rag_source_docs/syugyo-kisoku.pdf"], help="対象ファイルパス")
+    parser.add_argument("--grid", type=str, default=None, help="チャンキングの種類とパラメータを定義したJSONファイル")
+    parser.add_argument("--extractor", choices=["document_intelligence", "pypdf"], default="document_intelligence")
+    parser.add_argument("--index-prefix", type=str, default="sweep", help="作成するインデックス名の接頭辞")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="チャンク化を行うプロセス数")
+    parser.add_argument("--manifest", type=str, default="./sweep_manifest.json", help="結果を出力するファイルパス")
+    args = parser.parse_args()
+
+    grid = DEFAULT_GRID
+    if args.grid:
+        with open(args.grid, encoding="utf-8") as f:
+            grid = json.load(f)
+    configs = expand_grid(grid)
+
+    # 各ファイルからのテキスト抽出は1度だけ行い、全ての組み合わせで共有する
+    contents = {source: extract_text(source, args.extractor) for source in args.source}
+
+    results = []
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = {
+            executor.submit(create_chunk, splitter, params, content): (splitter, params, source)
+            for splitter, params in configs
+            for source, content in contents.items()
+        }
+        # チャンク化が終わったものから順にインデックスへ登録する
+        for future in as_completed(futures):
+            splitter, params, source = futures[future]
+            name = index_name(args.index_prefix, splitter, params)
+            chunks = future.result()
+
+            if ensure_index(name):
+                IndexManifest(name).clear()
+            with create_search_client(name) as searchClient:
+                stats = sync_chunks(searchClient, name, source, chunks, embeddings=index_embeddings())
+            print(f"{name} ({os.path.basename(source)}): {stats}")
+
+            results.append({
+                "index_name": name,
+                "source": os.path.basename(source),
+                "splitter": splitter,
+                "params": params,
+                "chunks": size_distribution(chunks),
+            })
+
+    results.sort(key=lambda r: (r["index_name"], r["source"]))
+    with open(args.manifest, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"{len(results)} chunk sets written to {args.manifest}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1 @@
+# rag_sample / rag_chunking / evaluation / langsmith の各スクリプトから共通で利用する処理をまとめたパッケージ
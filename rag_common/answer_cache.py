@@ -0,0 +1,177 @@
+# 質問に対する回答をSQLiteに保存して再利用するキャッシュ
+# 正規化した質問文の完全一致で検索し、見つからない場合は質問文のEmbeddingのコサイン類似度がthreshold以上の回答を利用する
+# 回答はインデックスのバージョンと紐づけて保存し、インデックスが更新された場合やttlを過ぎた場合は利用しない
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import Any, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from rag_common.paths import cache_path
+
+DEFAULT_TTL = 24 * 60 * 60
+DEFAULT_THRESHOLD = 0.95
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+# 全角・半角、大文字・小文字、空白、末尾の句読点の違いを無視する
+def normalize_question(question: str) -> str:
+    text = re.sub(r"\s+", "", unicodedata.normalize("NFKC", question).lower())
+    return re.sub(r"[。.、,?!]+$", "", text)
+
+
+class AnswerCache:
+    # namespaceにはインデックス名・LLMのデプロイメント名等、回答に影響する設定を含める
+    # embeddingsを省略した場合は完全一致のみで検索する
+    def __init__(self, namespace: str, embeddings: Optional[Embeddings] = None,
+                 threshold: float = DEFAULT_THRESHOLD, ttl: float = DEFAULT_TTL,
+                 path: Optional[str] = None, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.namespace = namespace
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # 類似度検索用に、有効なバージョンの質問ベクトルをメモリ上に保持する
+        self._version = None
+        self._keys: list[str] = []
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+        self._conn = sqlite3.connect(path or cache_path("answers.sqlite"), check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            "key TEXT PRIMARY KEY, namespace TEXT, index_version TEXT, question TEXT, "
+            "vector BLOB, answer TEXT, size INTEGER, created REAL, last_used REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS answers_last_used ON answers(last_used)")
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM answers").fetchone()[0]
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.exact_hits + self.semantic_hits + self.misses
+        return (self.exact_hits + self.semantic_hits) / total if total else 0.0
+
+    @property
+    def stats(self) -> str:
+        return (f"answer cache: exact_hits={self.exact_hits} semantic_hits={self.semantic_hits} "
+                f"misses={self.misses} hit_rate={self.hit_rate:.1%}")
+
+    def _key(self, question: str) -> str:
+        return hashlib.sha256(f"{self.namespace}\0{normalize_question(question)}".encode("utf-8")).hexdigest()
+
+    # バージョンが変わった場合は古いバージョンの回答を削除し、質問ベクトルを読み込み直す
+    def _load(self, version: str):
+        if self._version == version:
+            return
+        rows = self._conn.execute(
+            "SELECT key, size FROM answers WHERE namespace = ? AND index_version != ?", (self.namespace, version)
+        ).fetchall()
+        if rows:
+            self._conn.executemany("DELETE FROM answers WHERE key = ?", [(k,) for k, _ in rows])
+            self._total_bytes -= sum(size for _, size in rows)
+            self._conn.commit()
+        rows = self._conn.execute(
+            "SELECT key, vector FROM answers WHERE namespace = ? AND vector IS NOT NULL", (self.namespace,)
+        ).fetchall()
+        self._version = version
+        self._keys = [k for k, _ in rows]
+        self._matrix = (np.vstack([np.frombuffer(v, dtype=np.float32) for _, v in rows])
+                        if rows else np.zeros((0, 0), dtype=np.float32))
+
+    def _fetch(self, key: str) -> Optional[dict[str, Any]]:
+        row = self._conn.execute("SELECT answer, created FROM answers WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] < time.time() - self.ttl:
+            return None
+        self._conn.execute("UPDATE answers SET last_used = ? WHERE key = ?", (time.time(), key))
+        self._conn.commit()
+        return json.loads(row[0])
+
+    def _lookup_exact(self, question: str, version: str) -> Optional[dict[str, Any]]:
+        with self._lock:
+            self._load(version)
+            result = self._fetch(self._key(question))
+        if result is not None:
+            self.exact_hits += 1
+        return result
+
+    def _lookup_similar(self, vector: np.ndarray) -> Optional[dict[str, Any]]:
+        with self._lock:
+            if len(self._keys):
+                similarities = self._matrix @ vector
+                # ttlを過ぎた回答は除外し、類似度の高い順に確認する
+                for i in np.argsort(-similarities):
+                    if similarities[i] < self.threshold:
+                        break
+                    result = self._fetch(self._keys[i])
+                    if result is not None:
+                        self.semantic_hits += 1
+                        return result
+        self.misses += 1
+        return None
+
+    @staticmethod
+    def _normalize(vector: list[float]) -> np.ndarray:
+        array = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(array)
+        return array / norm if norm else array
+
+    # キャッシュにある回答と、保存時に再利用する質問ベクトルを返す
+    def get(self, question: str, version: str) -> tuple[Optional[dict[str, Any]], Optional[np.ndarray]]:
+        result = self._lookup_exact(question, version)
+        if result is not None or self.embeddings is None:
+            self.misses += result is None
+            return result, None
+        vector = self._normalize(self.embeddings.embed_query(normalize_question(question)))
+        return self._lookup_similar(vector), vector
+
+    async def aget(self, question: str, version: str) -> tuple[Optional[dict[str, Any]], Optional[np.ndarray]]:
+        result = self._lookup_exact(question, version)
+        if result is not None or self.embeddings is None:
+            self.misses += result is None
+            return result, None
+        vector = self._normalize(await self.embeddings.aembed_query(normalize_question(question)))
+        return self._lookup_similar(vector), vector
+
+    def set(self, question: str, version: str, result: dict[str, Any], vector: Optional[np.ndarray] = None):
+        key = self._key(question)
+        answer = json.dumps(result, ensure_ascii=False)
+        blob = vector.astype(np.float32).tobytes() if vector is not None else None
+        size = len(answer.encode("utf-8")) + len(question.encode("utf-8")) + (len(blob) if blob else 0)
+        now = time.time()
+        with self._lock:
+            self._load(version)
+            previous = self._conn.execute("SELECT size FROM answers WHERE key = ?", (key,)).fetchone()
+            if previous:
+                self._total_bytes -= previous[0]
+            self._conn.execute("INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                               (key, self.namespace, version, question, blob, answer, size, now, now))
+            self._total_bytes += size
+            evicted = self._evict()
+            self._conn.commit()
+            if evicted or previous:
+                self._version = None
+                self._load(version)
+            elif vector is not None:
+                self._keys.append(key)
+                self._matrix = (np.vstack([self._matrix, vector[None, :]])
+                                if self._matrix.size else vector[None, :].astype(np.float32))
+
+    # 合計サイズがmax_bytesを超えた場合は、最後に利用された時刻が古いものから削除する
+    def _evict(self) -> bool:
+        evicted = False
+        while self._total_bytes > self.max_bytes:
+            rows = self._conn.execute("SELECT key, size FROM answers ORDER BY last_used LIMIT 64").fetchall()
+            if not rows:
+                break
+            self._conn.executemany("DELETE FROM answers WHERE key = ?", [(k,) for k, _ in rows])
+            self._total_bytes -= sum(size for _, size in rows)
+            evicted = True
+        return evicted
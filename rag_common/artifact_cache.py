@@ -0,0 +1,93 @@
+# 複数のMetricが同じサンプルに対して行う同じLLMの呼び出し(回答・正解の文への分解、文と文脈の判定等)を1度にまとめるキャッシュ
+# Faithfulness / NoiseSensitivity(relevant, irrelevant)は、いずれもresponseをstatement_promptで文に分解してから判定するため、
+# 同じサンプルを評価すると同じ分解を複数回LLMに依頼することになる
+# キーはプロンプトに入力を埋め込んだ文字列(指示・例示・言語を含む)と評価用LLMのデプロイメント名・温度から作成する
+import asyncio
+import hashlib
+import json
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Optional
+
+from ragas.metrics.base import Metric
+from ragas.prompt import PydanticPrompt
+
+DEFAULT_MAX_ENTRIES = 4096
+
+
+def _llm_config(llm) -> dict:
+    llm = getattr(llm, "langchain_llm", llm)
+    return {
+        "llm": getattr(llm, "deployment_name", None) or getattr(llm, "model_name", None) or type(llm).__name__,
+        "temperature": getattr(llm, "temperature", None),
+    }
+
+
+class ArtifactCache:
+    # 同じキーの処理が実行中の場合は、その完了を待って同じ結果を返す(Metricは並列に評価されるため)
+    # 保持する結果はmax_entries件までとし、最後に利用された時刻が古いものから削除する
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, asyncio.Task] = OrderedDict()
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    @property
+    def stats(self) -> str:
+        return f"artifact cache: hits={self.hits} misses={self.misses} hit_rate={self.hit_rate:.1%}"
+
+    # 処理は呼び出し元とは別のタスクで実行し、呼び出し元のMetricがタイムアウトしても他のMetricは結果を受け取れるようにする
+    async def get_or_create(self, key: str, create: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._entries.get(key)
+        if task is not None:
+            self.hits += 1
+            self._entries.move_to_end(key)
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(create())
+            task.add_done_callback(lambda t: self._discard_failed(key, t))
+            self._entries[key] = task
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return await asyncio.shield(task)
+
+    # 失敗した結果は保持せず、次の呼び出しで再実行する
+    def _discard_failed(self, key: str, task: asyncio.Task):
+        if (task.cancelled() or task.exception() is not None) and self._entries.get(key) is task:
+            del self._entries[key]
+
+    def key(self, prompt: PydanticPrompt, llm, data, temperature: Optional[float] = None) -> str:
+        text = json.dumps({"prompt": prompt.to_string(data), "temperature": temperature, **_llm_config(llm)},
+                          ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+# metricsの各プロンプトのgenerateを、同じ入力・同じLLMの呼び出しをArtifactCacheで共有するように置き換える
+# プロンプトのオブジェクト自体は置き換えないため、get_prompts / adapt_prompts / ScoreCacheのキーには影響しない
+# 置き換えは呼び出し元のプロンプトのオブジェクトに対して行うため、set_prompts(日本語化等)で差し替えたプロンプトには適用されない
+# RagasEvaluatorは評価の直前に毎回呼び出し、差し替えられたプロンプトにも適用する(適用済みのプロンプトは何もしない)
+def share_prompts(metrics: list[Metric], cache: ArtifactCache) -> list[Metric]:
+    for metric in metrics:
+        get_prompts = getattr(metric, "get_prompts", None)
+        if get_prompts is None:
+            continue
+        for prompt in get_prompts().values():
+            if getattr(prompt, "_shared_cache", None) is cache:
+                continue
+            prompt._shared_cache = cache
+            prompt.generate = _cached_generate(prompt, prompt.generate, cache)
+    return metrics
+
+
+def _cached_generate(prompt: PydanticPrompt, generate, cache: ArtifactCache):
+    async def cached_generate(llm, data, temperature=None, stop=None, callbacks=None, retries_left=3):
+        return await cache.get_or_create(
+            cache.key(prompt, llm, data, temperature),
+            lambda: generate(llm=llm, data=data, temperature=temperature, stop=stop,
+                             callbacks=callbacks, retries_left=retries_left),
+        )
+    return cached_generate
@@ -0,0 +1,22 @@
+# レート制限を適用したAzure OpenAIのクライアントを作成する
+# プロジェクト内でAzureChatOpenAI / AzureOpenAIEmbeddingsを作成する場合はこちらを利用する
+import httpx
+from langchain_openai import AzureChatOpenAI, AzureOpenAIEmbeddings
+
+from rag_common.rate_limit import AsyncRateLimitedTransport, RateLimitedTransport, get_rate_limiter
+
+
+def _http_clients() -> dict:
+    limiter = get_rate_limiter()
+    return {
+        "http_client": httpx.Client(transport=RateLimitedTransport(limiter)),
+        "http_async_client": httpx.AsyncClient(transport=AsyncRateLimitedTransport(limiter)),
+    }
+
+
+def create_azure_chat_openai(**kwargs) -> AzureChatOpenAI:
+    return AzureChatOpenAI(**kwargs, **_http_clients())
+
+
+def create_azure_openai_embeddings(**kwargs) -> AzureOpenAIEmbeddings:
+    return AzureOpenAIEmbeddings(**kwargs, **_http_clients())
@@ -0,0 +1,26 @@
+# プロセス全体で共有する評価用LLM(judge)呼び出しの同時実行数の上限
+import asyncio
+import os
+
+DEFAULT_JUDGE_CONCURRENCY = int(os.getenv("JUDGE_MAX_CONCURRENCY", "8"))
+
+_judge_concurrency = DEFAULT_JUDGE_CONCURRENCY
+_judge_semaphore = None
+
+
+def set_judge_concurrency(max_concurrency: int):
+    global _judge_concurrency, _judge_semaphore
+    _judge_concurrency = max_concurrency
+    _judge_semaphore = None
+
+
+def get_judge_concurrency() -> int:
+    return _judge_concurrency
+
+
+# 全ての評価処理で同じセマフォを利用することで、Example単位の並列数に関係なく同時実行数を抑える
+def judge_semaphore() -> asyncio.Semaphore:
+    global _judge_semaphore
+    if _judge_semaphore is None:
+        _judge_semaphore = asyncio.Semaphore(_judge_concurrency)
+    return _judge_semaphore
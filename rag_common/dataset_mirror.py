@@ -0,0 +1,163 @@
+# LangSmithのDatasetのExampleをローカルにParquet形式で保存し、評価の開始時にダウンロードせずに利用する
+# Datasetが更新されている場合は前回の保存時点からの差分(追加・変更・削除されたExample)のみ取得し、新しいバージョンとして保存する
+# ネットワークに接続できない場合は保存済みの最新バージョンを利用する
+import json
+import os
+import time
+from typing import Any, Optional
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from langsmith import Client
+from langsmith.schemas import Example
+from langsmith.utils import LangSmithError
+
+from rag_common.paths import cache_path
+
+SNAPSHOT_FILE = "v{:05d}.parquet"
+DEFAULT_KEEP_VERSIONS = 5
+# list_examplesで1度に指定するExampleのIDの数(IDはクエリ文字列で送られるため分割する)
+FETCH_BATCH_SIZE = 100
+
+# inputs / outputs / metadataは形式がDatasetごとに異なるため、JSON文字列の列として保存する
+SCHEMA = pa.schema([
+    ("id", pa.string()),
+    ("dataset_id", pa.string()),
+    ("inputs", pa.string()),
+    ("outputs", pa.string()),
+    ("metadata", pa.string()),
+    ("created_at", pa.timestamp("us", tz="UTC")),
+    ("modified_at", pa.timestamp("us", tz="UTC")),
+])
+
+
+def _to_row(example: Example) -> dict[str, Any]:
+    return {
+        "id": str(example.id),
+        "dataset_id": str(example.dataset_id),
+        "inputs": json.dumps(example.inputs, ensure_ascii=False),
+        "outputs": json.dumps(example.outputs, ensure_ascii=False),
+        "metadata": json.dumps(example.metadata, ensure_ascii=False),
+        "created_at": example.created_at,
+        "modified_at": example.modified_at or example.created_at,
+    }
+
+
+def _to_example(row: dict[str, Any]) -> Example:
+    return Example(
+        id=row["id"],
+        dataset_id=row["dataset_id"],
+        inputs=json.loads(row["inputs"]),
+        outputs=json.loads(row["outputs"]),
+        metadata=json.loads(row["metadata"]),
+        created_at=row["created_at"],
+        modified_at=row["modified_at"],
+    )
+
+
+class DatasetMirror:
+    # clientを省略した場合はrefreshの実行時にlangsmith.Clientを作成する
+    def __init__(self, dataset_name: str, client: Optional[Client] = None, path: Optional[str] = None,
+                 keep_versions: int = DEFAULT_KEEP_VERSIONS):
+        self.dataset_name = dataset_name
+        self.client = client
+        self.keep_versions = keep_versions
+        self.path = path or cache_path(os.path.join("datasets", dataset_name))
+        os.makedirs(self.path, exist_ok=True)
+        self.manifest_path = os.path.join(self.path, "manifest.json")
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, encoding="utf-8") as f:
+                self.versions: list[dict[str, Any]] = json.load(f)["versions"]
+        else:
+            self.versions = []
+
+    @property
+    def latest(self) -> Optional[dict[str, Any]]:
+        return self.versions[-1] if self.versions else None
+
+    # Datasetの更新日時が前回の保存時から変わっていなければExampleは取得しない
+    def refresh(self) -> int:
+        client = self.client or Client()
+        dataset = client.read_dataset(dataset_name=self.dataset_name)
+        modified_at = (dataset.modified_at or dataset.created_at).isoformat()
+        latest = self.latest
+        if latest and latest["dataset_id"] == str(dataset.id) and latest["dataset_modified_at"] == modified_at:
+            return latest["version"]
+        rows = self._fetch(client, str(dataset.id), modified_at)
+        return self._write(str(dataset.id), modified_at, rows)
+
+    def _fetch(self, client: Client, dataset_id: str, modified_at: str) -> dict[str, dict[str, Any]]:
+        latest = self.latest
+        if latest is None or latest["dataset_id"] != dataset_id:
+            return {row["id"]: row for row in map(_to_row, client.list_examples(dataset_id=dataset_id))}
+        rows = {row["id"]: row for row in self._read(latest["version"]).to_pylist()}
+        try:
+            diff = client.diff_dataset_versions(
+                dataset_id, from_version=latest["dataset_modified_at"], to_version=modified_at
+            )
+        except LangSmithError:
+            # 差分を取得できない場合はすべてのExampleを取得し直す
+            return {row["id"]: row for row in map(_to_row, client.list_examples(dataset_id=dataset_id))}
+        for example_id in diff.examples_removed:
+            rows.pop(str(example_id), None)
+        changed = [*diff.examples_added, *diff.examples_modified]
+        for start in range(0, len(changed), FETCH_BATCH_SIZE):
+            ids = changed[start:start + FETCH_BATCH_SIZE]
+            for example in client.list_examples(dataset_id=dataset_id, example_ids=ids):
+                rows[str(example.id)] = _to_row(example)
+        print(f"dataset mirror: {len(diff.examples_added)} added, {len(diff.examples_modified)} modified, "
+              f"{len(diff.examples_removed)} removed")
+        return rows
+
+    def _write(self, dataset_id: str, modified_at: str, rows: dict[str, dict[str, Any]]) -> int:
+        version = self.latest["version"] + 1 if self.versions else 1
+        file = os.path.join(self.path, SNAPSHOT_FILE.format(version))
+        # 作成日時順に保存し、読み込み時のExampleの順序を毎回同じにする
+        table = pa.Table.from_pylist(sorted(rows.values(), key=lambda r: (r["created_at"], r["id"])), schema=SCHEMA)
+        pq.write_table(table, f"{file}.tmp")
+        os.replace(f"{file}.tmp", file)
+        self.versions.append({
+            "version": version,
+            "dataset_id": dataset_id,
+            "dataset_modified_at": modified_at,
+            "count": table.num_rows,
+            "created": time.time(),
+        })
+        # 古いバージョンはkeep_versions個まで残す
+        for old in self.versions[:-self.keep_versions]:
+            old_file = os.path.join(self.path, SNAPSHOT_FILE.format(old["version"]))
+            if os.path.exists(old_file):
+                os.remove(old_file)
+        self.versions = self.versions[-self.keep_versions:]
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"versions": self.versions}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.manifest_path)
+        return version
+
+    def _read(self, version: int) -> pa.Table:
+        return pq.read_table(os.path.join(self.path, SNAPSHOT_FILE.format(version)), schema=SCHEMA)
+
+    # 指定したバージョン(省略時は最新)のExampleを返す。aevaluateのdataにそのまま渡せる
+    # refresh=Trueの場合は先にDatasetの更新を確認し、接続できない場合は保存済みのバージョンを利用する
+    def examples(self, version: Optional[int] = None, refresh: bool = True) -> list[Example]:
+        if refresh and version is None:
+            try:
+                self.refresh()
+            except (LangSmithError, OSError) as e:
+                if self.latest is None:
+                    raise
+                print(f"dataset mirror: failed to refresh ({e!r}), using version {self.latest['version']}")
+        if version is None:
+            if self.latest is None:
+                raise ValueError(f"no local snapshot of dataset {self.dataset_name}")
+            version = self.latest["version"]
+        elif not any(v["version"] == version for v in self.versions):
+            raise ValueError(f"version {version} of dataset {self.dataset_name} is not available")
+        return [_to_example(row) for row in self._read(version).to_pylist()]
+
+    # 評価結果の記録用に、利用したスナップショットの情報を返す
+    def describe(self, version: Optional[int] = None) -> dict[str, Any]:
+        info = self.latest if version is None else next(v for v in self.versions if v["version"] == version)
+        return {"dataset_version": info["version"], "dataset_modified_at": info["dataset_modified_at"],
+                "example_count": info["count"]}
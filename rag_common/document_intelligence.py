@@ -0,0 +1,64 @@
+# Document Intelligenceによるレイアウト解析の結果をディスクにキャッシュする
+# キーはファイル内容のハッシュ, model_id, output_content_formatから作成し、解析結果全体をgzip圧縮したJSONとして保存する
+import gzip
+import hashlib
+import json
+import os
+from typing import Optional
+
+from azure.ai.documentintelligence.models import AnalyzeResult
+
+from rag_common.paths import cache_path
+
+
+def file_hash(filepath: str) -> str:
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _cache_file(filepath: str, model_id: str, output_content_format: Optional[str]) -> str:
+    key = hashlib.sha256(
+        f"{file_hash(filepath)}\0{model_id}\0{output_content_format or 'text'}".encode("utf-8")
+    ).hexdigest()
+    os.makedirs(cache_path("document_intelligence"), exist_ok=True)
+    return os.path.join(cache_path("document_intelligence"), f"{key}.json.gz")
+
+
+def create_client():
+    from azure.ai.documentintelligence import DocumentIntelligenceClient
+    from azure.core.credentials import AzureKeyCredential
+
+    endpoint = os.getenv("AZURE_FORM_RECOGNIZER_ENDPOINT")
+    key = os.getenv("AZURE_FORM_RECOGNIZER_KEY")
+    return DocumentIntelligenceClient(endpoint=endpoint, credential=AzureKeyCredential(key))
+
+
+# ファイルを解析してAnalyzeResultを返す。同じファイル・同じ設定の解析結果があればサービスを呼び出さない
+# clientを省略した場合は、キャッシュにない時だけ環境変数の接続情報でDocumentIntelligenceClientを作成する
+def analyze_document(filepath: str, model_id: str = "prebuilt-layout",
+                     output_content_format: Optional[str] = None,
+                     client=None, use_cache: bool = True) -> AnalyzeResult:
+    cache_file = _cache_file(filepath, model_id, output_content_format)
+    if use_cache and os.path.exists(cache_file):
+        with gzip.open(cache_file, "rt", encoding="utf-8") as f:
+            return AnalyzeResult(json.load(f))
+
+    client = client or create_client()
+    options = {"output_content_format": output_content_format} if output_content_format else {}
+    with open(filepath, "rb") as f:
+        poller = client.begin_analyze_document(
+            model_id=model_id,
+            body=f,
+            content_type="application/octet-stream",
+            **options
+        )
+        result = poller.result()
+
+    tmp_file = f"{cache_file}.tmp"
+    with gzip.open(tmp_file, "wt", encoding="utf-8") as f:
+        json.dump(result.as_dict(), f, ensure_ascii=False)
+    os.replace(tmp_file, cache_file)
+    return result
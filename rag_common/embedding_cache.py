@@ -0,0 +1,133 @@
+# Embeddingの結果をSQLiteに保存して再利用するキャッシュ
+# キーは(デプロイメント名, テキストのハッシュ)で、ベクトルはfloat32のバイト列として保存する
+import hashlib
+import sqlite3
+import threading
+import time
+from array import array
+from typing import Optional
+
+from langchain_core.embeddings import Embeddings
+
+from rag_common.paths import cache_path
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+class CachedEmbeddings(Embeddings):
+    # embeddingsにはAzureOpenAIEmbeddings等のLangChainのEmbeddingsを渡す
+    # ragasで利用する場合はLangchainEmbeddingsWrapper(CachedEmbeddings(...))のようにラップする
+    def __init__(self, embeddings: Embeddings, namespace: Optional[str] = None,
+                 path: Optional[str] = None, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.embeddings = embeddings
+        self.namespace = namespace or getattr(embeddings, "deployment", None) or getattr(embeddings, "model", "")
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path or cache_path("embeddings.sqlite"), check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, namespace TEXT, vector BLOB, size INTEGER, last_used REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings(last_used)")
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    @property
+    def stats(self) -> str:
+        return f"embedding cache: hits={self.hits} misses={self.misses} hit_rate={self.hit_rate:.1%}"
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.namespace}\0{text}".encode("utf-8")).hexdigest()
+
+    # キャッシュにあるベクトルを返し、存在しないテキストの位置をmissingとして返す
+    def _lookup(self, texts: list[str]) -> tuple[list[Optional[list[float]]], list[int]]:
+        keys = [self._key(t) for t in texts]
+        found = {}
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                found.update(rows)
+            if found:
+                now = time.time()
+                self._conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?",
+                                       [(now, k) for k in found])
+                self._conn.commit()
+
+        vectors, missing = [], []
+        for i, key in enumerate(keys):
+            if key in found:
+                vectors.append(array("f", found[key]).tolist())
+            else:
+                vectors.append(None)
+                missing.append(i)
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+        return vectors, missing
+
+    def _store(self, texts: list[str], vectors: list[list[float]]):
+        now = time.time()
+        rows = []
+        for text, vector in zip(texts, vectors):
+            blob = array("f", vector).tobytes()
+            rows.append((self._key(text), self.namespace, blob, len(blob), now))
+        with self._lock:
+            for key, *_ in rows:
+                previous = self._conn.execute("SELECT size FROM embeddings WHERE key = ?", (key,)).fetchone()
+                if previous:
+                    self._total_bytes -= previous[0]
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?, ?)", rows)
+            self._total_bytes += sum(r[3] for r in rows)
+            self._evict()
+            self._conn.commit()
+
+    # 合計サイズがmax_bytesを超えた場合は、最後に利用された時刻が古いものから削除する
+    def _evict(self):
+        while self._total_bytes > self.max_bytes:
+            rows = self._conn.execute(
+                "SELECT key, size FROM embeddings ORDER BY last_used LIMIT 256"
+            ).fetchall()
+            if not rows:
+                break
+            self._conn.executemany("DELETE FROM embeddings WHERE key = ?", [(k,) for k, _ in rows])
+            self._total_bytes -= sum(size for _, size in rows)
+
+    def _merge(self, texts, vectors, missing, new_vectors):
+        self._store([texts[i] for i in missing], new_vectors)
+        for i, vector in zip(missing, new_vectors):
+            vectors[i] = vector
+        return vectors
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        vectors, missing = self._lookup(texts)
+        if not missing:
+            return vectors
+        new_vectors = self.embeddings.embed_documents([texts[i] for i in missing])
+        return self._merge(texts, vectors, missing, new_vectors)
+
+    def embed_query(self, text: str) -> list[float]:
+        vectors, missing = self._lookup([text])
+        if not missing:
+            return vectors[0]
+        return self._merge([text], vectors, missing, [self.embeddings.embed_query(text)])[0]
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        vectors, missing = self._lookup(texts)
+        if not missing:
+            return vectors
+        new_vectors = await self.embeddings.aembed_documents([texts[i] for i in missing])
+        return self._merge(texts, vectors, missing, new_vectors)
+
+    async def aembed_query(self, text: str) -> list[float]:
+        vectors, missing = self._lookup([text])
+        if not missing:
+            return vectors[0]
+        return self._merge([text], vectors, missing, [await self.embeddings.aembed_query(text)])[0]
@@ -0,0 +1,311 @@
+# Azure等の外部サービスの代わりにローカルで動作するスタンドイン実装
+# ネットワークに接続できない環境での動作確認や、ベンチマーク・テストで利用する
+import asyncio
+import random
+import threading
+import time
+import uuid
+import zlib
+from datetime import datetime, timedelta, timezone
+from typing import Any, Optional
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langsmith.schemas import Dataset, DatasetDiffInfo, Example
+from langsmith.utils import LangSmithNotFoundError
+
+from rag_common.uploader import IndexingResult
+
+
+class FakeSearchClient:
+    # SearchClientのドキュメント登録系メソッドと同じシグネチャを持つインメモリ実装
+    # failure_rateを指定すると、その割合のドキュメントが503(高負荷)で部分失敗する
+    def __init__(self, latency: float = 0.0, failure_rate: float = 0.0, seed: int = 0):
+        self.documents: dict[str, dict[str, Any]] = {}
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.requests = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def upload_documents(self, documents: list[dict], **kwargs) -> list[IndexingResult]:
+        return self._index(documents, lambda d: self.documents.__setitem__(str(d["id"]), dict(d)))
+
+    def merge_or_upload_documents(self, documents: list[dict], **kwargs) -> list[IndexingResult]:
+        return self._index(documents, lambda d: self.documents.setdefault(str(d["id"]), {}).update(d))
+
+    def delete_documents(self, documents: list[dict], **kwargs) -> list[IndexingResult]:
+        return self._index(documents, lambda d: self.documents.pop(str(d["id"]), None))
+
+    def get_document_count(self) -> int:
+        return len(self.documents)
+
+    # search_text="*"(全件)の列挙のみに対応する
+    def search(self, search_text: str = "*", select: Optional[list[str]] = None, **kwargs) -> list[dict]:
+        with self._lock:
+            documents = list(self.documents.values())
+        return [{k: v for k, v in d.items() if select is None or k in select} for d in documents]
+
+    def _index(self, documents, apply) -> list[IndexingResult]:
+        if self.latency:
+            time.sleep(self.latency)
+        results = []
+        with self._lock:
+            self.requests += 1
+            for document in documents:
+                key = str(document["id"])
+                if self._random.random() < self.failure_rate:
+                    results.append(IndexingResult(key, False, 503, "Service busy"))
+                    continue
+                apply(document)
+                results.append(IndexingResult(key, True, 200))
+        return results
+
+
+class FakePoller:
+    def __init__(self, result):
+        self._result = result
+
+    def result(self):
+        return self._result
+
+    def done(self) -> bool:
+        return True
+
+
+class FakeDocumentIntelligenceClient:
+    # DocumentIntelligenceClient.begin_analyze_documentのスタンドイン
+    # contentを省略した場合はpypdfでPDFから抽出したテキストを解析結果とする
+    def __init__(self, content: str = None, latency: float = 0.0):
+        self.content = content
+        self.latency = latency
+        self.calls = 0
+
+    def begin_analyze_document(self, model_id: str, body, content_type: str = "application/json",
+                               output_content_format: str = None, **kwargs) -> FakePoller:
+        from azure.ai.documentintelligence.models import AnalyzeResult
+
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.content is not None:
+            page_texts = [self.content]
+        else:
+            from pypdf import PdfReader
+            page_texts = [page.extract_text() for page in PdfReader(body).pages]
+
+        pages, offset = [], 0
+        for number, text in enumerate(page_texts, start=1):
+            pages.append({"pageNumber": number, "spans": [{"offset": offset, "length": len(text)}]})
+            offset += len(text) + 1
+        return FakePoller(AnalyzeResult({
+            "apiVersion": "2024-11-30",
+            "modelId": model_id,
+            "stringIndexType": "textElements",
+            "contentFormat": output_content_format or "text",
+            "content": "\n".join(page_texts),
+            "pages": pages,
+        }))
+
+
+class FakeEmbeddings(Embeddings):
+    # AzureOpenAIEmbeddingsのスタンドイン。文字のバイグラムのハッシュからベクトルを作るため、同じテキストには同じベクトルを返す
+    def __init__(self, size: int = 256, latency: float = 0.0):
+        self.size = size
+        self.latency = latency
+        self.calls = 0
+
+    def _vector(self, text: str) -> list[float]:
+        vector = [0.0] * self.size
+        for i in range(len(text)):
+            vector[zlib.crc32(text[i:i + 2].encode("utf-8")) % self.size] += 1.0
+        return vector
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return [self._vector(t) for t in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return [self._vector(t) for t in texts]
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return (await self.aembed_documents([text]))[0]
+
+
+class FakeChatModel(BaseChatModel):
+    # AzureChatOpenAIのスタンドイン。latency秒後に最初のトークンを返し、以降token_latency秒ごとに1文字ずつ返す
+    # トークン数は1文字1トークンとしてusage_metadataに設定する
+    response: str = "関連情報に基づく回答です。"
+    latency: float = 0.0
+    token_latency: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _usage(self, messages) -> dict:
+        input_tokens = sum(len(str(m.content)) for m in messages)
+        return {"input_tokens": input_tokens, "output_tokens": len(self.response),
+                "total_tokens": input_tokens + len(self.response)}
+
+    def _result(self, messages) -> ChatResult:
+        message = AIMessage(content=self.response, usage_metadata=self._usage(messages))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _chunk(self, messages, i: int) -> ChatGenerationChunk:
+        # 使用量は最後のチャンクにのみ設定する(ストリームを結合した際に合計が一致するように)
+        usage = self._usage(messages) if i == len(self.response) - 1 else None
+        return ChatGenerationChunk(message=AIMessageChunk(content=self.response[i], usage_metadata=usage))
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        time.sleep(self.latency + self.token_latency * len(self.response))
+        return self._result(messages)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        await asyncio.sleep(self.latency + self.token_latency * len(self.response))
+        return self._result(messages)
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        for i in range(len(self.response)):
+            if i and self.token_latency:
+                time.sleep(self.token_latency)
+            chunk = self._chunk(messages, i)
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        for i in range(len(self.response)):
+            if i and self.token_latency:
+                await asyncio.sleep(self.token_latency)
+            chunk = self._chunk(messages, i)
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+
+class FakeLangSmithClient:
+    # langsmith.ClientのDataset・Example関連のメソッドと同じシグネチャを持つインメモリ実装
+    # 削除したExampleも削除日時とともに保持し、diff_dataset_versionsで日時を指定した差分を返せるようにする
+    def __init__(self):
+        self.datasets: dict[str, Dataset] = {}
+        self.examples: dict[str, dict[str, Example]] = {}
+        self.deleted: dict[str, dict[str, tuple[datetime, datetime]]] = {}
+        self.requests = 0
+        self._now = datetime.now(timezone.utc)
+        self._lock = threading.Lock()
+
+    # 同じ日時にならないよう、呼び出すたびに1マイクロ秒以上進める
+    def _timestamp(self) -> datetime:
+        self._now = max(self._now + timedelta(microseconds=1), datetime.now(timezone.utc))
+        return self._now
+
+    def _dataset(self, dataset_id=None, dataset_name: Optional[str] = None) -> Dataset:
+        self.requests += 1
+        for dataset in self.datasets.values():
+            if str(dataset.id) == str(dataset_id) or dataset.name == dataset_name:
+                return dataset
+        raise LangSmithNotFoundError(f"Dataset {dataset_name or dataset_id} not found")
+
+    def _touch(self, dataset: Dataset, now: datetime):
+        self.datasets[str(dataset.id)] = dataset.copy(
+            update={"modified_at": now, "example_count": len(self.examples[str(dataset.id)])}
+        )
+
+    def has_dataset(self, *, dataset_name: Optional[str] = None, dataset_id=None) -> bool:
+        try:
+            self._dataset(dataset_id, dataset_name)
+            return True
+        except LangSmithNotFoundError:
+            return False
+
+    def create_dataset(self, dataset_name: str, **kwargs) -> Dataset:
+        now = self._timestamp()
+        dataset = Dataset(id=uuid.uuid4(), name=dataset_name, created_at=now, modified_at=now, example_count=0)
+        self.datasets[str(dataset.id)] = dataset
+        self.examples[str(dataset.id)] = {}
+        self.deleted[str(dataset.id)] = {}
+        return dataset
+
+    def read_dataset(self, *, dataset_name: Optional[str] = None, dataset_id=None) -> Dataset:
+        return self._dataset(dataset_id, dataset_name)
+
+    def create_examples(self, *, inputs, outputs=None, metadata=None, ids=None, dataset_id=None,
+                        dataset_name: Optional[str] = None, **kwargs):
+        with self._lock:
+            dataset = self._dataset(dataset_id, dataset_name)
+            now = self._timestamp()
+            examples = self.examples[str(dataset.id)]
+            for i, example_inputs in enumerate(inputs):
+                example_id = str(ids[i]) if ids else str(uuid.uuid4())
+                examples[example_id] = Example(
+                    id=example_id, dataset_id=dataset.id, inputs=example_inputs,
+                    outputs=outputs[i] if outputs else None, metadata=metadata[i] if metadata else None,
+                    created_at=now, modified_at=now,
+                )
+            self._touch(dataset, now)
+
+    def update_example(self, example_id, *, inputs=None, outputs=None, metadata=None, **kwargs):
+        with self._lock:
+            for dataset_id, examples in self.examples.items():
+                example = examples.get(str(example_id))
+                if example is None:
+                    continue
+                now = self._timestamp()
+                examples[str(example_id)] = example.copy(update={
+                    "inputs": inputs if inputs is not None else example.inputs,
+                    "outputs": outputs if outputs is not None else example.outputs,
+                    "metadata": metadata if metadata is not None else example.metadata,
+                    "modified_at": now,
+                })
+                self._touch(self.datasets[dataset_id], now)
+                return
+            raise LangSmithNotFoundError(f"Example {example_id} not found")
+
+    def delete_example(self, example_id):
+        with self._lock:
+            for dataset_id, examples in self.examples.items():
+                example = examples.pop(str(example_id), None)
+                if example is None:
+                    continue
+                now = self._timestamp()
+                self.deleted[dataset_id][str(example_id)] = (example.created_at, now)
+                self._touch(self.datasets[dataset_id], now)
+                return
+            raise LangSmithNotFoundError(f"Example {example_id} not found")
+
+    def list_examples(self, dataset_id=None, dataset_name: Optional[str] = None, example_ids=None, **kwargs):
+        dataset = self._dataset(dataset_id, dataset_name)
+        examples = list(self.examples[str(dataset.id)].values())
+        if example_ids is not None:
+            ids = {str(i) for i in example_ids}
+            examples = [e for e in examples if str(e.id) in ids]
+        yield from sorted(examples, key=lambda e: e.created_at)
+
+    # 日時で指定した2つのバージョンの間に追加・変更・削除されたExampleを返す(タグによる指定には対応しない)
+    def diff_dataset_versions(self, dataset_id=None, *, dataset_name: Optional[str] = None,
+                              from_version, to_version) -> DatasetDiffInfo:
+        dataset = self._dataset(dataset_id, dataset_name)
+        start, end = (v if isinstance(v, datetime) else datetime.fromisoformat(v) for v in (from_version, to_version))
+        added, modified, removed = [], [], []
+        for example in self.examples[str(dataset.id)].values():
+            if start < example.created_at <= end:
+                added.append(example.id)
+            elif example.created_at <= start < example.modified_at <= end:
+                modified.append(example.id)
+        for example_id, (created_at, deleted_at) in self.deleted[str(dataset.id)].items():
+            if created_at <= start < deleted_at <= end:
+                removed.append(uuid.UUID(example_id))
+        return DatasetDiffInfo(examples_added=added, examples_modified=modified, examples_removed=removed)
@@ -0,0 +1,144 @@
+# チャンクの内容から決まるIDと、登録済みのIDを記録したマニフェストによる差分インデックス
+# 再実行時は新しいチャンクのみを登録し、元のドキュメントから無くなったチャンクは削除する
+import hashlib
+import json
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Iterable, Iterator
+
+from rag_common.paths import cache_path
+from rag_common.vector_search import VECTOR_FIELD
+from rag_common.uploader import BulkUploader, UploadStats
+
+_KEY_RE = re.compile(r"[^A-Za-z0-9_\-=]")
+_CHUNK_ID_RE = re.compile(r"[A-Za-z0-9_\-=]{0,64}-[0-9a-f]{32}")
+
+
+# ドキュメントのキーに利用できる文字(英数字, _, -, =)のみでIDを作成する
+# 同じ内容のチャンクが複数ある場合は出現順の番号で区別する
+def chunk_id(source: str, content: str, occurrence: int = 0) -> str:
+    prefix = _KEY_RE.sub("_", os.path.splitext(os.path.basename(source))[0])[:64]
+    digest = hashlib.sha256(f"{source}\0{content}\0{occurrence}".encode("utf-8")).hexdigest()[:32]
+    return f"{prefix}-{digest}"
+
+
+def chunk_documents(source: str, chunks: Iterable[str]) -> Iterator[dict]:
+    seen = {}
+    source = os.path.basename(source)
+    for content in chunks:
+        occurrence = seen.get(content, 0)
+        seen[content] = occurrence + 1
+        yield {"id": chunk_id(source, content, occurrence), "content": content}
+
+
+# chunk_idの形式ではないキー(連番のid=str(i)で登録していた頃のドキュメント等)をインデックスから列挙する
+def legacy_keys(client) -> Iterator[str]:
+    for document in client.search(search_text="*", select=["id"]):
+        if not _CHUNK_ID_RE.fullmatch(str(document["id"])):
+            yield str(document["id"])
+
+
+class IndexManifest:
+    # インデックスごとに、ソースドキュメント別の登録済みチャンクIDを保存する
+    def __init__(self, index_name: str):
+        os.makedirs(cache_path("manifests"), exist_ok=True)
+        self.path = os.path.join(cache_path("manifests"), f"{index_name}.json")
+        self.sources: dict[str, list[str]] = {}
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                self.sources = json.load(f)
+
+    def ids(self, source: str) -> set[str]:
+        return set(self.sources.get(os.path.basename(source), []))
+
+    def update(self, source: str, ids: set[str]):
+        self.sources[os.path.basename(source)] = sorted(ids)
+
+    def clear(self):
+        self.sources = {}
+        self.save()
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.sources, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.path)
+
+
+# ドキュメントをbatch_size件ずつEmbeddingし、ベクトルをcontent_vectorフィールドに付与する
+def with_embeddings(documents: Iterable[dict], embeddings, batch_size: int = 256) -> Iterator[dict]:
+    batch = []
+    for document in documents:
+        batch.append(document)
+        if len(batch) >= batch_size:
+            yield from _embed(batch, embeddings)
+            batch = []
+    if batch:
+        yield from _embed(batch, embeddings)
+
+
+def _embed(batch: list[dict], embeddings) -> list[dict]:
+    vectors = embeddings.embed_documents([d["content"] for d in batch])
+    for document, vector in zip(batch, vectors):
+        document[VECTOR_FIELD] = vector
+    return batch
+
+
+@dataclass
+class SyncStats:
+    unchanged: int
+    uploaded: UploadStats
+    deleted: UploadStats
+    legacy: UploadStats = field(default_factory=UploadStats)
+
+    def __str__(self) -> str:
+        text = f"unchanged={self.unchanged}\n  upload: {self.uploaded}\n  delete: {self.deleted}"
+        if self.legacy.batches:
+            text += f"\n  legacy delete: {self.legacy}"
+        return text
+
+
+# sourceから作成したchunksの差分のみをインデックスに反映する
+# chunksはジェネレーターでもよく、作成されたチャンクから順に登録する
+# embeddingsを指定すると、新しく登録するチャンクのベクトルも合わせて登録する
+def sync_chunks(client, index_name: str, source: str, chunks: Iterable[str],
+                uploader: BulkUploader = None, embeddings=None) -> SyncStats:
+    uploader = uploader or BulkUploader(client)
+    manifest = IndexManifest(index_name)
+
+    # インデックスが空の場合(作り直した場合等)はマニフェストを信用せずに全件登録する
+    count = client.get_document_count()
+    if count == 0:
+        manifest.sources = {}
+
+    # マニフェストが無いのにドキュメントがある場合は、チャンクIDの導入前に連番のキーで登録したインデックスとみなす
+    # 古いドキュメントを残すと同じチャンクが重複して検索されるため、チャンクIDの形式ではないドキュメントを先に削除する
+    legacy = UploadStats()
+    if count > 0 and not manifest.sources:
+        legacy = uploader.upload(({"id": key} for key in legacy_keys(client)), action="delete")
+        if legacy.failed:
+            raise RuntimeError(f"failed to delete {legacy.failed} legacy documents from {index_name}; "
+                               "delete and rebuild the index")
+
+    indexed = manifest.ids(source)
+    current = set()
+
+    def new_documents():
+        for document in chunk_documents(source, chunks):
+            current.add(document["id"])
+            if document["id"] not in indexed:
+                yield document
+
+    documents = new_documents()
+    if embeddings is not None:
+        documents = with_embeddings(documents, embeddings)
+    uploaded = uploader.upload(documents, action="merge_or_upload")
+    deleted = uploader.upload(({"id": key} for key in sorted(indexed - current)), action="delete")
+
+    # 失敗したチャンクは次回の実行で再度処理されるようにマニフェストに反映しない
+    ids = (indexed | current) - set(uploaded.failed_keys)
+    ids -= (indexed - current) - set(deleted.failed_keys)
+    manifest.update(source, ids)
+    manifest.save()
+    return SyncStats(len(current & indexed), uploaded, deleted, legacy)
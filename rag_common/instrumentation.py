@@ -0,0 +1,247 @@
+# RAGパイプラインの処理段階ごとの計測
+# 検索・プロンプト作成・回答生成等の処理時間、検索したドキュメントの件数とバイト数、トークン数、最初のトークンまでの時間を記録し、
+# JSONL(1リクエスト1行)またはPrometheusのテキスト形式(.promファイル、累計値)でファイルに出力する
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler, BaseCallbackManager
+from langchain_core.outputs import LLMResult
+from langchain_core.runnables import RunnableConfig, ensure_config
+
+# on_chain_startで渡される名前と記録する処理段階の対応(その他のチェーンは計測しない)
+CHAIN_STAGES = {
+    "ChatPromptTemplate": "prompt",
+    "StrOutputParser": "parse",
+}
+
+
+class InstrumentationCallback(BaseCallbackHandler):
+    # チェーンの実行中に呼び出され、Traceに計測結果を記録する
+    # 計測した時刻がずれないよう、非同期実行時もイベントループ上で直接呼び出させる
+    run_inline = True
+
+    def __init__(self, trace: "Trace"):
+        self.trace = trace
+        self._starts: dict[UUID, tuple[str, float]] = {}
+
+    def _start(self, run_id: UUID, stage: str):
+        self._starts[run_id] = (stage, time.perf_counter())
+
+    def _end(self, run_id: UUID) -> Optional[float]:
+        stage, start = self._starts.pop(run_id, (None, None))
+        if stage is None:
+            return None
+        end = time.perf_counter()
+        self.trace.add_stage(stage, end - start)
+        return end
+
+    def on_retriever_start(self, serialized, query, *, run_id, **kwargs):
+        self._start(run_id, "retrieve")
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        self.trace.record["retrieved_docs"] += len(documents)
+        self.trace.record["retrieved_bytes"] += sum(len(d.page_content.encode("utf-8")) for d in documents)
+        self._end(run_id)
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(run_id, "generate")
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(run_id, "generate")
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        if token and self.trace.record["ttft"] is None:
+            self.trace.record["ttft"] = time.perf_counter() - self.trace.start
+
+    def on_llm_end(self, response: LLMResult, *, run_id, **kwargs):
+        prompt_tokens, completion_tokens = _token_usage(response)
+        self.trace.record["prompt_tokens"] += prompt_tokens
+        self.trace.record["completion_tokens"] += completion_tokens
+        end = self._end(run_id)
+        # ストリーミングしない場合は回答全体が返った時点を最初のトークンの到着とする
+        if end is not None and self.trace.record["ttft"] is None:
+            self.trace.record["ttft"] = end - self.trace.start
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_chain_start(self, serialized, inputs, *, run_id, **kwargs):
+        name = kwargs.get("name") or (serialized or {}).get("name")
+        if name in CHAIN_STAGES:
+            self._start(run_id, CHAIN_STAGES[name])
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end(run_id)
+
+
+# usage_metadata(LangChainの共通形式)を優先し、なければllm_outputのtoken_usage(OpenAIの形式)を利用する
+def _token_usage(response: LLMResult) -> tuple[int, int]:
+    prompt_tokens, completion_tokens = 0, 0
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                prompt_tokens += usage.get("input_tokens", 0)
+                completion_tokens += usage.get("output_tokens", 0)
+    if not prompt_tokens and not completion_tokens:
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        prompt_tokens = usage.get("prompt_tokens", 0)
+        completion_tokens = usage.get("completion_tokens", 0)
+    return prompt_tokens, completion_tokens
+
+
+class Trace:
+    # 1リクエスト分の計測結果。withブロックを抜けた時点で全体の処理時間を記録して出力する
+    def __init__(self, instrumentation: "Instrumentation", name: str, **attributes):
+        self.instrumentation = instrumentation
+        self.start = time.perf_counter()
+        self.record: dict[str, Any] = {
+            "name": name,
+            "timestamp": time.time(),
+            **attributes,
+            "stages": {},
+            "total": None,
+            "retrieved_docs": 0,
+            "retrieved_bytes": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "ttft": None,
+            "error": None,
+        }
+        self.callback = InstrumentationCallback(self)
+
+    def set(self, **values):
+        self.record.update(values)
+
+    def add_stage(self, stage: str, seconds: float):
+        stages = self.record["stages"]
+        stages[stage] = stages.get(stage, 0.0) + seconds
+
+    # withブロック内の処理時間を指定した処理段階の時間として加算する
+    @contextmanager
+    def stage(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(stage, time.perf_counter() - start)
+
+    # configのコールバックに計測用のハンドラーを追加したconfigを返す
+    def with_callbacks(self, config: Optional[RunnableConfig]) -> RunnableConfig:
+        config = ensure_config(config)
+        callbacks = config.get("callbacks")
+        if isinstance(callbacks, BaseCallbackManager):
+            callbacks = callbacks.copy()
+            callbacks.add_handler(self.callback, inherit=True)
+        else:
+            callbacks = [*(callbacks or []), self.callback]
+        return {**config, "callbacks": callbacks}
+
+    def __enter__(self) -> "Trace":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.record["total"] = time.perf_counter() - self.start
+        if exc is not None:
+            self.record["error"] = repr(exc)
+        self.instrumentation.write(self.record)
+
+
+class NullTrace:
+    # 計測が無効な場合に利用する何もしない実装
+    def set(self, **values):
+        pass
+
+    def add_stage(self, stage: str, seconds: float):
+        pass
+
+    def stage(self, stage: str):
+        return nullcontext()
+
+    def with_callbacks(self, config: Optional[RunnableConfig]) -> Optional[RunnableConfig]:
+        return config
+
+    def __enter__(self) -> "NullTrace":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+
+NULL_TRACE = NullTrace()
+
+
+class Instrumentation:
+    # pathの拡張子が.promの場合はPrometheusのテキスト形式、それ以外はJSONLで出力する
+    def __init__(self, path: str, format: str = None):
+        self.path = path
+        self.format = format or ("prometheus" if path.endswith(".prom") else "jsonl")
+        self._lock = threading.Lock()
+        self._totals: dict[str, float] = {}
+        self._stages: dict[str, list[float]] = {}
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    # 環境変数RAG_METRICS_FILEが設定されている場合のみ計測を有効にする
+    @classmethod
+    def from_env(cls) -> Optional["Instrumentation"]:
+        path = os.getenv("RAG_METRICS_FILE")
+        return cls(path) if path else None
+
+    def trace(self, name: str, **attributes) -> Trace:
+        return Trace(self, name, **attributes)
+
+    def write(self, record: dict[str, Any]):
+        with self._lock:
+            if self.format == "prometheus":
+                self._accumulate(record)
+                self._write_prometheus()
+            else:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def _accumulate(self, record: dict[str, Any]):
+        for key in ("retrieved_docs", "retrieved_bytes", "prompt_tokens", "completion_tokens"):
+            self._totals[key] = self._totals.get(key, 0) + record[key]
+        self._totals["requests"] = self._totals.get("requests", 0) + 1
+        self._totals["errors"] = self._totals.get("errors", 0) + (record["error"] is not None)
+        self._totals["cache_hits"] = self._totals.get("cache_hits", 0) + (record.get("cache") == "hit")
+        stages = {**record["stages"], "total": record["total"]}
+        if record["ttft"] is not None:
+            stages["ttft"] = record["ttft"]
+        for stage, seconds in stages.items():
+            total, count = self._stages.get(stage, (0.0, 0))
+            self._stages[stage] = (total + seconds, count + 1)
+
+    # 累計値でファイル全体を書き換える(node_exporterのtextfile collector等でそのまま読み込める)
+    def _write_prometheus(self):
+        lines = [
+            "# TYPE rag_stage_seconds summary",
+            *(f'rag_stage_seconds_sum{{stage="{stage}"}} {total:.6f}\n'
+              f'rag_stage_seconds_count{{stage="{stage}"}} {count}'
+              for stage, (total, count) in sorted(self._stages.items())),
+        ]
+        for key, value in sorted(self._totals.items()):
+            lines.append(f"# TYPE rag_{key}_total counter")
+            lines.append(f"rag_{key}_total {int(value)}")
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, self.path)
+
+
+# instrumentationがNoneの場合は何もしないTraceを返す
+def start_trace(instrumentation: Optional[Instrumentation], name: str, **attributes):
+    if instrumentation is None:
+        return NULL_TRACE
+    return instrumentation.trace(name, **attributes)
@@ -0,0 +1,166 @@
+# テストセット生成用のナレッジグラフと日本語化したプロンプトをディスクにキャッシュする
+# ナレッジグラフはドキュメントごとに保存し、キーはドキュメント内容のハッシュとtransformsの設定(LLMのデプロイメント名・プロンプトを含む)から作成する
+# 新しく追加・変更されたドキュメントのみtransformsを適用し、それ以外は保存済みの結果を利用する
+import dataclasses
+import hashlib
+import json
+import os
+import shutil
+from typing import Any, Optional, Sequence
+
+from langchain_core.documents import Document
+from ragas.run_config import RunConfig
+from ragas.testset.graph import KnowledgeGraph, Node, NodeType
+from ragas.testset.transforms import Parallel, apply_transforms
+from ragas.testset.transforms.base import RelationshipBuilder
+
+from rag_common.paths import cache_path
+from rag_common.score_cache import prompt_version
+
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def document_hash(doc: Document) -> str:
+    return _sha256(json.dumps({"page_content": doc.page_content, "metadata": doc.metadata},
+                              ensure_ascii=False, sort_keys=True, default=str))
+
+
+def _llm_config(llm) -> Optional[dict]:
+    llm = getattr(llm, "langchain_llm", llm)
+    if llm is None:
+        return None
+    return {
+        "deployment": getattr(llm, "deployment_name", None) or getattr(llm, "model_name", None),
+        "temperature": getattr(llm, "temperature", None),
+    }
+
+
+# transformの種類、数値・文字列等の設定値、LLM、プロンプトの内容を結果に影響する設定とする
+def _describe(transform) -> dict[str, Any]:
+    if isinstance(transform, Parallel):
+        return {"parallel": [_describe(t) for t in transform.transformations]}
+    config = {"type": type(transform).__name__}
+    if dataclasses.is_dataclass(transform):
+        for field in dataclasses.fields(transform):
+            value = getattr(transform, field.name)
+            if isinstance(value, (str, int, float, bool, type(None))) or (
+                isinstance(value, (list, tuple)) and all(isinstance(v, (str, int, float, bool)) for v in value)
+            ):
+                config[field.name] = value
+    if hasattr(transform, "llm"):
+        config["llm"] = _llm_config(transform.llm)
+    if hasattr(transform, "get_prompts"):
+        config["prompts"] = prompt_version(transform)
+    return config
+
+
+def transform_config_hash(transforms: Sequence) -> str:
+    return _sha256(json.dumps([_describe(t) for t in transforms], ensure_ascii=False, sort_keys=True))[:16]
+
+
+# ドキュメントをまたいで関係を作るRelationshipBuilderは、ドキュメントごとにキャッシュできない
+def _is_global(transform) -> bool:
+    if isinstance(transform, Parallel):
+        return any(_is_global(t) for t in transform.transformations)
+    return isinstance(transform, RelationshipBuilder)
+
+
+# ドキュメントのノードと、そこから分割・抽出されたノード(関係でつながるノード)ごとにグラフを分ける
+def _split_by_document(kg: KnowledgeGraph, doc_nodes: dict[Any, str]) -> dict[str, KnowledgeGraph]:
+    parent = {node.id: node.id for node in kg.nodes}
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for rel in kg.relationships:
+        parent[find(rel.source.id)] = find(rel.target.id)
+    roots = {find(node_id): doc_hash for node_id, doc_hash in doc_nodes.items() if node_id in parent}
+    graphs = {doc_hash: KnowledgeGraph() for doc_hash in doc_nodes.values()}
+    for node in kg.nodes:
+        doc_hash = roots.get(find(node.id))
+        if doc_hash is not None:
+            graphs[doc_hash].nodes.append(node)
+    for rel in kg.relationships:
+        doc_hash = roots.get(find(rel.source.id))
+        if doc_hash is not None:
+            graphs[doc_hash].relationships.append(rel)
+    return graphs
+
+
+def _save(kg: KnowledgeGraph, path: str):
+    tmp_path = f"{path}.tmp"
+    kg.save(tmp_path)
+    os.replace(tmp_path, path)
+
+
+# docsにtransformsを適用したナレッジグラフを返す
+# Extractor / Splitter等のドキュメント単位のtransformsを先に適用し、その結果をキャッシュする
+# RelationshipBuilderは結合したグラフに対して毎回適用する(LLMを利用しないため高速)
+def build_knowledge_graph(docs: Sequence[Document], transforms: Sequence, run_config: RunConfig = None,
+                          path: Optional[str] = None) -> KnowledgeGraph:
+    document_transforms = [t for t in transforms if not _is_global(t)]
+    global_transforms = [t for t in transforms if _is_global(t)]
+    directory = os.path.join(path or cache_path("knowledge_graphs"), transform_config_hash(document_transforms))
+    os.makedirs(directory, exist_ok=True)
+
+    hashes = [document_hash(doc) for doc in docs]
+    graphs: dict[str, KnowledgeGraph] = {}
+    missing: dict[str, Document] = {}
+    for doc_hash, doc in zip(hashes, docs):
+        file = os.path.join(directory, f"{doc_hash}.json")
+        if os.path.exists(file):
+            graphs[doc_hash] = KnowledgeGraph.load(file)
+        else:
+            missing[doc_hash] = doc
+    print(f"knowledge graph cache: {len(docs) - len(missing)} cached, {len(missing)} to transform")
+
+    if missing:
+        doc_nodes = {}
+        kg = KnowledgeGraph()
+        for doc_hash, doc in missing.items():
+            node = Node(type=NodeType.DOCUMENT,
+                        properties={"page_content": doc.page_content, "document_metadata": doc.metadata})
+            doc_nodes[node.id] = doc_hash
+            kg.nodes.append(node)
+        if document_transforms:
+            apply_transforms(kg, document_transforms, run_config or RunConfig())
+        for doc_hash, graph in _split_by_document(kg, doc_nodes).items():
+            _save(graph, os.path.join(directory, f"{doc_hash}.json"))
+            graphs[doc_hash] = graph
+
+    kg = KnowledgeGraph()
+    for doc_hash in dict.fromkeys(hashes):
+        kg.nodes.extend(graphs[doc_hash].nodes)
+        kg.relationships.extend(graphs[doc_hash].relationships)
+    if global_transforms:
+        apply_transforms(kg, global_transforms, run_config or RunConfig())
+    return kg
+
+
+# synthesizer等のプロンプトをlanguageに合わせて変換した結果を返す
+# キーは変換前のプロンプトの内容, 言語, 変換に利用するLLMのデプロイメント名から作成する
+async def adapt_prompts(target, language: str, llm, path: Optional[str] = None) -> dict:
+    key = _sha256(json.dumps({
+        "type": type(target).__name__,
+        "name": getattr(target, "name", None),
+        "prompts": prompt_version(target),
+        "language": language,
+        "llm": _llm_config(llm),
+    }, ensure_ascii=False, sort_keys=True))[:16]
+    directory = os.path.join(path or cache_path("prompts"), key)
+    if os.path.exists(directory):
+        return target.load_prompts(directory, language)
+
+    prompts = await target.adapt_prompts(language, llm=llm)
+    tmp_directory = f"{directory}.tmp"
+    shutil.rmtree(tmp_directory, ignore_errors=True)
+    os.makedirs(tmp_directory)
+    for name, prompt in prompts.items():
+        prompt.save(os.path.join(tmp_directory, f"{name}_{language}.json"))
+    os.replace(tmp_directory, directory)
+    return prompts
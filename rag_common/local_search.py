@@ -0,0 +1,246 @@
+# Azure AI Searchの代わりにローカルで動作する日本語BM25インデックス
+# 転置インデックスはnumpyの配列としてディレクトリに保存し、読み込み時はメモリマップで開く
+import hashlib
+import json
+import mmap
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Any, Optional
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from pydantic import PrivateAttr
+
+from rag_common.uploader import IndexingResult
+
+_WORD_RE = re.compile(r"[a-z0-9]+|[^\Wa-z0-9_]+")
+
+
+# NFKC正規化した上で、英数字は単語単位、日本語は文字bigramに分割する
+def tokenize(text: str) -> list[str]:
+    tokens = []
+    for word in _WORD_RE.findall(unicodedata.normalize("NFKC", text).lower()):
+        if word.isascii() or len(word) == 1:
+            tokens.append(word)
+        else:
+            tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+    return tokens
+
+
+def _save_array(path: str, name: str, array: np.ndarray):
+    tmp_path = os.path.join(path, f"{name}.tmp.npy")
+    np.save(tmp_path, array)
+    os.replace(tmp_path, os.path.join(path, f"{name}.npy"))
+
+
+def _save_bytes(path: str, name: str, data: bytes):
+    tmp_path = os.path.join(path, f"{name}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, os.path.join(path, name))
+
+
+# ドキュメントの一覧から転置インデックスを構築してpathに保存する
+def build_index(path: str, documents: list[dict[str, Any]], content_key: str = "content",
+                k1: float = 1.2, b: float = 0.75):
+    os.makedirs(path, exist_ok=True)
+
+    postings = defaultdict(list)
+    doc_len = np.zeros(len(documents), dtype=np.float32)
+    for i, document in enumerate(documents):
+        counts = Counter(tokenize(document.get(content_key) or ""))
+        doc_len[i] = sum(counts.values())
+        for token, tf in counts.items():
+            postings[token].append((i, tf))
+
+    terms = sorted(postings)
+    offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    for i, term in enumerate(terms):
+        offsets[i + 1] = offsets[i] + len(postings[term])
+    doc_ids = np.empty(offsets[-1], dtype=np.int32)
+    tfs = np.empty(offsets[-1], dtype=np.float32)
+    for i, term in enumerate(terms):
+        doc_ids[offsets[i]:offsets[i + 1]], tfs[offsets[i]:offsets[i + 1]] = zip(*postings[term])
+
+    n_docs = len(documents)
+    df = np.diff(offsets).astype(np.float32)
+    idf = np.log(1.0 + (n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+
+    # ドキュメント本体はJSON Linesで保存し、各行の先頭位置を別の配列に持つ
+    lines = [json.dumps(d, ensure_ascii=False).encode("utf-8") + b"\n" for d in documents]
+    doc_offsets = np.zeros(n_docs + 1, dtype=np.int64)
+    doc_offsets[1:] = np.cumsum([len(line) for line in lines])
+    body = b"".join(lines)
+
+    _save_array(path, "postings_offsets", offsets)
+    _save_array(path, "postings_docs", doc_ids)
+    _save_array(path, "postings_tf", tfs)
+    _save_array(path, "idf", idf)
+    _save_array(path, "doc_len", doc_len)
+    _save_array(path, "doc_offsets", doc_offsets)
+    _save_bytes(path, "documents.jsonl", body)
+    _save_bytes(path, "vocab.json", json.dumps({t: i for i, t in enumerate(terms)}, ensure_ascii=False).encode("utf-8"))
+    meta = {
+        "n_docs": n_docs,
+        "avgdl": float(doc_len.mean()) if n_docs else 0.0,
+        "k1": k1,
+        "b": b,
+        "content_key": content_key,
+        # 内容が変わった時に変化する値。キャッシュの無効化等に利用する
+        "version": hashlib.sha256(body).hexdigest()[:16],
+    }
+    _save_bytes(path, "meta.json", json.dumps(meta).encode("utf-8"))
+
+
+class LocalBM25Index:
+    # 保存済みのインデックスをメモリマップで開く
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        with open(os.path.join(path, "vocab.json"), encoding="utf-8") as f:
+            self.vocab: dict[str, int] = json.load(f)
+        load = lambda name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+        self.postings_offsets = load("postings_offsets")
+        self.postings_docs = load("postings_docs")
+        self.postings_tf = load("postings_tf")
+        self.idf = load("idf")
+        self.doc_len = load("doc_len")
+        self.doc_offsets = load("doc_offsets")
+        self._documents = None
+        if self.doc_offsets[-1] > 0:
+            with open(os.path.join(path, "documents.jsonl"), "rb") as f:
+                self._documents = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @property
+    def version(self) -> str:
+        return self.meta["version"]
+
+    def __len__(self) -> int:
+        return self.meta["n_docs"]
+
+    def get_document(self, i: int) -> dict[str, Any]:
+        return json.loads(self._documents[self.doc_offsets[i]:self.doc_offsets[i + 1]])
+
+    # BM25のスコアが高い順に(ドキュメント番号, スコア)をtop_k件返す
+    def search(self, query: str, top_k: int = 3) -> list[tuple[int, float]]:
+        n_docs = len(self)
+        if n_docs == 0:
+            return []
+        k1, b = self.meta["k1"], self.meta["b"]
+        norm = k1 * (1 - b + b * np.asarray(self.doc_len) / max(self.meta["avgdl"], 1e-9))
+        scores = np.zeros(n_docs, dtype=np.float32)
+        for token in set(tokenize(query)):
+            term = self.vocab.get(token)
+            if term is None:
+                continue
+            start, end = self.postings_offsets[term], self.postings_offsets[term + 1]
+            docs = self.postings_docs[start:end]
+            tf = self.postings_tf[start:end]
+            scores[docs] += self.idf[term] * tf * (k1 + 1) / (tf + norm[docs])
+
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > top_k:
+            candidates = candidates[np.argpartition(-scores[candidates], top_k - 1)[:top_k]]
+        candidates = candidates[np.lexsort((candidates, -scores[candidates]))]
+        return [(int(i), float(scores[i])) for i in candidates]
+
+
+class LocalBM25Retriever(BaseRetriever):
+    # AzureAISearchRetrieverと同様にcontent_keyの値をpage_contentに、その他のフィールドをmetadataに格納する
+    index_path: str
+    top_k: int = 3
+    content_key: str = "content"
+    _index: LocalBM25Index = PrivateAttr(default=None)
+
+    def model_post_init(self, __context: Any):
+        self._index = LocalBM25Index(self.index_path)
+
+    @property
+    def index(self) -> LocalBM25Index:
+        return self._index
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> list[Document]:
+        docs = []
+        for i, score in self._index.search(query, self.top_k):
+            document = self._index.get_document(i)
+            content = document.pop(self.content_key, "")
+            document["@search.score"] = score
+            docs.append(Document(page_content=content, metadata=document))
+        return docs
+
+
+class LocalSearchClient:
+    # SearchClientと同じ登録系メソッドを持つローカルインデックスへの書き込み用クライアント
+    # 登録内容はclose()(withブロックの終了時)にインデックスとして保存する
+    # content_vectorフィールドを持つドキュメントはベクトル検索の対象にもなる
+    def __init__(self, path: str, key_field: str = "id", content_key: str = "content"):
+        self.path = path
+        self.key_field = key_field
+        self.content_key = content_key
+        self.documents: dict[str, dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        if os.path.exists(os.path.join(path, "meta.json")):
+            from rag_common.vector_search import VECTOR_FIELD, load_vectors
+
+            index = LocalBM25Index(path)
+            vectors = load_vectors(path)
+            for i in range(len(index)):
+                document = index.get_document(i)
+                if i in vectors:
+                    document[VECTOR_FIELD] = vectors[i].tolist()
+                self.documents[str(document[key_field])] = document
+
+    def upload_documents(self, documents: list[dict], **kwargs) -> list[IndexingResult]:
+        return self._index(documents, lambda key, d: self.documents.__setitem__(key, dict(d)))
+
+    def merge_or_upload_documents(self, documents: list[dict], **kwargs) -> list[IndexingResult]:
+        return self._index(documents, lambda key, d: self.documents.setdefault(key, {}).update(d))
+
+    def delete_documents(self, documents: list[dict], **kwargs) -> list[IndexingResult]:
+        return self._index(documents, lambda key, d: self.documents.pop(key, None))
+
+    def get_document_count(self) -> int:
+        return len(self.documents)
+
+    # search_text="*"(全件)の列挙のみに対応する
+    def search(self, search_text: str = "*", select: Optional[list[str]] = None, **kwargs) -> list[dict]:
+        with self._lock:
+            documents = list(self.documents.values())
+        return [{k: v for k, v in d.items() if select is None or k in select} for d in documents]
+
+    def _index(self, documents, apply) -> list[IndexingResult]:
+        with self._lock:
+            results = []
+            for document in documents:
+                key = str(document[self.key_field])
+                apply(key, document)
+                results.append(IndexingResult(key, True, 200))
+            return results
+
+    # ベクトル(content_vector)はドキュメント本体とは別の行列として保存する
+    def close(self):
+        from rag_common.vector_search import VECTOR_FIELD, build_vector_index
+
+        with self._lock:
+            documents, doc_ids, vectors = [], [], []
+            for i, document in enumerate(self.documents.values()):
+                document = dict(document)
+                vector = document.pop(VECTOR_FIELD, None)
+                if vector is not None:
+                    doc_ids.append(i)
+                    vectors.append(vector)
+                documents.append(document)
+            build_index(self.path, documents, content_key=self.content_key)
+            build_vector_index(self.path, doc_ids, vectors)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,12 @@
+import os
+
+# リポジトリのルートディレクトリ。スクリプトの実行ディレクトリに関係なく同じ場所を指す
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 各種キャッシュの保存先。環境変数RAG_CACHE_DIRで変更できる
+CACHE_DIR = os.getenv("RAG_CACHE_DIR") or os.path.join(ROOT_DIR, ".cache")
+
+
+def cache_path(name: str) -> str:
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    return os.path.join(CACHE_DIR, name)
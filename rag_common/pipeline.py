@@ -0,0 +1,149 @@
+import os
+import time
+from typing import Any, AsyncIterator, Callable
+from langchain_core.documents import Document
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import SystemMessage
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate, HumanMessagePromptTemplate
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.runnables import RunnableConfig
+
+from rag_common.answer_cache import DEFAULT_THRESHOLD, DEFAULT_TTL, AnswerCache
+from rag_common.instrumentation import Instrumentation, start_trace
+from rag_common.search import create_index_embeddings, create_retriever, index_version
+
+
+def build_prompt() -> ChatPromptTemplate:
+    return ChatPromptTemplate.from_messages(
+        [SystemMessage(
+                """関連情報に基づき質問に回答してください。"""
+        ),
+            HumanMessagePromptTemplate.from_template(
+                """ 関連情報：{context}
+
+                ## 質問：{question}
+                ## 回答： """
+        )
+            ]
+        )
+
+
+def format_docs(docs: list[Document]) -> str:
+    return "\n\n".join(doc.page_content for doc in docs)
+
+
+class RagPipeline:
+    # retrieverとllmは1度だけ構築し、質問ごとに使い回す
+    # instrumentationを省略した場合は環境変数RAG_METRICS_FILEが設定されている時のみ処理段階ごとの計測を行う
+    # answer_cacheを指定した場合は、index_version()が同じ間は同じ(または類似した)質問に保存済みの回答を返す
+    def __init__(self, retriever: BaseRetriever, llm: BaseChatModel, prompt: ChatPromptTemplate = None,
+                 instrumentation: Instrumentation = None,
+                 answer_cache: AnswerCache = None, index_version: Callable[[], str] = None):
+        self.retriever = retriever
+        self.llm = llm
+        self.prompt = prompt or build_prompt()
+        self.instrumentation = instrumentation or Instrumentation.from_env()
+        self.answer_cache = answer_cache
+        self.index_version = index_version or (lambda: "none")
+        self.generate_chain = self.prompt | self.llm | StrOutputParser()
+
+    # Azure AI Search(LOCAL_INDEX_DIR設定時はローカルのBM25インデックス)とAzure OpenAIを利用したパイプラインを構築する
+    # answer_cacheをTrueにすると回答キャッシュを利用する(EMBEDDING_DEPLOYMENT_NAMEが設定されている場合は類似した質問も対象とする)
+    @classmethod
+    def from_azure(cls, index_name: str, top_k: int = 3,
+                   service_name: str = "srch-sd-rag-evaluation",
+                   azure_deployment: str = "gpt-4o-mini-deploy", temperature: float = 0,
+                   answer_cache: bool = False, cache_ttl: float = DEFAULT_TTL,
+                   cache_threshold: float = DEFAULT_THRESHOLD) -> "RagPipeline":
+        from rag_common.azure_openai import create_azure_chat_openai
+
+        retriever = create_retriever(index_name, top_k=top_k, service_name=service_name)
+        llm = create_azure_chat_openai(
+            azure_deployment=azure_deployment,
+            temperature=temperature,
+        )
+        cache = None
+        if answer_cache:
+            embeddings = create_index_embeddings() if os.getenv("EMBEDDING_DEPLOYMENT_NAME") else None
+            cache = AnswerCache(f"{index_name}\0{top_k}\0{azure_deployment}\0{temperature}", embeddings,
+                                threshold=cache_threshold, ttl=cache_ttl)
+        return cls(retriever, llm, answer_cache=cache, index_version=lambda: index_version(index_name))
+
+    # 検索は1回だけ行い、同じドキュメントをプロンプトと返り値のretrieved_contextsの両方に利用する
+    def invoke(self, question: str, config: RunnableConfig = None) -> dict[str, Any]:
+        with start_trace(self.instrumentation, "rag_pipeline", question=question) as trace:
+            if self.answer_cache:
+                version = self.index_version()
+                with trace.stage("cache_lookup"):
+                    cached, vector = self.answer_cache.get(question, version)
+                trace.set(cache="hit" if cached is not None else "miss")
+                if cached is not None:
+                    return cached
+            config = trace.with_callbacks(config)
+            docs = self.retriever.invoke(question, config=config)
+            with trace.stage("format_docs"):
+                context = format_docs(docs)
+            answer = self.generate_chain.invoke({"context": context, "question": question}, config=config)
+            result = self._output(answer, docs)
+            if self.answer_cache:
+                self.answer_cache.set(question, version, result, vector)
+        return result
+
+    async def ainvoke(self, question: str, config: RunnableConfig = None) -> dict[str, Any]:
+        with start_trace(self.instrumentation, "rag_pipeline", question=question) as trace:
+            if self.answer_cache:
+                version = self.index_version()
+                with trace.stage("cache_lookup"):
+                    cached, vector = await self.answer_cache.aget(question, version)
+                trace.set(cache="hit" if cached is not None else "miss")
+                if cached is not None:
+                    return cached
+            config = trace.with_callbacks(config)
+            docs = await self.retriever.ainvoke(question, config=config)
+            with trace.stage("format_docs"):
+                context = format_docs(docs)
+            answer = await self.generate_chain.ainvoke({"context": context, "question": question}, config=config)
+            result = self._output(answer, docs)
+            if self.answer_cache:
+                self.answer_cache.set(question, version, result, vector)
+        return result
+
+    # 回答をトークンごとに返す。回答の生成を始める前に検索結果を返し、最後に最初のトークンまでの時間と全体の処理時間を返す
+    # {"type": "contexts", "retrieved_contexts": [...]} -> {"type": "token", "content": "..."} ... -> {"type": "end", "ttft": 秒, "total": 秒}
+    async def astream(self, question: str, config: RunnableConfig = None) -> AsyncIterator[dict[str, Any]]:
+        start = time.perf_counter()
+        with start_trace(self.instrumentation, "rag_pipeline", question=question, streaming=True) as trace:
+            if self.answer_cache:
+                version = self.index_version()
+                with trace.stage("cache_lookup"):
+                    cached, vector = await self.answer_cache.aget(question, version)
+                trace.set(cache="hit" if cached is not None else "miss")
+                # キャッシュにある場合は回答全体を1つのトークンとして返す
+                if cached is not None:
+                    yield {"type": "contexts", "retrieved_contexts": cached["retrieved_contexts"]}
+                    yield {"type": "token", "content": cached["response"]}
+                    elapsed = time.perf_counter() - start
+                    yield {"type": "end", "ttft": elapsed, "total": elapsed}
+                    return
+            config = trace.with_callbacks(config)
+            docs = await self.retriever.ainvoke(question, config=config)
+            with trace.stage("format_docs"):
+                context = format_docs(docs)
+            yield {"type": "contexts", "retrieved_contexts": [doc.page_content for doc in docs]}
+
+            ttft, tokens = None, []
+            async for token in self.generate_chain.astream({"context": context, "question": question}, config=config):
+                if ttft is None and token:
+                    ttft = time.perf_counter() - start
+                tokens.append(token)
+                yield {"type": "token", "content": token}
+            if self.answer_cache:
+                self.answer_cache.set(question, version, self._output("".join(tokens), docs), vector)
+        yield {"type": "end", "ttft": ttft, "total": time.perf_counter() - start}
+
+    def _output(self, answer: str, docs: list[Document]) -> dict[str, Any]:
+        return {
+            "response": answer,
+            "retrieved_contexts": [doc.page_content for doc in docs],
+        }
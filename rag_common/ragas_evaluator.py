@@ -0,0 +1,102 @@
+import asyncio
+from typing import Any, Optional
+from langsmith.schemas import Example, Run
+from ragas import SingleTurnSample
+from ragas.metrics.base import Metric
+
+from rag_common.artifact_cache import ArtifactCache, share_prompts
+from rag_common.concurrency import judge_semaphore
+from rag_common.results_store import RunResults
+from rag_common.score_cache import ScoreCache
+
+
+def _reason(error: BaseException) -> str:
+    return "timeout" if isinstance(error, asyncio.TimeoutError) else repr(error)
+
+
+# outputsはtarget(RAGシステム)の返り値, exampleはDatasetに登録された値を示す
+def to_sample(outputs: dict[str, Any], example: Example) -> SingleTurnSample:
+    return SingleTurnSample(
+        user_input=example.inputs["user_input"],#テストセットから得られた質問文
+        retrieved_contexts=outputs["retrieved_contexts"], #RAGシステムから得られた関連情報
+        response=outputs["response"], #RAGシステムから得られた回答
+        reference=example.outputs["reference"], #テストセットから得られた真の回答
+        reference_contexts=example.outputs.get("reference_contexts") #テストセットの作成元のコンテキスト
+    )
+
+
+class RagasEvaluator:
+    # 対象となるMetricsを設定
+    # score_cacheを指定すると、同じサンプルに対する同じMetricの評価結果を再利用する
+    # metric_timeoutを指定すると、その秒数を超えたMetricはスコアなしとして扱う
+    # resultsを指定すると、(Example, Metric)ごとの結果を完了した時点で記録し、記録済みの結果は評価せずに返す
+    # artifact_cacheを指定すると、Metric間で同じLLMの呼び出し(回答の文への分解等)をサンプルごとに1度にまとめる
+    def __init__(self, metrics: list[Metric], score_cache: Optional[ScoreCache] = None,
+                 metric_timeout: Optional[float] = None, results: Optional[RunResults] = None,
+                 artifact_cache: Optional[ArtifactCache] = None):
+        self.metrics = metrics
+        self.score_cache = score_cache
+        self.metric_timeout = metric_timeout
+        self.results = results
+        self.artifact_cache = artifact_cache
+
+    # 実際に引き渡す評価用の関数
+    # runはtargetの返り値, exampleはDatasetに登録された値を示す
+    async def evaluate(self, run: Run, example: Example) -> dict[str, Any]:
+        return await self.evaluate_sample(to_sample(run.outputs, example), str(example.id))
+
+    # 1件のサンプルに対して各Metric(metricsを指定した場合はそのMetricのみ)の評価を並列に実行する
+    # 一部のMetricが失敗・タイムアウトした場合でも、他のMetricの結果は返す
+    async def evaluate_sample(self, sample: SingleTurnSample, example_id: str,
+                              metrics: Optional[list[Metric]] = None) -> list[dict[str, Any]]:
+        metrics = self.metrics if metrics is None else metrics
+        scores = await asyncio.gather(
+            *(self._evaluate_metric(metric, sample, example_id) for metric in metrics),
+            return_exceptions=True
+        )
+
+        results = []
+        for metric, score in zip(metrics, scores):
+            if isinstance(score, BaseException):
+                results.append({"key": metric.name, "score": None, "comment": _reason(score)})
+            else:
+                results.append({"key": metric.name, "score": score})
+
+        return results
+
+    async def _evaluate_metric(self, metric: Metric, sample: SingleTurnSample, example_id: str) -> float:
+        if self.results is None:
+            return await self.score(metric, sample)
+
+        score = self.results.score(example_id, metric.name)
+        if score is not None:
+            return score
+        try:
+            score = await self.score(metric, sample)
+        except Exception as e:
+            self.results.add(example_id, metric.name, None, _reason(e))
+            raise
+        self.results.add(example_id, metric.name, score)
+        return score
+
+    async def score(self, metric: Metric, sample: SingleTurnSample) -> float:
+        if self.score_cache is None:
+            return await self._ascore(metric, sample)
+
+        key = self.score_cache.key(metric, sample)
+        score = self.score_cache.get(key)
+        if score is None:
+            score = await self._ascore(metric, sample)
+            self.score_cache.set(key, metric.name, score)
+        return score
+
+    # 評価用LLMの呼び出しはプロセス全体で共有するセマフォの範囲内で行う
+    # LLMを利用しないMetric(RetrievalMetric等)はセマフォを待たずに実行する
+    # artifact_cacheは評価の直前に適用し、構築後にset_promptsで差し替えられたプロンプトの呼び出しも共有する
+    async def _ascore(self, metric: Metric, sample: SingleTurnSample) -> float:
+        if self.artifact_cache is not None:
+            share_prompts([metric], self.artifact_cache)
+        if getattr(metric, "llm", None) is None:
+            return await metric.single_turn_ascore(sample, timeout=self.metric_timeout)
+        async with judge_semaphore():
+            return await metric.single_turn_ascore(sample, timeout=self.metric_timeout)
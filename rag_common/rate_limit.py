@@ -0,0 +1,222 @@
+# Azure OpenAIへのリクエストをデプロイメントごとのRPM/TPMの範囲に抑えるレート制限
+# httpxのTransportとして実装しているため、LLM・Embeddingのどちらのクライアントにも同じ仕組みを適用できる
+import asyncio
+import email.utils
+import json
+import os
+import re
+import threading
+import time
+from typing import Optional
+
+import httpx
+
+_DEPLOYMENT_RE = re.compile(r"/deployments/([^/]+)/")
+
+# 生成するトークン数(max_tokens)が指定されていない場合に見込んでおくトークン数
+DEFAULT_COMPLETION_TOKENS = 256
+
+
+# リクエストボディから消費するトークン数を見積もる
+# 日本語は1文字1トークン、英数字は4文字1トークン程度として概算する
+def estimate_tokens(text: str) -> int:
+    ascii_chars = sum(1 for c in text if c.isascii())
+    return (len(text) - ascii_chars) + ascii_chars // 4 + 1
+
+
+def estimate_request_tokens(body: bytes) -> int:
+    try:
+        payload = json.loads(body or b"{}")
+    except ValueError:
+        return estimate_tokens(body.decode("utf-8", errors="ignore"))
+
+    tokens = 0
+    for message in payload.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, list):
+            content = " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+        tokens += estimate_tokens(content or "") + 4
+
+    inputs = payload.get("input")
+    if inputs is not None:
+        # Embeddingの入力は文字列、もしくはトークンIDの配列として送られる
+        for item in inputs if isinstance(inputs, list) else [inputs]:
+            if isinstance(item, str):
+                tokens += estimate_tokens(item)
+            elif isinstance(item, list):
+                tokens += len(item)
+            else:
+                tokens += 1
+    else:
+        tokens += payload.get("max_tokens") or payload.get("max_completion_tokens") or DEFAULT_COMPLETION_TOKENS
+    return tokens
+
+
+def parse_retry_after(headers: httpx.Headers) -> Optional[float]:
+    for name in ("retry-after-ms", "x-ms-retry-after-ms"):
+        if name in headers:
+            try:
+                return float(headers[name]) / 1000
+            except ValueError:
+                pass
+    if "retry-after" in headers:
+        value = headers["retry-after"]
+        try:
+            return float(value)
+        except ValueError:
+            parsed = email.utils.parsedate_to_datetime(value)
+            return max(0.0, parsed.timestamp() - time.time()) if parsed else None
+    return None
+
+
+class TokenBucket:
+    # RPM/TPMをそれぞれ1分あたりの補充量とするトークンバケット
+    # バースト量は10秒分までとし、429を受けた場合は補充速度を下げ、成功が続くと徐々に元の速度に戻す
+    def __init__(self, rpm: Optional[float] = None, tpm: Optional[float] = None,
+                 burst_seconds: float = 10.0, min_factor: float = 0.1):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.burst_seconds = burst_seconds
+        self.min_factor = min_factor
+        self.factor = 1.0
+        self.throttled = 0
+        self._requests = self._capacity(rpm)
+        self._tokens = self._capacity(tpm)
+        self._blocked_until = 0.0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _capacity(self, per_minute: Optional[float]) -> float:
+        return per_minute / 60 * self.burst_seconds if per_minute else 0.0
+
+    def _refill(self, now: float):
+        elapsed = now - self._updated
+        self._updated = now
+        if self.rpm:
+            self._requests = min(self._capacity(self.rpm), self._requests + elapsed * self.rpm / 60 * self.factor)
+        if self.tpm:
+            self._tokens = min(self._capacity(self.tpm), self._tokens + elapsed * self.tpm / 60 * self.factor)
+
+    # リクエスト1件とtokens分を予約し、送信までに待つべき秒数を返す
+    def reserve(self, tokens: int) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            wait = max(0.0, self._blocked_until - now)
+            if self.rpm:
+                self._requests -= 1
+                wait = max(wait, -self._requests / (self.rpm / 60 * self.factor))
+            if self.tpm:
+                # 1回で上限を超えるリクエストはバケットが満杯になった時点で送信する
+                self._tokens -= min(tokens, self._capacity(self.tpm))
+                wait = max(wait, -self._tokens / (self.tpm / 60 * self.factor))
+            return wait
+
+    def on_success(self):
+        with self._lock:
+            self.factor = min(1.0, self.factor + 0.02)
+
+    def on_throttled(self, retry_after: Optional[float]):
+        with self._lock:
+            self.throttled += 1
+            self.factor = max(self.min_factor, self.factor * 0.7)
+            self._blocked_until = max(self._blocked_until, time.monotonic() + (retry_after or 1.0))
+
+
+class RateLimiter:
+    # デプロイメント名ごとにTokenBucketを管理する
+    # limitsは{デプロイメント名: (rpm, tpm)}。指定のないデプロイメントにはdefault_rpm/default_tpmを適用する
+    def __init__(self, limits: Optional[dict[str, tuple[Optional[float], Optional[float]]]] = None,
+                 default_rpm: Optional[float] = None, default_tpm: Optional[float] = None):
+        self.limits = limits or {}
+        self.default_rpm = default_rpm
+        self.default_tpm = default_tpm
+        self._buckets: dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    # 環境変数から設定を読み込む
+    # AZURE_OPENAI_RATE_LIMITS="gpt-4o-mini-deploy=300/50000,text-embedding-3-small-deploy=600/100000"
+    # AZURE_OPENAI_RPM / AZURE_OPENAI_TPM はデプロイメントの指定がない場合の既定値
+    @classmethod
+    def from_env(cls) -> "RateLimiter":
+        limits = {}
+        for entry in filter(None, os.getenv("AZURE_OPENAI_RATE_LIMITS", "").split(",")):
+            name, _, values = entry.strip().partition("=")
+            rpm, _, tpm = values.partition("/")
+            limits[name] = (float(rpm) if rpm else None, float(tpm) if tpm else None)
+        rpm, tpm = os.getenv("AZURE_OPENAI_RPM"), os.getenv("AZURE_OPENAI_TPM")
+        return cls(limits, float(rpm) if rpm else None, float(tpm) if tpm else None)
+
+    def bucket(self, deployment: str) -> TokenBucket:
+        with self._lock:
+            if deployment not in self._buckets:
+                rpm, tpm = self.limits.get(deployment, (self.default_rpm, self.default_tpm))
+                self._buckets[deployment] = TokenBucket(rpm, tpm)
+            return self._buckets[deployment]
+
+    @property
+    def stats(self) -> str:
+        return ", ".join(
+            f"{name}: throttled={b.throttled} factor={b.factor:.2f}" for name, b in self._buckets.items()
+        )
+
+
+def _bucket_for(limiter: RateLimiter, request: httpx.Request) -> tuple[TokenBucket, int]:
+    match = _DEPLOYMENT_RE.search(request.url.path)
+    bucket = limiter.bucket(match.group(1) if match else request.url.host)
+    return bucket, estimate_request_tokens(request.content)
+
+
+class RateLimitedTransport(httpx.BaseTransport):
+    def __init__(self, limiter: RateLimiter, transport: Optional[httpx.BaseTransport] = None, max_retries: int = 8):
+        self.limiter = limiter
+        self.transport = transport or httpx.HTTPTransport()
+        self.max_retries = max_retries
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        bucket, tokens = _bucket_for(self.limiter, request)
+        for attempt in range(self.max_retries + 1):
+            time.sleep(bucket.reserve(tokens))
+            response = self.transport.handle_request(request)
+            if response.status_code != 429 or attempt == self.max_retries:
+                if response.status_code < 400:
+                    bucket.on_success()
+                return response
+            bucket.on_throttled(parse_retry_after(response.headers))
+            response.close()
+
+    def close(self):
+        self.transport.close()
+
+
+class AsyncRateLimitedTransport(httpx.AsyncBaseTransport):
+    def __init__(self, limiter: RateLimiter, transport: Optional[httpx.AsyncBaseTransport] = None, max_retries: int = 8):
+        self.limiter = limiter
+        self.transport = transport or httpx.AsyncHTTPTransport()
+        self.max_retries = max_retries
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        bucket, tokens = _bucket_for(self.limiter, request)
+        for attempt in range(self.max_retries + 1):
+            await asyncio.sleep(bucket.reserve(tokens))
+            response = await self.transport.handle_async_request(request)
+            if response.status_code != 429 or attempt == self.max_retries:
+                if response.status_code < 400:
+                    bucket.on_success()
+                return response
+            bucket.on_throttled(parse_retry_after(response.headers))
+            await response.aclose()
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+_limiter = None
+
+
+# プロセス全体で共有するRateLimiter
+def get_rate_limiter() -> RateLimiter:
+    global _limiter
+    if _limiter is None:
+        _limiter = RateLimiter.from_env()
+    return _limiter
@@ -0,0 +1,167 @@
+# 評価結果を(Example, Metric)ごとに完了した時点でSQLiteへ追記する
+# 結果は実行IDごとに記録し、途中で中断した評価を同じ実行IDで再開した場合は評価済みの結果とRAGの出力を再利用する
+# 記録した結果はLangSmith等のサービスに接続せずDataFrameとして読み込める
+import hashlib
+import json
+import math
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Optional
+
+import pandas as pd
+
+from rag_common.paths import cache_path
+
+
+# RAGの出力はtargetに渡される入力のみから識別する(aevaluateのtargetにはExampleのIDが渡されないため)
+def inputs_key(inputs: dict[str, Any]) -> str:
+    return hashlib.sha256(json.dumps(inputs, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def new_run_id() -> str:
+    return f"{datetime.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:8]}"
+
+
+# 再開する実行が開始時に利用したDatasetのスナップショットのバージョンを返す(新しい実行の場合はdataset_versionをそのまま返す)
+# 途中でDatasetが更新されても、追加・変更されたExampleを同じ実行に混在させないようにする
+def resume_dataset_version(store: "ResultsStore", run_id: Optional[str], dataset_version: Optional[int]) -> Optional[int]:
+    metadata = store.metadata(run_id) if run_id else None
+    if metadata is None or metadata.get("dataset_version") is None:
+        return dataset_version
+    if dataset_version is not None and dataset_version != metadata["dataset_version"]:
+        raise ValueError(f"run {run_id} was started on dataset version {metadata['dataset_version']}, "
+                         f"not {dataset_version}")
+    return metadata["dataset_version"]
+
+
+class ResultsStore:
+    # 結果は追記のみ行い、同じ(Example, Metric)を再評価した場合は最後に記録した結果を利用する
+    def __init__(self, path: Optional[str] = None):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path or cache_path("results.sqlite"), check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS runs (run_id TEXT PRIMARY KEY, created REAL, metadata TEXT)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results (id INTEGER PRIMARY KEY AUTOINCREMENT, run_id TEXT, "
+            "example_id TEXT, metric TEXT, score REAL, comment TEXT, created REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS results_run ON results(run_id, example_id, metric)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS outputs (run_id TEXT, key TEXT, outputs TEXT, created REAL, "
+            "PRIMARY KEY (run_id, key))"
+        )
+        self._conn.commit()
+
+    # run_idを省略した場合は新しい実行として記録する。既存のrun_idを指定した場合はその続きから再開する
+    def open_run(self, run_id: Optional[str] = None, **metadata) -> "RunResults":
+        run_id = run_id or new_run_id()
+        with self._lock:
+            self._conn.execute("INSERT OR IGNORE INTO runs VALUES (?, ?, ?)",
+                               (run_id, time.time(), json.dumps(metadata, ensure_ascii=False, default=str)))
+            self._conn.commit()
+        return RunResults(self, run_id)
+
+    # 実行の開始時に記録したメタデータ(利用したDatasetのスナップショット等)。記録の無い実行IDの場合はNone
+    def metadata(self, run_id: str) -> Optional[dict[str, Any]]:
+        rows = self._execute("SELECT metadata FROM runs WHERE run_id = ?", (run_id,))
+        return json.loads(rows[0][0]) if rows else None
+
+    def _execute(self, sql: str, params: tuple = ()) -> list[tuple]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _insert(self, sql: str, params: tuple):
+        with self._lock:
+            self._conn.execute(sql, params)
+            self._conn.commit()
+
+    def runs(self) -> pd.DataFrame:
+        rows = self._execute(
+            "SELECT r.run_id, r.created, r.metadata, COUNT(DISTINCT s.example_id), COUNT(s.id) "
+            "FROM runs r LEFT JOIN results s ON r.run_id = s.run_id GROUP BY r.run_id ORDER BY r.created"
+        )
+        return pd.DataFrame(
+            [(run_id, datetime.fromtimestamp(created), json.loads(metadata), examples, results)
+             for run_id, created, metadata, examples, results in rows],
+            columns=["run_id", "created", "metadata", "examples", "results"],
+        )
+
+    # wide=Falseの場合は(Example, Metric)ごとの1行、wide=Trueの場合はExampleごとの1行(Metricごとの列)で返す
+    def load(self, run_id: str, wide: bool = False) -> pd.DataFrame:
+        rows = self._execute(
+            "SELECT example_id, metric, score, comment, created FROM results WHERE id IN "
+            "(SELECT MAX(id) FROM results WHERE run_id = ? GROUP BY example_id, metric) ORDER BY id",
+            (run_id,),
+        )
+        df = pd.DataFrame(rows, columns=["example_id", "metric", "score", "comment", "created"])
+        df["created"] = pd.to_datetime(df["created"], unit="s")
+        if wide:
+            return df.pivot(index="example_id", columns="metric", values="score")
+        return df
+
+    # Metricごとの件数(スコアが記録されたもの)・平均・標準偏差
+    def summary(self, run_id: str) -> pd.DataFrame:
+        return self.load(run_id).groupby("metric")["score"].agg(["count", "mean", "std"])
+
+
+class RunResults:
+    # 1回の評価の実行に対する結果の読み書き。評価済みの結果はメモリ上にも保持する
+    def __init__(self, store: ResultsStore, run_id: str):
+        self.store = store
+        self.run_id = run_id
+        self._scores: dict[tuple[str, str], float] = {}
+        for example_id, metric, score in store._execute(
+            "SELECT example_id, metric, score FROM results WHERE run_id = ? ORDER BY id", (run_id,)
+        ):
+            if score is None:
+                self._scores.pop((example_id, metric), None)
+            else:
+                self._scores[(example_id, metric)] = score
+        self._outputs = {
+            key: json.loads(outputs)
+            for key, outputs in store._execute("SELECT key, outputs FROM outputs WHERE run_id = ?", (run_id,))
+        }
+        self.reused = 0
+
+    @property
+    def completed(self) -> int:
+        return len(self._scores)
+
+    @property
+    def stats(self) -> str:
+        return f"results: run_id={self.run_id} completed={self.completed} reused={self.reused}"
+
+    # スコアが記録されていない(失敗・タイムアウトした)結果は再開時に評価し直す
+    def score(self, example_id: str, metric: str) -> Optional[float]:
+        score = self._scores.get((example_id, metric))
+        self.reused += score is not None
+        return score
+
+    def is_completed(self, example_id: str, metrics: list[str]) -> bool:
+        return all((example_id, metric) in self._scores for metric in metrics)
+
+    def add(self, example_id: str, metric: str, score: Optional[float], comment: Optional[str] = None):
+        if score is not None and isinstance(score, float) and math.isnan(score):
+            score, comment = None, comment or "nan"
+        self.store._insert("INSERT INTO results (run_id, example_id, metric, score, comment, created) "
+                           "VALUES (?, ?, ?, ?, ?, ?)",
+                           (self.run_id, example_id, metric, score, comment, time.time()))
+        if score is not None:
+            self._scores[(example_id, metric)] = score
+
+    def outputs(self, inputs: dict[str, Any]) -> Optional[dict[str, Any]]:
+        return self._outputs.get(inputs_key(inputs))
+
+    def add_outputs(self, inputs: dict[str, Any], outputs: dict[str, Any]):
+        key = inputs_key(inputs)
+        self.store._insert("INSERT OR IGNORE INTO outputs VALUES (?, ?, ?, ?)",
+                           (self.run_id, key, json.dumps(outputs, ensure_ascii=False), time.time()))
+        self._outputs.setdefault(key, outputs)
+
+    def load(self, wide: bool = False) -> pd.DataFrame:
+        return self.store.load(self.run_id, wide=wide)
+
+    def summary(self) -> pd.DataFrame:
+        return self.store.summary(self.run_id)
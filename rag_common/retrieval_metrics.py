@@ -0,0 +1,124 @@
+# LLMを利用しない検索の評価指標(hit@k, recall@k, MRR@k, nDCG@k)
+# retrieved_contextsとreference_contextsの文字バイグラムの重なりから関連の有無を判定する
+# チャンクの分け方が異なっても判定できるよう、重なりは短い方のバイグラム数で割った値(overlap coefficient)とする
+import typing as t
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Optional, Sequence
+
+import numpy as np
+from langchain_core.callbacks import Callbacks
+from ragas import SingleTurnSample
+from ragas.metrics.base import MetricOutputType, MetricType, SingleTurnMetric
+from ragas.run_config import RunConfig
+
+MEASURES = ("hit", "recall", "mrr", "ndcg")
+DEFAULT_THRESHOLD = 0.5
+# 1度の行列演算で処理するサンプル数(バイグラムの語彙数に比例してメモリを利用する)
+BATCH_SIZE = 64
+# RetrievalMetricの4つの指標で共有する、サンプルごとの重なりの行列の保持数
+OVERLAP_CACHE_SIZE = 1024
+
+
+def _bigrams(text: str) -> set[str]:
+    text = "".join(text.split())
+    return {text[i:i + 2] for i in range(len(text) - 1)} or {text}
+
+
+# サンプルごとの(retrievedの順位, reference)の重なりの行列を返す
+def overlap_matrices(retrieved: Sequence[Sequence[str]], references: Sequence[Sequence[str]]) -> list[np.ndarray]:
+    matrices = []
+    for start in range(0, len(retrieved), BATCH_SIZE):
+        batch_retrieved = retrieved[start:start + BATCH_SIZE]
+        batch_references = references[start:start + BATCH_SIZE]
+        texts = [c for contexts in batch_retrieved for c in contexts] + [c for contexts in batch_references for c in contexts]
+        grams = [_bigrams(text) for text in texts]
+        vocabulary = {g: i for i, g in enumerate(set().union(*grams))} if grams else {}
+        # バッチ内のすべてのコンテキストを0/1の行列にし、重なる数を行列積でまとめて求める
+        x = np.zeros((len(texts), len(vocabulary)), dtype=np.float32)
+        for row, text_grams in enumerate(grams):
+            x[row, [vocabulary[g] for g in text_grams]] = 1.0
+        sizes = x.sum(axis=1)
+        n_retrieved = sum(len(c) for c in batch_retrieved)
+        intersection = x[:n_retrieved] @ x[n_retrieved:].T
+        overlap = intersection / np.maximum(np.minimum.outer(sizes[:n_retrieved], sizes[n_retrieved:]), 1.0)
+        r, c = 0, n_retrieved
+        for retrieved_contexts, reference_contexts in zip(batch_retrieved, batch_references):
+            matrices.append(overlap[r:r + len(retrieved_contexts), c - n_retrieved:c - n_retrieved + len(reference_contexts)])
+            r += len(retrieved_contexts)
+            c += len(reference_contexts)
+    return matrices
+
+
+# 同じサンプルを評価する4つの指標で、重なりの行列を1度だけ計算して共有する
+@lru_cache(maxsize=OVERLAP_CACHE_SIZE)
+def _sample_overlap(retrieved: tuple[str, ...], references: tuple[str, ...]) -> np.ndarray:
+    return overlap_matrices([retrieved], [references])[0]
+
+
+def _scores(relevant: np.ndarray, k: int) -> dict[str, float]:
+    n_references = relevant.shape[1]
+    if n_references == 0:
+        return {measure: np.nan for measure in MEASURES}
+    if relevant.shape[0] == 0:
+        return {measure: 0.0 for measure in MEASURES}
+    top = relevant[:k]
+    hit_ranks = np.flatnonzero(top.any(axis=1))
+    # referenceごとに最初に一致した順位でのみ利得を数え、同じreferenceに一致するチャンクが続いても加算しない
+    first_ranks = np.where(top.any(axis=0), top.argmax(axis=0), -1)
+    gains = np.bincount(first_ranks[first_ranks >= 0], minlength=k)[:k]
+    discounts = 1.0 / np.log2(np.arange(2, k + 2))
+    ideal = discounts[:min(k, n_references)].sum()
+    return {
+        "hit": float(len(hit_ranks) > 0),
+        "recall": float(top.any(axis=0).mean()),
+        "mrr": float(1.0 / (hit_ranks[0] + 1)) if len(hit_ranks) else 0.0,
+        "ndcg": float(min((gains * discounts[:len(gains)]).sum() / ideal, 1.0)),
+    }
+
+
+# データセット全体の各指標を計算し、指標ごとのサンプル数分の配列を返す
+def retrieval_scores(retrieved: Sequence[Sequence[str]], references: Sequence[Sequence[str]], k: int = 5,
+                     threshold: float = DEFAULT_THRESHOLD) -> dict[str, np.ndarray]:
+    rows = [_scores(overlap >= threshold, k) for overlap in overlap_matrices(retrieved, references)]
+    return {measure: np.array([row[measure] for row in rows], dtype=np.float64) for measure in MEASURES}
+
+
+@dataclass
+class RetrievalMetric(SingleTurnMetric):
+    # measureにはhit / recall / mrr / ndcgのいずれかを指定する
+    # RagasEvaluatorやragasのevaluateにLLMを利用するMetricと同じように渡せる
+    name: str = ""
+    measure: str = "hit"
+    k: int = 5
+    threshold: float = DEFAULT_THRESHOLD
+    _required_columns: t.Dict[MetricType, t.Set[str]] = field(
+        default_factory=lambda: {MetricType.SINGLE_TURN: {"retrieved_contexts", "reference_contexts"}}
+    )
+    output_type: Optional[MetricOutputType] = MetricOutputType.CONTINUOUS
+
+    def __post_init__(self):
+        if self.measure not in MEASURES:
+            raise ValueError(f"measure must be one of {MEASURES}, got {self.measure!r}")
+        self.name = self.name or f"{self.measure}_at_{self.k}"
+        super().__post_init__()
+
+    # LLMを利用しないためScoreCacheのキーにはプロンプト・評価用LLMの情報が含まれない。代わりにkとthresholdを含める
+    @property
+    def cache_params(self) -> dict:
+        return {"measure": self.measure, "k": self.k, "threshold": self.threshold}
+
+    def init(self, run_config: RunConfig):
+        pass
+
+    async def _single_turn_ascore(self, sample: SingleTurnSample, callbacks: Callbacks) -> float:
+        overlap = _sample_overlap(tuple(sample.retrieved_contexts or []), tuple(sample.reference_contexts or []))
+        return float(_scores(overlap >= self.threshold, self.k)[self.measure])
+
+    async def _ascore(self, row: t.Dict, callbacks: Callbacks) -> float:
+        return await self._single_turn_ascore(SingleTurnSample(**row), callbacks)
+
+
+# hit@k, recall@k, MRR@k, nDCG@kの4つのMetricを返す
+def retrieval_metrics(k: int = 5, threshold: float = DEFAULT_THRESHOLD) -> list[RetrievalMetric]:
+    return [RetrievalMetric(measure=measure, k=k, threshold=threshold) for measure in MEASURES]
@@ -0,0 +1,108 @@
+# LLM-as-a-judgeによるMetricのスコアをSQLiteに保存して再利用するキャッシュ
+# キーはMetric名, プロンプトのバージョン, 評価用LLMのデプロイメント名と温度, サンプルの正規化したハッシュから作成する
+import hashlib
+import json
+import math
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from ragas import SingleTurnSample
+from ragas.metrics.base import Metric
+
+from rag_common.paths import cache_path
+
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+# Metricが利用するプロンプトの内容から作成したハッシュ。日本語化等でプロンプトが変わるとキーも変わる
+def prompt_version(metric: Metric) -> str:
+    get_prompts = getattr(metric, "get_prompts", None)
+    if get_prompts is None:
+        return ""
+    prompts = get_prompts()
+    text = "\n".join(
+        f"{name}:{getattr(p, 'language', '')}:{p.to_string() if hasattr(p, 'to_string') else p}"
+        for name, p in sorted(prompts.items())
+    )
+    return _sha256(text)[:16]
+
+
+# 評価用LLM(とEmbedding)のデプロイメント名と温度
+def judge_config(metric: Metric) -> dict:
+    config = {}
+    llm = getattr(getattr(metric, "llm", None), "langchain_llm", None)
+    if llm is not None:
+        config["llm"] = getattr(llm, "deployment_name", None) or getattr(llm, "model_name", None)
+        config["temperature"] = getattr(llm, "temperature", None)
+    embeddings = getattr(getattr(metric, "embeddings", None), "embeddings", None)
+    if embeddings is not None:
+        config["embeddings"] = getattr(embeddings, "namespace", None) or getattr(embeddings, "deployment", None)
+    return config
+
+
+# Metricが利用する列のみを対象に、キーの順序に依存しないJSONからハッシュを作成する
+def sample_hash(metric: Metric, sample: SingleTurnSample) -> str:
+    columns = metric.get_required_columns(with_optional=True).get("SINGLE_TURN") or None
+    data = sample.model_dump(include=columns, exclude_none=True)
+    return _sha256(json.dumps(data, ensure_ascii=False, sort_keys=True))
+
+
+class ScoreCache:
+    # bypass=Trueの場合はキャッシュを参照せずに必ず評価し、結果のみを保存する
+    def __init__(self, path: Optional[str] = None, bypass: bool = False):
+        self.bypass = bypass
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path or cache_path("scores.sqlite"), check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS scores (key TEXT PRIMARY KEY, metric TEXT, score REAL, created REAL)"
+        )
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    @property
+    def stats(self) -> str:
+        return f"score cache: hits={self.hits} misses={self.misses} hit_rate={self.hit_rate:.1%}"
+
+    def key(self, metric: Metric, sample: SingleTurnSample) -> str:
+        # set_prompts(日本語化等)で差し替えたプロンプトを反映するため、プロンプトは毎回ハッシュ化する
+        parts = {
+            "metric": metric.name,
+            "prompt": prompt_version(metric),
+            "judge": judge_config(metric),
+            "sample": sample_hash(metric, sample),
+        }
+        # LLMを利用しないMetric等、スコアがパラメータ(kや閾値)で変わるMetricはcache_paramsもキーに含める
+        params = getattr(metric, "cache_params", None)
+        if params:
+            parts["params"] = params
+        return _sha256(json.dumps(parts, sort_keys=True))
+
+    def get(self, key: str) -> Optional[float]:
+        if self.bypass:
+            self.misses += 1
+            return None
+        with self._lock:
+            row = self._conn.execute("SELECT score FROM scores WHERE key = ?", (key,)).fetchone()
+        if row is None or row[0] is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0]
+
+    def set(self, key: str, metric_name: str, score: float):
+        # 評価に失敗した(NaN)スコアは保存しない
+        if score is None or (isinstance(score, float) and math.isnan(score)):
+            return
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?)",
+                               (key, metric_name, float(score), time.time()))
+            self._conn.commit()
@@ -0,0 +1,109 @@
+# 環境変数LOCAL_INDEX_DIRが設定されている場合はAzure AI Searchの代わりにローカルのBM25インデックスを利用する
+# LOCAL_SEARCH_MODEに"vector"または"hybrid"を指定すると、ローカルのベクトル検索・ハイブリッド検索を利用する
+import hashlib
+import json
+import os
+from langchain_core.retrievers import BaseRetriever
+
+
+def use_local_index() -> bool:
+    return bool(os.getenv("LOCAL_INDEX_DIR"))
+
+
+def local_index_path(index_name: str) -> str:
+    return os.path.join(os.getenv("LOCAL_INDEX_DIR"), index_name)
+
+
+# チャンクと検索クエリのEmbeddingに利用するモデル(一度Embeddingしたテキストはキャッシュから取得する)
+def create_index_embeddings():
+    from rag_common.azure_openai import create_azure_openai_embeddings
+    from rag_common.embedding_cache import CachedEmbeddings
+    return CachedEmbeddings(create_azure_openai_embeddings(
+        azure_deployment=os.getenv("EMBEDDING_DEPLOYMENT_NAME")
+    ))
+
+
+# ローカルのインデックスにはチャンクのベクトルも保存する
+# Azure AI Searchのインデックスはベクトルのフィールドを定義していないため保存しない
+def index_embeddings():
+    if use_local_index() and os.getenv("EMBEDDING_DEPLOYMENT_NAME"):
+        return create_index_embeddings()
+    return None
+
+
+# インデックスの内容が変わると値が変わるバージョン文字列を返す(回答キャッシュの無効化に利用する)
+# ローカルのインデックスはmeta.jsonのversion、Azure AI Searchはこの環境で登録したチャンクIDの記録(IndexManifest)のハッシュを利用する
+def index_version(index_name: str) -> str:
+    if use_local_index():
+        path = os.path.join(local_index_path(index_name), "meta.json")
+    else:
+        from rag_common.paths import cache_path
+        path = os.path.join(cache_path("manifests"), f"{index_name}.json")
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return "none"
+    if use_local_index():
+        return json.loads(data)["version"]
+    return hashlib.sha256(data).hexdigest()
+
+
+# インデックスへの書き込み用クライアントを作成する
+def create_search_client(index_name: str):
+    if use_local_index():
+        from rag_common.local_search import LocalSearchClient
+        return LocalSearchClient(local_index_path(index_name))
+
+    from azure.core.credentials import AzureKeyCredential
+    from azure.search.documents import SearchClient
+    return SearchClient(
+        endpoint=os.environ["SEARCH_SERVICE_ENDPOINT"],
+        index_name=index_name,
+        credential=AzureKeyCredential(os.environ["SEARCH_API_KEY"])
+    )
+
+
+# 検索用のRetrieverを作成する。top_kの意味はAzureAISearchRetrieverと同じ
+def create_retriever(index_name: str, top_k: int = 3,
+                     service_name: str = "srch-sd-rag-evaluation") -> BaseRetriever:
+    if use_local_index():
+        mode = os.getenv("LOCAL_SEARCH_MODE", "keyword")
+        if mode == "vector":
+            from rag_common.vector_search import LocalVectorRetriever
+            return LocalVectorRetriever(index_path=local_index_path(index_name), embeddings=create_index_embeddings(), top_k=top_k)
+        if mode == "hybrid":
+            from rag_common.vector_search import LocalHybridRetriever
+            return LocalHybridRetriever(index_path=local_index_path(index_name), embeddings=create_index_embeddings(), top_k=top_k)
+        from rag_common.local_search import LocalBM25Retriever
+        return LocalBM25Retriever(index_path=local_index_path(index_name), top_k=top_k)
+
+    from langchain_community.retrievers import AzureAISearchRetriever
+    return AzureAISearchRetriever(
+        service_name=service_name,
+        content_key="content",
+        top_k=top_k,
+        index_name=index_name)
+
+
+# インデックスが存在しない場合はid / contentのフィールドを持つインデックスを作成する
+# 作成した場合はTrueを返す。ローカルのインデックスは書き込み時に作成されるため何もしない
+def ensure_index(index_name: str) -> bool:
+    if use_local_index():
+        return False
+
+    from azure.core.credentials import AzureKeyCredential
+    from azure.search.documents.indexes import SearchIndexClient
+    from azure.search.documents.indexes.models import SearchableField, SearchFieldDataType, SearchIndex, SimpleField
+
+    client = SearchIndexClient(endpoint=os.environ["SEARCH_SERVICE_ENDPOINT"],
+                               credential=AzureKeyCredential(os.environ["SEARCH_API_KEY"]))
+    if index_name in client.list_index_names():
+        return False
+
+    fields = [
+        SimpleField(name="id", type=SearchFieldDataType.String, key=True),
+        SearchableField(name="content", type="Edm.String", analyzer_name="ja.microsoft"),
+    ]
+    client.create_index(SearchIndex(name=index_name, fields=fields))
+    return True
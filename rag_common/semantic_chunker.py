@@ -0,0 +1,146 @@
+# 意味的な類似度に基づいてテキストを分割するチャンカー
+# langchain_experimentalのSemanticChunkerと同じ境界を、Embeddingのバッチ化とnumpyによる一括計算で求める
+import copy
+import re
+from typing import Optional
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+# 日本語の句点・感嘆符・疑問符と改行で文を区切る
+JAPANESE_SENTENCE_SPLIT_REGEX = r"(?<=[。！？\.\?\\n])\s*|\n"
+
+BREAKPOINT_DEFAULTS = {
+    "percentile": 95,
+    "standard_deviation": 3,
+    "interquartile": 1.5,
+    "gradient": 95,
+}
+
+
+class FastSemanticChunker:
+    # パラメータはSemanticChunkerと同じ。max_chunk_sizeを指定すると、それを超えるチャンクを文の区切りで分割する
+    def __init__(self, embeddings: Embeddings, buffer_size: int = 1, add_start_index: bool = False,
+                 breakpoint_threshold_type: str = "percentile",
+                 breakpoint_threshold_amount: Optional[float] = None,
+                 number_of_chunks: Optional[int] = None,
+                 sentence_split_regex: str = JAPANESE_SENTENCE_SPLIT_REGEX,
+                 min_chunk_size: Optional[int] = None, max_chunk_size: Optional[int] = None,
+                 batch_size: int = 1000):
+        if breakpoint_threshold_type not in BREAKPOINT_DEFAULTS:
+            raise ValueError(f"Got unexpected `breakpoint_threshold_type`: {breakpoint_threshold_type}")
+        self.embeddings = embeddings
+        self.buffer_size = buffer_size
+        self.add_start_index = add_start_index
+        self.breakpoint_threshold_type = breakpoint_threshold_type
+        self.breakpoint_threshold_amount = (
+            BREAKPOINT_DEFAULTS[breakpoint_threshold_type]
+            if breakpoint_threshold_amount is None else breakpoint_threshold_amount
+        )
+        self.number_of_chunks = number_of_chunks
+        self.sentence_split_regex = sentence_split_regex
+        self.min_chunk_size = min_chunk_size
+        self.max_chunk_size = max_chunk_size
+        self.batch_size = batch_size
+
+    # 前後buffer_size文を含めた文をまとめてEmbeddingする
+    def _embed(self, sentences: list[str]) -> np.ndarray:
+        n, b = len(sentences), self.buffer_size
+        combined = [" ".join(sentences[max(0, i - b):min(n, i + b + 1)]) for i in range(n)]
+        vectors = []
+        for start in range(0, n, self.batch_size):
+            vectors.extend(self.embeddings.embed_documents(combined[start:start + self.batch_size]))
+        return np.asarray(vectors, dtype=np.float64)
+
+    # 隣り合う文のコサイン距離を一括で計算する
+    @staticmethod
+    def _distances(embeddings: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(embeddings, axis=1)
+        dots = np.einsum("ij,ij->i", embeddings[:-1], embeddings[1:])
+        denominators = norms[:-1] * norms[1:]
+        similarity = np.divide(dots, denominators, out=np.zeros_like(dots), where=denominators != 0)
+        return 1 - similarity
+
+    def _threshold(self, distances: np.ndarray) -> tuple[float, np.ndarray]:
+        if self.number_of_chunks is not None:
+            # チャンク数からパーセンタイルを線形補間で求める
+            x1, y1, x2, y2 = len(distances), 0.0, 1.0, 100.0
+            x = max(min(self.number_of_chunks, x1), x2)
+            y = y2 if x2 == x1 else y1 + ((y2 - y1) / (x2 - x1)) * (x - x1)
+            return float(np.percentile(distances, min(max(y, 0), 100))), distances
+
+        amount = self.breakpoint_threshold_amount
+        if self.breakpoint_threshold_type == "percentile":
+            return float(np.percentile(distances, amount)), distances
+        if self.breakpoint_threshold_type == "standard_deviation":
+            return float(np.mean(distances) + amount * np.std(distances)), distances
+        if self.breakpoint_threshold_type == "interquartile":
+            q1, q3 = np.percentile(distances, [25, 75])
+            return float(np.mean(distances) + amount * (q3 - q1)), distances
+        gradient = np.gradient(distances, np.arange(len(distances)))
+        return float(np.percentile(gradient, amount)), gradient
+
+    # max_chunk_sizeを超えるチャンクを、文の区切りでmax_chunk_size以下になるように分割する
+    def _limit_size(self, sentences: list[str]) -> list[str]:
+        chunks, current = [], []
+        for sentence in sentences:
+            while len(sentence) > self.max_chunk_size:
+                if current:
+                    chunks.append(" ".join(current))
+                    current = []
+                chunks.append(sentence[:self.max_chunk_size])
+                sentence = sentence[self.max_chunk_size:]
+            if current and len(" ".join(current)) + 1 + len(sentence) > self.max_chunk_size:
+                chunks.append(" ".join(current))
+                current = []
+            current.append(sentence)
+        if current:
+            chunks.append(" ".join(current))
+        return chunks
+
+    def _group(self, sentences: list[str], start: int, end: int) -> list[str]:
+        group = sentences[start:end]
+        text = " ".join(group)
+        if self.max_chunk_size is not None and len(text) > self.max_chunk_size:
+            return self._limit_size(group)
+        return [text]
+
+    def split_text(self, text: str) -> list[str]:
+        sentences = re.split(self.sentence_split_regex, text)
+        if len(sentences) == 1:
+            return sentences
+        if self.breakpoint_threshold_type == "gradient" and len(sentences) == 2:
+            return sentences
+
+        distances = self._distances(self._embed(sentences))
+        threshold, breakpoint_array = self._threshold(distances)
+        breakpoints = np.flatnonzero(breakpoint_array > threshold)
+
+        # 各区切り位置までの文字数(文の間の空白を含む)を累積和で求め、min_chunk_size未満の区切りは次の区切りとまとめる
+        lengths = np.cumsum([len(s) + 1 for s in sentences])
+        chunks, start = [], 0
+        for index in breakpoints:
+            end = index + 1
+            if self.min_chunk_size is not None:
+                size = lengths[index] - (lengths[start - 1] if start > 0 else 0) - 1
+                if size < self.min_chunk_size:
+                    continue
+            chunks.extend(self._group(sentences, start, end))
+            start = end
+        if start < len(sentences):
+            chunks.extend(self._group(sentences, start, len(sentences)))
+        return chunks
+
+    def create_documents(self, texts: list[str], metadatas: Optional[list[dict]] = None) -> list[Document]:
+        metadatas = metadatas or [{}] * len(texts)
+        documents = []
+        for text, metadata in zip(texts, metadatas):
+            start_index = 0
+            for chunk in self.split_text(text):
+                chunk_metadata = copy.deepcopy(metadata)
+                if self.add_start_index:
+                    chunk_metadata["start_index"] = start_index
+                documents.append(Document(page_content=chunk, metadata=chunk_metadata))
+                start_index += len(chunk)
+        return documents
@@ -0,0 +1,163 @@
+# 逐次サンプリングによる評価
+# Exampleをsynthesizer_nameで層別したランダムな順序で評価し、Metricごとに平均の信頼区間を更新する
+# 信頼区間の幅が目標値以下になったMetric、または評価件数の上限に達したMetricから評価を打ち切る
+import asyncio
+import math
+import random
+from collections import defaultdict
+from dataclasses import dataclass, field
+from statistics import NormalDist
+from typing import Any, Awaitable, Callable, Optional, Sequence
+
+import numpy as np
+from langsmith.schemas import Example
+
+from rag_common.ragas_evaluator import RagasEvaluator, to_sample
+
+DEFAULT_TARGET_WIDTH = 0.04
+DEFAULT_CONFIDENCE = 0.95
+DEFAULT_MIN_EXAMPLES = 30
+BOOTSTRAP_RESAMPLES = 2000
+
+
+# 層(synthesizer_name)ごとにシャッフルし、どの時点で打ち切っても各層の割合がDataset全体と同じになるように並べる
+def stratified_order(examples: Sequence[Example], key: str = "synthesizer_name", seed: int = 0) -> list[Example]:
+    rng = random.Random(seed)
+    strata = defaultdict(list)
+    for example in examples:
+        strata[(example.metadata or {}).get(key)].append(example)
+    positions = []
+    for members in strata.values():
+        rng.shuffle(members)
+        offset = rng.random()
+        positions.extend(((i + offset) / len(members), rng.random(), example) for i, example in enumerate(members))
+    return [example for *_, example in sorted(positions, key=lambda p: p[:2])]
+
+
+def wilson_interval(successes: float, n: int, confidence: float = DEFAULT_CONFIDENCE) -> tuple[float, float]:
+    if n == 0:
+        return 0.0, 1.0
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    p = successes / n
+    center = (p + z * z / (2 * n)) / (1 + z * z / n)
+    margin = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / (1 + z * z / n)
+    return max(0.0, center - margin), min(1.0, center + margin)
+
+
+def bootstrap_interval(scores: Sequence[float], confidence: float = DEFAULT_CONFIDENCE,
+                       resamples: int = BOOTSTRAP_RESAMPLES, seed: int = 0) -> tuple[float, float]:
+    values = np.asarray(scores, dtype=np.float64)
+    if len(values) == 0:
+        return 0.0, 1.0
+    rng = np.random.default_rng(seed)
+    means = values[rng.integers(0, len(values), size=(resamples, len(values)))].mean(axis=1)
+    lower, upper = np.quantile(means, [(1 - confidence) / 2, (1 + confidence) / 2])
+    return float(lower), float(upper)
+
+
+# method="auto"の場合、スコアが0/1のみのMetricはWilson、それ以外はブートストラップで信頼区間を求める
+def confidence_interval(scores: Sequence[float], confidence: float = DEFAULT_CONFIDENCE,
+                        method: str = "auto") -> tuple[float, float]:
+    if method == "auto":
+        method = "wilson" if all(s in (0.0, 1.0) for s in scores) else "bootstrap"
+    if method == "wilson":
+        return wilson_interval(sum(scores), len(scores), confidence)
+    return bootstrap_interval(scores, confidence)
+
+
+@dataclass
+class MetricEstimate:
+    name: str
+    scores: list[float] = field(default_factory=list)
+    # スコアを得られなかった(失敗・タイムアウト)件数も含めた評価件数
+    attempted: int = 0
+    lower: float = 0.0
+    upper: float = 1.0
+    # running / converged(目標の幅に到達) / budget(評価件数の上限) / exhausted(Exampleをすべて評価)
+    status: str = "running"
+
+    @property
+    def n(self) -> int:
+        return len(self.scores)
+
+    @property
+    def mean(self) -> float:
+        return float(np.mean(self.scores)) if self.scores else math.nan
+
+    @property
+    def width(self) -> float:
+        return self.upper - self.lower
+
+    def to_dict(self) -> dict[str, Any]:
+        return {"metric": self.name, "mean": self.mean, "lower": self.lower, "upper": self.upper,
+                "width": self.width, "n": self.n, "attempted": self.attempted, "status": self.status}
+
+
+class SequentialEvaluator:
+    # targetはaevaluateに渡すものと同じ非同期関数(inputsを受け取り、response / retrieved_contextsを返す)
+    # target_widthは信頼区間の幅(±0.02の場合は0.04)、max_examplesはMetricごとの評価件数の上限
+    def __init__(self, evaluator: RagasEvaluator, target: Callable[[dict[str, Any]], Awaitable[dict[str, Any]]],
+                 target_width: float = DEFAULT_TARGET_WIDTH, confidence: float = DEFAULT_CONFIDENCE,
+                 min_examples: int = DEFAULT_MIN_EXAMPLES, max_examples: Optional[int] = None,
+                 method: str = "auto", batch_size: int = 8, seed: int = 0):
+        self.evaluator = evaluator
+        self.target = target
+        self.target_width = target_width
+        self.confidence = confidence
+        self.min_examples = min_examples
+        self.max_examples = max_examples
+        self.method = method
+        self.batch_size = batch_size
+        self.seed = seed
+        self.predictions = 0
+
+    async def _evaluate(self, example: Example, metrics: list) -> list[dict[str, Any]]:
+        outputs = await self.target(example.inputs)
+        self.predictions += 1
+        return await self.evaluator.evaluate_sample(to_sample(outputs, example), str(example.id), metrics)
+
+    # batch_size件ずつ評価し、バッチごとに信頼区間を更新して打ち切るMetricを判定する
+    async def run(self, examples: Sequence[Example]) -> dict[str, MetricEstimate]:
+        metrics = self.evaluator.metrics
+        estimates = {metric.name: MetricEstimate(metric.name) for metric in metrics}
+        order = stratified_order(examples, seed=self.seed)
+        for start in range(0, len(order), self.batch_size):
+            active = [metric for metric in metrics if estimates[metric.name].status == "running"]
+            if not active:
+                break
+            batch = order[start:start + self.batch_size]
+            outcomes = await asyncio.gather(*(self._evaluate(example, active) for example in batch),
+                                            return_exceptions=True)
+            for outcome in outcomes:
+                if isinstance(outcome, BaseException):
+                    print(f"prediction failed: {outcome!r}")
+                    continue
+                for result in outcome:
+                    estimate = estimates[result["key"]]
+                    estimate.attempted += 1
+                    score = result["score"]
+                    if score is not None and not math.isnan(score):
+                        estimate.scores.append(float(score))
+            for metric in active:
+                self._update(estimates[metric.name])
+            print(f"{min(start + self.batch_size, len(order))}/{len(order)} examples: " + ", ".join(
+                f"{e.name}={e.mean:.3f}±{e.width / 2:.3f}" for e in estimates.values()))
+        for estimate in estimates.values():
+            if estimate.status == "running":
+                estimate.status = "exhausted"
+        return estimates
+
+    def _update(self, estimate: MetricEstimate):
+        estimate.lower, estimate.upper = confidence_interval(estimate.scores, self.confidence, self.method)
+        if estimate.n >= self.min_examples and estimate.width <= self.target_width:
+            estimate.status = "converged"
+        elif self.max_examples is not None and estimate.attempted >= self.max_examples:
+            estimate.status = "budget"
+
+    def report(self, estimates: dict[str, MetricEstimate]) -> str:
+        lines = [f"sequential evaluation: {self.predictions} predictions, "
+                 f"{sum(e.attempted for e in estimates.values())} metric evaluations"]
+        for e in estimates.values():
+            lines.append(f"{e.name}: mean={e.mean:.3f} {self.confidence:.0%} CI=[{e.lower:.3f}, {e.upper:.3f}] "
+                         f"(±{e.width / 2:.3f}) n={e.n} {e.status}")
+        return "\n".join(lines)
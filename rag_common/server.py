@@ -0,0 +1,223 @@
+# RagPipelineを常駐させて質問を受け付けるサーバー
+# 質問ごとにプロセスを起動せず、構築済みのretrieverとLLMのクライアント(HTTP接続)を使い回す
+# ローカルのHTTPエンドポイントと、標準入力から1行1リクエストのJSONを読み込むモードを提供する
+import asyncio
+import json
+import sys
+import urllib.error
+import urllib.request
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Iterator
+
+# 実行中と待機中のリクエスト数が上限に達している場合に返すHTTPステータス
+BUSY_STATUS = 503
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class RagServer:
+    # 同時に回答を生成するのはmax_concurrency件までとし、さらにqueue_depth件まで待機させる
+    def __init__(self, pipeline, max_concurrency: int = 8, queue_depth: int = 64):
+        self.pipeline = pipeline
+        self.max_concurrency = max_concurrency
+        self.queue_depth = queue_depth
+        self.pending = 0
+        self.completed = 0
+        self._semaphore = None
+
+    # 実行枠を1つ確保する。上限を超えている場合はQueueFullErrorとする
+    @asynccontextmanager
+    async def _slot(self):
+        if self.pending >= self.max_concurrency + self.queue_depth:
+            raise QueueFullError(f"too many requests (pending={self.pending})")
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.pending += 1
+        try:
+            async with self._semaphore:
+                yield
+        finally:
+            self.pending -= 1
+            self.completed += 1
+
+    async def answer(self, question: str) -> dict[str, Any]:
+        async with self._slot():
+            return await self.pipeline.ainvoke(question)
+
+    async def stream(self, question: str) -> AsyncIterator[dict[str, Any]]:
+        async with self._slot():
+            async for event in self.pipeline.astream(question):
+                yield event
+
+    # POST /answer に {"question": "..."} を送ると {"response": "...", "retrieved_contexts": [...]} を返す
+    # POST /answer/stream の場合はRagPipeline.astreamのイベントを1行ずつのJSONとしてチャンク形式で返す
+    async def serve_http(self, host: str = "127.0.0.1", port: int = 8080):
+        server = await asyncio.start_server(self._handle_connection, host, port)
+        print(f"listening on http://{host}:{port} "
+              f"(max_concurrency={self.max_concurrency}, queue_depth={self.queue_depth})", file=sys.stderr)
+        async with server:
+            await server.serve_forever()
+
+    # Keep-Aliveの接続では同じ接続で続けてリクエストを受け付ける
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length") or 0))
+                keep_alive = headers.get("connection", "").lower() != "close"
+
+                if method == "POST" and path == "/answer/stream":
+                    await self._stream_response(writer, body, keep_alive)
+                else:
+                    status, payload = await self._route(method, path, body)
+                    self._write_json(writer, status, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route(self, method: str, path: str, body: bytes) -> tuple[int, dict[str, Any]]:
+        if method == "GET" and path == "/health":
+            status = {"status": "ok", "pending": self.pending, "completed": self.completed}
+            answer_cache = getattr(self.pipeline, "answer_cache", None)
+            if answer_cache is not None:
+                status["answer_cache"] = answer_cache.stats
+            return 200, status
+        if method != "POST" or path != "/answer":
+            return 404, {"error": f"{method} {path} not found"}
+        question = _parse_question(body)
+        if question is None:
+            return 400, {"error": 'request body must be {"question": "..."}'}
+        try:
+            return 200, await self.answer(question)
+        except QueueFullError as e:
+            return BUSY_STATUS, {"error": str(e)}
+        except Exception as e:
+            return 500, {"error": repr(e)}
+
+    def _write_json(self, writer: asyncio.StreamWriter, status: int, payload: dict[str, Any], keep_alive: bool):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        writer.write(_headers(status, keep_alive, f"Content-Length: {len(data)}") + data)
+
+    async def _stream_response(self, writer: asyncio.StreamWriter, body: bytes, keep_alive: bool):
+        question = _parse_question(body)
+        if question is None:
+            self._write_json(writer, 400, {"error": 'request body must be {"question": "..."}'}, keep_alive)
+            return
+        # 最初のイベント(検索結果)を取得するまではエラーを通常のレスポンスとして返す
+        events = self.stream(question)
+        try:
+            event = await events.__anext__()
+        except QueueFullError as e:
+            self._write_json(writer, BUSY_STATUS, {"error": str(e)}, keep_alive)
+            return
+        except Exception as e:
+            self._write_json(writer, 500, {"error": repr(e)}, keep_alive)
+            return
+
+        writer.write(_headers(200, keep_alive, "Transfer-Encoding: chunked", "application/x-ndjson"))
+        try:
+            while True:
+                data = (json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8")
+                writer.write(f"{len(data):X}\r\n".encode("latin-1") + data + b"\r\n")
+                await writer.drain()
+                try:
+                    event = await events.__anext__()
+                except StopAsyncIteration:
+                    break
+                except Exception as e:
+                    event = {"type": "error", "error": repr(e)}
+        finally:
+            await events.aclose()
+        writer.write(b"0\r\n\r\n")
+
+    # 標準入力の1行ごとの{"id": ..., "question": "..."}に対し、回答が生成された順に標準出力へ1行ずつ結果を書き込む
+    # 上限まで処理中の場合は標準入力の読み込みを止めて待つ
+    async def serve_stdin(self):
+        loop = asyncio.get_running_loop()
+        tasks: set[asyncio.Task] = set()
+        while True:
+            line = await loop.run_in_executor(None, sys.stdin.readline)
+            if not line:
+                break
+            if not line.strip():
+                continue
+            while len(tasks) >= self.max_concurrency + self.queue_depth:
+                await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            task = asyncio.create_task(self._answer_line(line))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.wait(tasks)
+
+    async def _answer_line(self, line: str):
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get("id")
+            result = {"id": request_id, **await self.answer(request["question"])}
+        except Exception as e:
+            result = {"id": request_id, "error": repr(e)}
+        print(json.dumps(result, ensure_ascii=False), flush=True)
+
+
+def _parse_question(body: bytes):
+    try:
+        question = json.loads(body)["question"]
+    except (ValueError, KeyError, TypeError):
+        return None
+    return question if isinstance(question, str) else None
+
+
+def _headers(status: int, keep_alive: bool, length_header: str, content_type: str = "application/json") -> bytes:
+    return (
+        f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+        f"Content-Type: {content_type}; charset=utf-8\r\n"
+        f"{length_header}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+    ).encode("latin-1")
+
+
+# 起動中のサーバーに質問を送信する(langchain等を読み込まない軽量なクライアント)
+def _request(url: str, path: str, question: str) -> urllib.request.Request:
+    return urllib.request.Request(
+        url.rstrip("/") + path,
+        data=json.dumps({"question": question}, ensure_ascii=False).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+
+
+def request_answer(url: str, question: str, timeout: float = 300) -> dict[str, Any]:
+    try:
+        with urllib.request.urlopen(_request(url, "/answer", question), timeout=timeout) as response:
+            return json.load(response)
+    except urllib.error.HTTPError as e:
+        raise RuntimeError(f"server returned {e.code}: {e.read().decode('utf-8', 'replace')}") from e
+
+
+# /answer/streamのイベントを受信した順に返す
+def stream_answer(url: str, question: str, timeout: float = 300) -> Iterator[dict[str, Any]]:
+    try:
+        with urllib.request.urlopen(_request(url, "/answer/stream", question), timeout=timeout) as response:
+            for line in response:
+                if line.strip():
+                    yield json.loads(line)
+    except urllib.error.HTTPError as e:
+        raise RuntimeError(f"server returned {e.code}: {e.read().decode('utf-8', 'replace')}") from e
@@ -0,0 +1,74 @@
+# PDFのページを複数プロセスで並列に抽出し、ページ順にテキストを返すストリーミング処理
+# 全ページのテキストを保持せずに、抽出が終わった部分から順にチャンク化できる
+import os
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Iterator
+
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from pypdf import PdfReader
+
+_reader = None
+
+
+def _init_reader(filepath: str):
+    global _reader
+    _reader = PdfReader(filepath)
+
+
+def _extract_page(page_number: int) -> str:
+    return _reader.pages[page_number].extract_text()
+
+
+# ページのテキストを順番に返す。同時に処理中・未読のページ数はwindowまでに抑える
+def iter_pdf_pages(filepath: str, workers: int = None, window: int = None) -> Iterator[str]:
+    workers = workers or os.cpu_count()
+    window = window or workers * 2
+    page_count = len(PdfReader(filepath).pages)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_reader, initargs=(filepath,)) as executor:
+        pending = deque()
+        next_page = 0
+        while next_page < page_count or pending:
+            while next_page < page_count and len(pending) < window:
+                pending.append(executor.submit(_extract_page, next_page))
+                next_page += 1
+            yield pending.popleft().result()
+
+
+# 順に届くテキストを連結しながら、テキスト全体をRecursiveCharacterTextSplitterでsplit_textした場合と同じチャンクに分割する
+# RecursiveCharacterTextSplitterは、テキストに含まれる最初の区切り文字で分割した区間をチャンクサイズまで連結する
+# そのため、先頭の区切り文字(separators[0])が現れて分割に使う区切り文字が確定した後に、
+# チャンクサイズ以上の区間(前後の区間と連結されない)の手前でのみバッファを区切り、区切った前半をチャンク化する
+# 区切れる位置が無い場合(先頭の区切り文字を含まないテキスト等)はテキストの終わりまでバッファに保持してからチャンク化する
+def split_stream(texts: Iterable[str], separators: list[str], chunk_size: int, chunk_overlap: int = 0,
+                 buffer_size: int = None) -> Iterator[str]:
+    splitter = RecursiveCharacterTextSplitter(separators=separators, chunk_size=chunk_size,
+                                              chunk_overlap=chunk_overlap)
+    # バッファがbuffer_size増えるごとに区切れる位置を探す
+    buffer_size = buffer_size or chunk_size * 8
+    separator = separators[0]
+    buffer, checked, confirmed = "", 0, False
+    for text in texts:
+        buffer += text
+        if len(buffer) - checked < buffer_size:
+            continue
+        checked = len(buffer)
+        confirmed = confirmed or (separator != "" and separator in buffer)
+        cut = _last_long_section(buffer, separator, chunk_size) if confirmed else 0
+        if cut > 0:
+            yield from splitter.split_text(buffer[:cut])
+            buffer = buffer[cut:]
+            checked = len(buffer)
+    if buffer:
+        yield from splitter.split_text(buffer)
+
+
+# separatorで始まり、次のseparatorまでの長さがchunk_size以上の区間のうち、最後のものの開始位置(無い場合は0)
+def _last_long_section(buffer: str, separator: str, chunk_size: int) -> int:
+    positions = [m.start() for m in re.finditer(re.escape(separator), buffer)]
+    for start, end in zip(reversed(positions[:-1]), reversed(positions[1:])):
+        if end - start >= chunk_size:
+            return start
+    return 0
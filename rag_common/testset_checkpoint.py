@@ -0,0 +1,100 @@
+# テストセット生成の途中経過をシャードごとのJSONLファイルとして保存する
+# 生成が終わったシャードとLangSmithへの登録済み件数をstate.jsonに記録し、途中で失敗しても続きから再開できるようにする
+# すべてのシャードの生成・登録が終わったチェックポイントは再開せず、次の実行では新しいテストセットを生成する
+import json
+import os
+import uuid
+from typing import Any
+
+SHARD_FILE = "shard_{:05d}.jsonl"
+
+
+class TestsetCheckpoint:
+    # 同じディレクトリでシャードの分け方を変えると続きから再開できないため、その場合はエラーとする
+    def __init__(self, path: str, testset_size: int, shard_size: int):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.state_path = os.path.join(path, "state.json")
+        if os.path.exists(self.state_path):
+            with open(self.state_path, encoding="utf-8") as f:
+                self.state = json.load(f)
+            if (self.state["testset_size"], self.state["shard_size"]) != (testset_size, shard_size):
+                raise ValueError(
+                    f"checkpoint {path} was created with testset_size={self.state['testset_size']} "
+                    f"shard_size={self.state['shard_size']}; use the same values to resume or --restart to discard it"
+                )
+        else:
+            # 登録するExampleのIDを実行ごとに一意にするためのID
+            self.state = {"run_id": str(uuid.uuid4()), "testset_size": testset_size,
+                          "shard_size": shard_size, "uploaded": {}}
+            self._save_state()
+
+    @property
+    def shard_sizes(self) -> list[int]:
+        size, shard_size = self.state["testset_size"], self.state["shard_size"]
+        return [min(shard_size, size - start) for start in range(0, size, shard_size)]
+
+    def _shard_path(self, shard: int) -> str:
+        return os.path.join(self.path, SHARD_FILE.format(shard))
+
+    def is_completed(self, shard: int) -> bool:
+        return os.path.exists(self._shard_path(shard))
+
+    def pending_shards(self) -> list[int]:
+        return [i for i in range(len(self.shard_sizes)) if not self.is_completed(i)]
+
+    def save_shard(self, shard: int, rows: list[dict[str, Any]]):
+        tmp_path = f"{self._shard_path(shard)}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self._shard_path(shard))
+
+    def load_shard(self, shard: int) -> list[dict[str, Any]]:
+        with open(self._shard_path(shard), encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    # 生成済みでLangSmithに未登録の行を(シャード番号, 行番号, 行)として返す
+    def pending_rows(self) -> list[tuple[int, int, dict[str, Any]]]:
+        rows = []
+        for shard in range(len(self.shard_sizes)):
+            if not self.is_completed(shard):
+                continue
+            uploaded = self.state["uploaded"].get(str(shard), 0)
+            rows.extend((shard, i, row) for i, row in enumerate(self.load_shard(shard)) if i >= uploaded)
+        return rows
+
+    # 再実行時に同じ行へ同じIDを割り当て、登録済みのExampleを重複して登録しないようにする
+    def example_id(self, shard: int, row: int) -> str:
+        return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{self.state['run_id']}/{shard}/{row}"))
+
+    def mark_uploaded(self, rows: list[tuple[int, int, dict[str, Any]]]):
+        uploaded = self.state["uploaded"]
+        for shard, i, _ in rows:
+            uploaded[str(shard)] = max(uploaded.get(str(shard), 0), i + 1)
+        self._save_state()
+
+    # すべてのシャードを生成し、生成した行をすべてLangSmithに登録したか
+    @property
+    def finished(self) -> bool:
+        return not self.pending_shards() and not self.pending_rows()
+
+    @property
+    def uploaded_count(self) -> int:
+        return sum(self.state["uploaded"].values())
+
+    def _save_state(self):
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.state_path)
+
+
+# pathに保存されたチェックポイントが生成・登録を終えているかを、シャードの分け方を指定せずに判定する
+def is_finished(path: str) -> bool:
+    state_path = os.path.join(path, "state.json")
+    if not os.path.exists(state_path):
+        return False
+    with open(state_path, encoding="utf-8") as f:
+        state = json.load(f)
+    return TestsetCheckpoint(path, state["testset_size"], state["shard_size"]).finished
@@ -0,0 +1,128 @@
+import json
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Any, Iterable, Iterator, Optional
+
+# Azure AI Searchの1リクエストあたりの上限(1000件 / 16MB)
+MAX_BATCH_DOCUMENTS = 1000
+MAX_BATCH_BYTES = 16 * 1024 * 1024
+
+# 部分失敗時に再送してよいステータスコード(409:競合, 422:一時的に利用不可, 503:高負荷)
+RETRYABLE_STATUS_CODES = {409, 422, 503}
+
+
+# SearchClientの登録系メソッドが返すIndexingResultと同じ属性を持つ、ローカル実装用の結果
+@dataclass
+class IndexingResult:
+    key: str
+    succeeded: bool
+    status_code: int
+    error_message: Optional[str] = None
+
+
+@dataclass
+class UploadStats:
+    succeeded: int = 0
+    failed: int = 0
+    retried: int = 0
+    batches: int = 0
+    elapsed: float = 0.0
+    failed_keys: list[str] = field(default_factory=list)
+    # 失敗したキーごとのエラーの内容(ステータスコードとメッセージ、または送信時の例外)
+    errors: dict[str, str] = field(default_factory=dict)
+
+    @property
+    def docs_per_sec(self) -> float:
+        return self.succeeded / self.elapsed if self.elapsed > 0 else 0.0
+
+    def __str__(self) -> str:
+        return (f"succeeded={self.succeeded} failed={self.failed} retried={self.retried} "
+                f"batches={self.batches} elapsed={self.elapsed:.2f}s ({self.docs_per_sec:.1f} docs/sec)")
+
+
+class BulkUploader:
+    # clientにはSearchClient(またはupload_documents等を同じシグネチャで持つローカル実装)を渡す
+    def __init__(self, client, key_field: str = "id",
+                 batch_size: int = MAX_BATCH_DOCUMENTS, max_batch_bytes: int = MAX_BATCH_BYTES,
+                 max_concurrency: int = 4, max_retries: int = 3, retry_backoff: float = 1.0):
+        self.client = client
+        self.key_field = key_field
+        self.batch_size = batch_size
+        self.max_batch_bytes = max_batch_bytes
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+
+    # documentsはジェネレーターでもよい。バッチが揃った順に送信し、同時に送信中のバッチ数はmax_concurrencyまでに抑える
+    # actionは"upload" / "merge_or_upload" / "delete"のいずれか
+    def upload(self, documents: Iterable[dict[str, Any]], action: str = "upload") -> UploadStats:
+        stats = UploadStats()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            in_flight = set()
+            for batch in self._batches(documents):
+                if len(in_flight) >= self.max_concurrency:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    self._collect(done, stats)
+                in_flight.add(executor.submit(self._send, batch, action))
+                stats.batches += 1
+            self._collect(in_flight, stats)
+        stats.elapsed = time.perf_counter() - start
+        return stats
+
+    # 件数とJSONのバイト数の両方の上限を超えないようにバッチを組み立てる
+    def _batches(self, documents: Iterable[dict[str, Any]]) -> Iterator[list[dict[str, Any]]]:
+        batch, batch_bytes = [], 0
+        for document in documents:
+            size = len(json.dumps(document, ensure_ascii=False).encode("utf-8"))
+            if batch and (len(batch) >= self.batch_size or batch_bytes + size > self.max_batch_bytes):
+                yield batch
+                batch, batch_bytes = [], 0
+            batch.append(document)
+            batch_bytes += size
+        if batch:
+            yield batch
+
+    def _collect(self, futures, stats: UploadStats):
+        for future in futures:
+            succeeded, errors, retried = future.result()
+            stats.succeeded += succeeded
+            stats.failed += len(errors)
+            stats.failed_keys.extend(errors)
+            stats.errors.update(errors)
+            stats.retried += retried
+
+    # 1バッチを送信する。部分失敗した場合は失敗したキーのドキュメントのみを再送する
+    # 失敗したキーとエラーの内容はUploadStatsに記録して呼び出し元に返す
+    def _send(self, batch: list[dict[str, Any]], action: str) -> tuple[int, dict[str, str], int]:
+        send = getattr(self.client, f"{action}_documents")
+        succeeded, errors, retried = 0, {}, 0
+        attempt = 0
+        while batch:
+            try:
+                results = send(documents=batch)
+            except Exception as e:
+                if attempt >= self.max_retries:
+                    errors.update((str(d[self.key_field]), repr(e)) for d in batch)
+                    break
+                attempt += 1
+                retried += len(batch)
+                time.sleep(self.retry_backoff * 2 ** (attempt - 1))
+                continue
+
+            retry_keys = set()
+            for result in results:
+                if result.succeeded:
+                    succeeded += 1
+                elif result.status_code in RETRYABLE_STATUS_CODES and attempt < self.max_retries:
+                    retry_keys.add(result.key)
+                else:
+                    errors[result.key] = f"{result.status_code}: {result.error_message}"
+
+            batch = [d for d in batch if str(d[self.key_field]) in retry_keys]
+            if batch:
+                attempt += 1
+                retried += len(batch)
+                time.sleep(self.retry_backoff * 2 ** (attempt - 1))
+        return succeeded, errors, retried
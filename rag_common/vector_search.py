@@ -0,0 +1,164 @@
+# ローカルのベクトルインデックスと、BM25との結果をReciprocal Rank Fusionで統合するハイブリッド検索
+# ベクトルは正規化したfloat32の行列としてBM25インデックスと同じディレクトリに保存し、読み込み時はメモリマップで開く
+# 件数が多い場合はk-meansによるIVF(転置ファイル)で探索範囲を絞り、少ない場合は全件との内積で厳密に検索する
+import os
+from typing import Any, Optional
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+from pydantic import PrivateAttr
+
+from rag_common.local_search import LocalBM25Index, _save_array
+
+VECTOR_FIELD = "content_vector"
+
+# この件数以上のベクトルがある場合にIVFを構築する
+IVF_THRESHOLD = 20000
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def _kmeans(vectors: np.ndarray, n_lists: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    sample = vectors[rng.choice(len(vectors), size=min(len(vectors), n_lists * 256), replace=False)]
+    centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(sample @ centroids.T, axis=1)
+        for i in range(n_lists):
+            members = sample[assignment == i]
+            if len(members):
+                centroids[i] = members.mean(axis=0)
+        centroids = _normalize(centroids)
+    return centroids
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray, batch_size: int = 8192) -> np.ndarray:
+    return np.concatenate([
+        np.argmax(vectors[i:i + batch_size] @ centroids.T, axis=1)
+        for i in range(0, len(vectors), batch_size)
+    ])
+
+
+# doc_idsの各ドキュメントのベクトルをpathに保存する
+def build_vector_index(path: str, doc_ids: list[int], vectors: list[list[float]], ivf_threshold: int = IVF_THRESHOLD):
+    for name in ("ivf_centroids", "ivf_offsets", "ivf_rows"):
+        if os.path.exists(os.path.join(path, f"{name}.npy")):
+            os.remove(os.path.join(path, f"{name}.npy"))
+    if not doc_ids:
+        for name in ("vectors", "vector_doc_ids"):
+            if os.path.exists(os.path.join(path, f"{name}.npy")):
+                os.remove(os.path.join(path, f"{name}.npy"))
+        return
+
+    matrix = _normalize(np.asarray(vectors, dtype=np.float32))
+    _save_array(path, "vectors", matrix)
+    _save_array(path, "vector_doc_ids", np.asarray(doc_ids, dtype=np.int32))
+
+    if len(matrix) >= ivf_threshold:
+        n_lists = int(np.sqrt(len(matrix)))
+        centroids = _kmeans(matrix, n_lists)
+        assignment = _assign(matrix, centroids)
+        rows = np.argsort(assignment, kind="stable").astype(np.int32)
+        offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(assignment, minlength=n_lists))
+        _save_array(path, "ivf_centroids", centroids.astype(np.float32))
+        _save_array(path, "ivf_offsets", offsets)
+        _save_array(path, "ivf_rows", rows)
+
+
+def load_vectors(path: str) -> dict[int, np.ndarray]:
+    if not os.path.exists(os.path.join(path, "vectors.npy")):
+        return {}
+    vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+    doc_ids = np.load(os.path.join(path, "vector_doc_ids.npy"))
+    return {int(doc_id): np.asarray(vectors[row]) for row, doc_id in enumerate(doc_ids)}
+
+
+class LocalVectorIndex:
+    def __init__(self, path: str):
+        self.path = path
+        load = lambda name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+        self.vectors = load("vectors")
+        self.doc_ids = load("vector_doc_ids")
+        self.centroids = None
+        if os.path.exists(os.path.join(path, "ivf_centroids.npy")):
+            self.centroids = np.asarray(load("ivf_centroids"))
+            self.ivf_offsets = load("ivf_offsets")
+            self.ivf_rows = load("ivf_rows")
+
+    # コサイン類似度が高い順に(ドキュメント番号, 類似度)をtop_k件返す
+    # nprobeはIVFを利用する場合に探索するクラスタ数
+    def search(self, query_vector: list[float], top_k: int = 3, nprobe: int = 8) -> list[tuple[int, float]]:
+        query = _normalize(np.asarray(query_vector, dtype=np.float32))
+        if self.centroids is None:
+            rows = None
+            scores = self.vectors @ query
+        else:
+            lists = np.argsort(-(self.centroids @ query))[:nprobe]
+            rows = np.sort(np.concatenate([self.ivf_rows[self.ivf_offsets[i]:self.ivf_offsets[i + 1]] for i in lists]))
+            scores = self.vectors[rows] @ query
+
+        top = np.argpartition(-scores, top_k - 1)[:top_k] if len(scores) > top_k else np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        selected = top if rows is None else rows[top]
+        return [(int(self.doc_ids[row]), float(score)) for row, score in zip(selected, scores[top])]
+
+
+def _to_document(index: LocalBM25Index, doc_id: int, score: float, content_key: str) -> Document:
+    document = index.get_document(doc_id)
+    content = document.pop(content_key, "")
+    document["@search.score"] = score
+    return Document(page_content=content, metadata=document)
+
+
+class LocalVectorRetriever(BaseRetriever):
+    index_path: str
+    embeddings: Embeddings
+    top_k: int = 3
+    nprobe: int = 8
+    content_key: str = "content"
+    _index: LocalBM25Index = PrivateAttr(default=None)
+    _vectors: LocalVectorIndex = PrivateAttr(default=None)
+
+    def model_post_init(self, __context: Any):
+        self._index = LocalBM25Index(self.index_path)
+        self._vectors = LocalVectorIndex(self.index_path)
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> list[Document]:
+        results = self._vectors.search(self.embeddings.embed_query(query), self.top_k, self.nprobe)
+        return [_to_document(self._index, doc_id, score, self.content_key) for doc_id, score in results]
+
+
+class LocalHybridRetriever(BaseRetriever):
+    # BM25とベクトル検索のそれぞれ上位candidates件の順位をReciprocal Rank Fusionで統合する
+    index_path: str
+    embeddings: Embeddings
+    top_k: int = 3
+    candidates: int = 50
+    rrf_k: int = 60
+    nprobe: int = 8
+    content_key: str = "content"
+    _index: LocalBM25Index = PrivateAttr(default=None)
+    _vectors: LocalVectorIndex = PrivateAttr(default=None)
+
+    def model_post_init(self, __context: Any):
+        self._index = LocalBM25Index(self.index_path)
+        self._vectors = LocalVectorIndex(self.index_path)
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> list[Document]:
+        rankings = [
+            self._index.search(query, self.candidates),
+            self._vectors.search(self.embeddings.embed_query(query), self.candidates, self.nprobe),
+        ]
+        fused: dict[int, float] = {}
+        for ranking in rankings:
+            for rank, (doc_id, _) in enumerate(ranking, start=1):
+                fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (self.rrf_k + rank)
+        top = sorted(fused.items(), key=lambda item: (-item[1], item[0]))[:self.top_k]
+        return [_to_document(self._index, doc_id, score, self.content_key) for doc_id, score in top]
@@ -1,20 +1,25 @@
 import os
+import sys
+import argparse
 from typing import Any
 import asyncio
 from dotenv import load_dotenv
-from ragas.metrics.base import Metric
-from langsmith.schemas import Example, Run
 from langsmith.evaluation import aevaluate
-from langchain_openai import AzureChatOpenAI, AzureOpenAIEmbeddings
 from ragas.llms import LangchainLLMWrapper
 from ragas.embeddings import LangchainEmbeddingsWrapper
 from ragas.metrics import ContextPrecision, Faithfulness
-from ragas import SingleTurnSample
-from langchain_core.prompts import ChatPromptTemplate, HumanMessagePromptTemplate
-from langchain_core.messages import SystemMessage
-from langchain.schema import StrOutputParser
-from langchain.schema.runnable import RunnablePassthrough
-from langchain_community.retrievers import AzureAISearchRetriever
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from rag_common.azure_openai import create_azure_chat_openai, create_azure_openai_embeddings
+from rag_common.pipeline import RagPipeline
+from rag_common.concurrency import set_judge_concurrency
+from rag_common.dataset_mirror import DatasetMirror
+from rag_common.embedding_cache import CachedEmbeddings
+from rag_common.ragas_evaluator import RagasEvaluator
+from rag_common.results_store import ResultsStore, resume_dataset_version
+from rag_common.retrieval_metrics import retrieval_metrics
+from rag_common.sequential_evaluation import SequentialEvaluator
+from rag_common.score_cache import ScoreCache
 
 # .envファイルの読み込み
 load_dotenv()
@@ -26,106 +31,112 @@ os.environ["OPENAI_API_VERSION"] = os.getenv("OPENAI_API_VERSION")
 os.environ["AZURE_AI_SEARCH_ENDPOINT"] = os.getenv("SEARCH_SERVICE_ENDPOINT")
 os.environ["AZURE_AI_SEARCH_API_KEY"] = os.getenv("SEARCH_API_KEY")
 
-class RagasEvaluator:
-    # 対象となるMetricsを設定
-    def __init__(self, metrics:list[Metric]):
-        self.metrics = metrics
-
-    # 実際に引き渡す評価用の関数
-    # runはtargetの返り値, exampleはDatasetに登録された値を示す
-    async def evaluate(self, run: Run, example: Example) -> dict[str, Any]:
-        context_strs = run.outputs["retrieved_contexts"] #RAGシステムから得られた関連情報
-
-        single_turn_sample = SingleTurnSample(
-            user_input=example.inputs["user_input"],#テストセットから得られた質問文
-            retrieved_contexts=context_strs,
-            response=run.outputs["response"], #RAGシステムから得られた回答
-            reference=example.outputs["reference"] #テストセットから得られた真の回答
-        )
-        
-        results = []
-        # 各Metricに対して評価を実行
-        for metric in self.metrics:
-            score = await metric.single_turn_ascore(single_turn_sample)
-            results.append({"key": metric.name, "score": score})
-        
-        return results
+# パイプラインは評価の実行ごとに1度だけ構築し、全Exampleで使い回す
+rag_pipeline = RagPipeline.from_azure(index_name="docs_di_1500", top_k=3)
+
+# 実行中の評価の結果の記録先(main()で設定する)
+run_results = None
 
 async def predict(inputs: dict[str, Any]) -> dict[str, Any]:
     user_input = inputs["user_input"]
-    
-    retriever = AzureAISearchRetriever(
-        service_name="srch-sd-rag-evaluation",
-        content_key="content",
-        top_k=3, 
-        index_name="docs_di_1500")
-    
-    prompt = ChatPromptTemplate.from_messages(
-        [SystemMessage(
-             """関連情報に基づき質問に回答してください。"""
-        ),
-         HumanMessagePromptTemplate.from_template(
-             """ 関連情報：{context}
-               
-             ## 質問：{question}
-             ## 回答： """
-        )
-         ]
-        ) 
-
-    llm = AzureChatOpenAI(
-        azure_deployment="gpt-4o-mini-deploy",
-        temperature=0,
-    )
-
-    def format_docs(docs):
-        return "\n\n".join(doc.page_content for doc in docs)
-
-    answer_chain = (
-        {"context": retriever | format_docs, "question": RunnablePassthrough()}
-        | prompt
-        | llm
-        | StrOutputParser()
-    )
-    answer = answer_chain.invoke(user_input)
-
-    # contextを得るためのchain
-    context_chain = retriever
 
-    contexts = context_chain.invoke(user_input)
-    retrieved_contexts = [c.page_content for c in contexts]
+    outputs = run_results.outputs(inputs) if run_results is not None else None
+    if outputs is not None:
+        return outputs
 
-    return {
-        "response": answer,
-        "retrieved_contexts": retrieved_contexts,
-    }
+    # 検索は1回のみ行い、回答生成と返却するretrieved_contextsで同じ結果を利用する
+    outputs = await rag_pipeline.ainvoke(user_input)
+    if run_results is not None:
+        run_results.add_outputs(inputs, outputs)
+    return outputs
 
 async def main():
     dataset_name = "syugyo-kisoku"
         
-    evaluator_llm = LangchainLLMWrapper(AzureChatOpenAI(
+    evaluator_llm = LangchainLLMWrapper(create_azure_chat_openai(
         azure_deployment="gpt-4o-mini",
         temperature=0.8,
     ))
 
-    evaluator_embeddings = LangchainEmbeddingsWrapper(AzureOpenAIEmbeddings(
+    # 一度Embeddingした質問文はキャッシュから取得する
+    cached_embeddings = CachedEmbeddings(create_azure_openai_embeddings(
         azure_deployment="text-embedding-3-small-deploy"
     ))
+    evaluator_embeddings = LangchainEmbeddingsWrapper(cached_embeddings)
 
     # 評価を実行するMetricsを定義
+    # hit@k等の検索の評価指標はreference_contextsとの文字の重なりから計算する(LLMを呼び出さない)
     metrics = [
         ContextPrecision(llm=evaluator_llm),
-        Faithfulness(llm=evaluator_llm)
+        Faithfulness(llm=evaluator_llm),
+        *retrieval_metrics(k=3),
     ]
 
+    # 前回までと同じサンプルに対する評価結果はキャッシュから取得する
+    score_cache = ScoreCache(bypass=args.no_score_cache)
+
+    # 評価用LLMの同時呼び出し数の上限。Exampleの並列数にも同じ値を利用する
+    set_judge_concurrency(args.max_concurrency)
+
+    # (Example, Metric)ごとの結果は完了した時点でローカルに記録する
+    # --run-idで中断した実行を指定した場合は、すべてのMetricを評価済みのExampleを除いて続きから評価する
+    # 再開時は実行の開始時に利用したスナップショットのバージョンに固定する
+    store = ResultsStore()
+    dataset_version = resume_dataset_version(store, args.run_id, args.dataset_version)
+
+    # DatasetのExampleはローカルのスナップショットから読み込む(更新されている場合は差分のみ取得する)
+    mirror = DatasetMirror(dataset_name)
+    examples = mirror.examples(version=dataset_version, refresh=not args.offline)
+    results = store.open_run(args.run_id, dataset=dataset_name, **mirror.describe(dataset_version))
+    metric_names = [metric.name for metric in metrics]
+    pending = [e for e in examples if not results.is_completed(str(e.id), metric_names)]
+    print(f"run {results.run_id}: {len(examples) - len(pending)}/{len(examples)} examples already evaluated")
+
+    # 再開時は記録済みのRAGの出力を再利用する
+    global run_results
+    run_results = results
+
+    evaluator = RagasEvaluator(metrics, score_cache=score_cache, metric_timeout=args.metric_timeout,
+                               results=results)
+
+    # 逐次サンプリングの場合は、信頼区間の幅が目標値に達したMetricから評価を打ち切る(LangSmithには登録しない)
+    if args.sequential:
+        sequential = SequentialEvaluator(evaluator, predict, target_width=args.target_width,
+                                         confidence=args.confidence, max_examples=args.max_examples,
+                                         batch_size=args.max_concurrency)
+        print(sequential.report(await sequential.run(examples)))
+
     # 評価の実行
-    await aevaluate(
-        predict,
-        data=dataset_name,
-        evaluators=[
-            RagasEvaluator(metrics).evaluate
-        ],
-    )
+    elif pending:
+        await aevaluate(
+            predict,
+            data=pending,
+            metadata={**mirror.describe(dataset_version), "run_id": results.run_id},
+            upload_results=not args.offline,
+            evaluators=[evaluator.evaluate],
+            max_concurrency=args.max_concurrency,
+        )
+
+    # 中断前の結果を含めた実行全体の結果を表示する
+    print(results.summary())
+    print(results.stats)
+    print(cached_embeddings.stats)
+    print(score_cache.stats)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="LangSmith上で評価を行う")
+    parser.add_argument("--no-score-cache", action="store_true", help="評価結果のキャッシュを参照せずに評価する")
+    parser.add_argument("--max-concurrency", type=int, default=8, help="評価用LLMの同時呼び出し数の上限")
+    parser.add_argument("--metric-timeout", type=float, default=None, help="Metricごとのタイムアウト(秒)")
+    parser.add_argument("--dataset-version", type=int, default=None,
+                        help="利用するDatasetのローカルのスナップショットのバージョン(省略時は最新)")
+    parser.add_argument("--offline", action="store_true",
+                        help="LangSmithに接続せず、保存済みのスナップショットで評価する(評価結果は登録しない)")
+    parser.add_argument("--run-id", default=None, help="中断した評価の実行ID(指定した実行の続きから評価する)")
+    parser.add_argument("--sequential", action="store_true",
+                        help="ランダムな順序で評価し、スコアの信頼区間が目標の幅に達したMetricから評価を打ち切る")
+    parser.add_argument("--target-width", type=float, default=0.04, help="信頼区間の幅の目標値(±0.02の場合は0.04)")
+    parser.add_argument("--confidence", type=float, default=0.95, help="信頼区間の信頼水準")
+    parser.add_argument("--max-examples", type=int, default=None, help="Metricごとに評価するExampleの数の上限")
+    args = parser.parse_args()
     asyncio.run(main())
\ No newline at end of file
@@ -1,22 +1,29 @@
 import os
+import sys
 from azure.search.documents.indexes import SearchIndexClient
-from azure.search.documents import SearchClient
 from azure.core.credentials import AzureKeyCredential
 from azure.search.documents.indexes.models import *
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from pypdf import PdfReader
 from dotenv import load_dotenv
 import time
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from rag_common.incremental import IndexManifest, sync_chunks
+from rag_common.search import create_search_client, index_embeddings, use_local_index
+from rag_common.streaming import iter_pdf_pages, split_stream
+
 # 環境変数からAzure AI Searchのエンドポイント等を取得する
 load_dotenv()
-search_endpoint = os.environ["SEARCH_SERVICE_ENDPOINT"]
-search_api_key = os.environ["SEARCH_API_KEY"]
+search_endpoint = os.getenv("SEARCH_SERVICE_ENDPOINT")
+search_api_key = os.getenv("SEARCH_API_KEY")
 
 filepath = "../rag_source_docs/syugyo-kisoku.pdf"  # 対象ファイルパス
 
 #インデックスの作成
 def create_index():
+    # ローカルのインデックスを利用する場合はインデックスの定義は不要
+    if use_local_index():
+        return
+
     client = SearchIndexClient(endpoint= search_endpoint, credential=AzureKeyCredential(search_api_key))
     name = "docs"
 
@@ -35,33 +42,27 @@ def create_index():
     index = SearchIndex(name=name, fields=fields)
     client.create_index(index)
 
+    # 新しく作成したインデックスには何も登録されていないため、登録済みの記録を削除する
+    IndexManifest(name).clear()
 
+
+# ページごとのテキストを複数プロセスで抽出し、ページ順に返す
 def extract_text_from_docs(filepath):
-    with open(filepath, "rb") as f:
-        reader = PdfReader(f)
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text()            
-    return text
-
-def create_chunk(content: str, separator: str, chunk_size: int = 512, overlap: int = 0):
-    splitter = RecursiveCharacterTextSplitter(chunk_overlap=overlap, chunk_size=chunk_size, separators=separator)
-    chunks = splitter.split_text(content)
-    return chunks
-
-
-def index_docs(chunks: list):
-    searchClient = SearchClient(
-        endpoint=search_endpoint,
-        index_name="docs",
-        credential=AzureKeyCredential(search_api_key)
-    )
-
-    # チャンク化されたテキストとそのテキストのベクトルをAzure AI Searchにアップロードする
-    for i, chunk in enumerate(chunks):
-        document = {"id": str(i), "content": chunk}
-        searchClient.upload_documents([document])
-        print(i)
+    return iter_pdf_pages(filepath)
+
+# 抽出されたテキストから順に指定したサイズで分割する
+def create_chunk(pages, separator: str, chunk_size: int = 512, overlap: int = 0):
+    return split_stream(pages, separator, chunk_size, overlap)
+
+
+def index_docs(chunks, filepath: str):
+    # LOCAL_INDEX_DIRが設定されている場合はローカルのインデックスに書き込む
+    searchClient = create_search_client("docs")
+
+    # チャンクの内容から作成したIDで、前回から追加・削除されたチャンクのみをAzure AI Searchに反映する
+    with searchClient:
+        stats = sync_chunks(searchClient, "docs", filepath, chunks, embeddings=index_embeddings())
+    print(stats)
 
 def main():
     # チャンク化のパラメータ
@@ -72,14 +73,14 @@ def main():
     # インデックスを作成する
     create_index()
 
-    # 対象ファイルパスのファイルを読み込んで、テキストを抽出する
-    content = extract_text_from_docs(filepath)
-    
-    # テキストを指定したサイズで分割する
-    chunks = create_chunk(content, separator, chunksize, overlap)
-    
-    # テキストをAzure AI Searchにインデックスする
-    index_docs(chunks)
+    # 対象ファイルパスのファイルを読み込んで、ページごとにテキストを抽出する
+    pages = extract_text_from_docs(filepath)
+
+    # 抽出されたテキストから順に指定したサイズで分割する
+    chunks = create_chunk(pages, separator, chunksize, overlap)
+
+    # 分割されたチャンクから順にAzure AI Searchにインデックスする
+    index_docs(chunks, filepath)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
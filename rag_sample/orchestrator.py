@@ -1,61 +1,66 @@
 import os
+import sys
 import argparse
+import asyncio
 from dotenv import load_dotenv
-from langchain_core.prompts import ChatPromptTemplate, HumanMessagePromptTemplate
-from langchain_core.messages import SystemMessage
-from langchain.schema import StrOutputParser
-from langchain.schema.runnable import RunnablePassthrough
-from langchain_openai import AzureChatOpenAI
-from langchain_community.retrievers import AzureAISearchRetriever
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from rag_common.server import request_answer, stream_answer
 
 load_dotenv()
-os.environ["AZURE_OPENAI_ENDPOINT"] = os.getenv("AZURE_OPENAI_ENDPOINT")
-os.environ["AZURE_OPENAI_API_KEY"] = os.getenv("AZURE_OPENAI_API_KEY")
-os.environ["OPENAI_API_VERSION"] = os.getenv("OPENAI_API_VERSION")
-os.environ["AZURE_AI_SEARCH_ENDPOINT"] = os.getenv("SEARCH_SERVICE_ENDPOINT")
-os.environ["AZURE_AI_SEARCH_API_KEY"] = os.getenv("SEARCH_API_KEY")
 
 parser = argparse.ArgumentParser(description="回答を生成する")
 parser.add_argument("user_input", type=str, help="質問内容")
+parser.add_argument("--server", default=os.getenv("RAG_SERVER_URL"),
+                    help="起動済みのserver.pyのURL(例: http://127.0.0.1:8080)。省略時はこのプロセスで回答を生成する")
+parser.add_argument("--stream", action="store_true",
+                    help="生成されたトークンから順に表示し、最初のトークンまでの時間と全体の処理時間を標準エラーに出力する")
+parser.add_argument("--answer-cache", action="store_true",
+                    help="同じ質問・類似した質問にはインデックスが更新されるまで保存済みの回答を返す(サーバー利用時はserver.pyで指定する)")
 args = parser.parse_args()
 
-retriever = AzureAISearchRetriever(
-    service_name="srch-sd-rag-evaluation",
-    content_key="content",
-    top_k=3, 
-    index_name="docs")
-
-prompt = ChatPromptTemplate.from_messages(
-    [SystemMessage(
-            """関連情報に基づき質問に回答してください。"""
-    ),
-        HumanMessagePromptTemplate.from_template(
-            """ 関連情報：{context}
-            
-            ## 質問：{question}
-            ## 回答： """
-    )
-        ]
-    ) 
-
-llm = AzureChatOpenAI(
-    azure_deployment="gpt-4o-mini-deploy",
-    temperature=0,
-)
-
-def format_docs(docs):
-    return "\n\n".join(doc.page_content for doc in docs)
-
-answer_chain = (
-    {"context": retriever | format_docs, "question": RunnablePassthrough()}
-    | prompt
-    | llm
-    | StrOutputParser()
-)
-answer = answer_chain.invoke(args.user_input)
-
-# contextを得るためのchain
-context_chain = retriever
-
-contexts = context_chain.invoke(args.user_input)
-retrieved_contexts = [c.page_content for c in contexts]
+
+# ストリーミングのイベントを受け取った順に表示する(検索結果のイベントは回答の生成前に届くが表示はしない)
+def print_event(event: dict):
+    if event["type"] == "token":
+        print(event["content"], end="", flush=True)
+    elif event["type"] == "end":
+        print()
+        ttft = f"{event['ttft']:.3f}s" if event["ttft"] is not None else "-"
+        print(f"ttft={ttft} total={event['total']:.3f}s", file=sys.stderr)
+    elif event["type"] == "error":
+        raise RuntimeError(event["error"])
+
+
+if args.server:
+    # サーバーで構築済みのパイプラインを利用して回答を生成する
+    if args.stream:
+        for event in stream_answer(args.server, args.user_input):
+            print_event(event)
+        sys.exit()
+    result = request_answer(args.server, args.user_input)
+else:
+    from rag_common.pipeline import RagPipeline
+
+    os.environ["AZURE_OPENAI_ENDPOINT"] = os.getenv("AZURE_OPENAI_ENDPOINT")
+    os.environ["AZURE_OPENAI_API_KEY"] = os.getenv("AZURE_OPENAI_API_KEY")
+    os.environ["OPENAI_API_VERSION"] = os.getenv("OPENAI_API_VERSION")
+    os.environ["AZURE_AI_SEARCH_ENDPOINT"] = os.getenv("SEARCH_SERVICE_ENDPOINT")
+    os.environ["AZURE_AI_SEARCH_API_KEY"] = os.getenv("SEARCH_API_KEY")
+
+    rag_pipeline = RagPipeline.from_azure(index_name="docs", top_k=3, answer_cache=args.answer_cache)
+
+    if args.stream:
+        async def stream():
+            async for event in rag_pipeline.astream(args.user_input):
+                print_event(event)
+
+        asyncio.run(stream())
+        sys.exit()
+
+    # 検索は1回のみ行い、回答生成と関連情報の取得で同じ検索結果を利用する
+    result = rag_pipeline.invoke(args.user_input)
+answer = result["response"]
+retrieved_contexts = result["retrieved_contexts"]
+
+print(answer)
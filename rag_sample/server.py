@@ -0,0 +1,49 @@
+import os
+import sys
+import argparse
+import asyncio
+from dotenv import load_dotenv
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from rag_common.pipeline import RagPipeline
+from rag_common.server import RagServer
+
+load_dotenv()
+os.environ["AZURE_OPENAI_ENDPOINT"] = os.getenv("AZURE_OPENAI_ENDPOINT")
+os.environ["AZURE_OPENAI_API_KEY"] = os.getenv("AZURE_OPENAI_API_KEY")
+os.environ["OPENAI_API_VERSION"] = os.getenv("OPENAI_API_VERSION")
+os.environ["AZURE_AI_SEARCH_ENDPOINT"] = os.getenv("SEARCH_SERVICE_ENDPOINT")
+os.environ["AZURE_AI_SEARCH_API_KEY"] = os.getenv("SEARCH_API_KEY")
+
+
+def main(args):
+    # パイプラインは起動時に1度だけ構築し、全てのリクエストで使い回す
+    rag_pipeline = RagPipeline.from_azure(index_name=args.index_name, top_k=args.top_k,
+                                          answer_cache=args.answer_cache, cache_ttl=args.cache_ttl,
+                                          cache_threshold=args.cache_threshold)
+    server = RagServer(rag_pipeline, max_concurrency=args.max_concurrency, queue_depth=args.queue_depth)
+    if args.stdin:
+        asyncio.run(server.serve_stdin())
+    else:
+        asyncio.run(server.serve_http(args.host, args.port))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="回答を生成するサーバーを起動する")
+    parser.add_argument("--host", default="127.0.0.1", help="待ち受けるアドレス")
+    parser.add_argument("--port", type=int, default=8080, help="待ち受けるポート")
+    parser.add_argument("--stdin", action="store_true",
+                        help='HTTPの代わりに標準入力から1行ずつ{"id": ..., "question": "..."}を読み込み、結果を標準出力に書き込む')
+    parser.add_argument("--index-name", default="docs", help="検索対象のインデックス名")
+    parser.add_argument("--top-k", type=int, default=3, help="検索するドキュメント数")
+    parser.add_argument("--max-concurrency", type=int, default=8, help="同時に回答を生成するリクエスト数の上限")
+    parser.add_argument("--queue-depth", type=int, default=64, help="上限を超えたリクエストを待機させる数(超えた場合は503を返す)")
+    parser.add_argument("--answer-cache", action="store_true",
+                        help="同じ質問・類似した質問にはインデックスが更新されるまで保存済みの回答を返す")
+    parser.add_argument("--cache-ttl", type=float, default=24 * 60 * 60, help="回答キャッシュの有効期間(秒)")
+    parser.add_argument("--cache-threshold", type=float, default=0.95,
+                        help="類似した質問とみなす質問文のEmbeddingのコサイン類似度")
+    try:
+        main(parser.parse_args())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+# スクリプトと同様に、リポジトリのルートからrag_common等を読み込めるようにする
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+# キャッシュ(.cache)はテストごとの一時ディレクトリに保存する
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    import rag_common.paths
+
+    path = tmp_path / "cache"
+    monkeypatch.setattr(rag_common.paths, "CACHE_DIR", str(path))
+    return path
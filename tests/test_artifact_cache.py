@@ -0,0 +1,111 @@
+import asyncio
+import json
+from collections import Counter
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from ragas import SingleTurnSample
+from ragas.llms import LangchainLLMWrapper
+from ragas.metrics import Faithfulness, NoiseSensitivity
+
+from rag_common.artifact_cache import ArtifactCache
+from rag_common.ragas_evaluator import RagasEvaluator
+
+RESPONSE_STATEMENTS = ["富士山は山梨県と静岡県に跨る活火山である。", "富士山の標高は3776.12mである。"]
+REFERENCE_STATEMENTS = ["富士山は山梨県と静岡県に跨る山である。", "富士山の標高は3776.12mである。"]
+RESPONSE = "富士山は山梨県と静岡県に跨る活火山で、標高は3776.12mです。"
+REFERENCE = "富士山は山梨県と静岡県に跨る山で、標高は3776.12mです。"
+
+
+class ScriptedJudge(BaseChatModel):
+    # 文への分解と文脈との照合のプロンプトに決まった結果を返し、プロンプトの種類ごとの呼び出し回数を数える
+    calls: Counter
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted-judge"
+
+    def _reply(self, prompt: str) -> str:
+        if "simpler_statements" in prompt:
+            self.calls["statements"] += 1
+            statements = RESPONSE_STATEMENTS if RESPONSE in prompt else REFERENCE_STATEMENTS
+            return json.dumps({"sentences": [{"sentence_index": 0, "simpler_statements": statements}]})
+        self.calls["verdicts"] += 1
+        statements = RESPONSE_STATEMENTS if RESPONSE_STATEMENTS[0] in prompt else REFERENCE_STATEMENTS
+        return json.dumps({"statements": [{"statement": s, "reason": "文脈に記載がある", "verdict": 1}
+                                          for s in statements]})
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        content = self._reply(messages[-1].content)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+
+def sample(retrieved_contexts: list[str]) -> SingleTurnSample:
+    return SingleTurnSample(user_input="富士山について教えてください。", retrieved_contexts=retrieved_contexts,
+                            response=RESPONSE, reference=REFERENCE)
+
+
+CONTEXTS = ["富士山は山梨県と静岡県に跨る活火山である。標高3776.12m。", "エベレストは世界最高峰の山である。"]
+
+
+def evaluate(contexts: list[str], artifact_cache=None, replace_prompts: bool = False):
+    judge = ScriptedJudge(calls=Counter())
+    llm = LangchainLLMWrapper(judge)
+    faithfulness, noise_sensitivity = Faithfulness(llm=llm), NoiseSensitivity(llm=llm)
+    evaluator = RagasEvaluator([faithfulness, noise_sensitivity], artifact_cache=artifact_cache)
+    if replace_prompts:
+        # 日本語化等で評価器の作成後にプロンプトを差し替えた場合
+        for metric in (faithfulness, noise_sensitivity):
+            metric.set_prompts(**{name: prompt.__class__() for name, prompt in metric.get_prompts().items()})
+    results = asyncio.run(evaluator.evaluate_sample(sample(contexts), "sample"))
+    return {r["key"]: r["score"] for r in results}, judge.calls
+
+
+def test_shares_response_decomposition_between_faithfulness_and_noise_sensitivity():
+    baseline_scores, baseline_calls = evaluate(CONTEXTS)
+    cache = ArtifactCache()
+    scores, calls = evaluate(CONTEXTS, cache)
+
+    assert scores == baseline_scores
+    # 回答の文への分解は2つのMetricで1度にまとまる(正解の分解はNoiseSensitivityのみが行う)
+    # Faithfulnessは文脈をまとめて、NoiseSensitivityは文脈ごとに照合するため、照合は共有されない
+    assert baseline_calls == {"statements": 3, "verdicts": 6}
+    assert calls == {"statements": 2, "verdicts": 6}
+    assert cache.hits == 1
+
+
+def test_shares_verdicts_when_the_same_context_is_checked():
+    baseline_scores, baseline_calls = evaluate(CONTEXTS[:1])
+    scores, calls = evaluate(CONTEXTS[:1], ArtifactCache())
+
+    assert scores == baseline_scores
+    # 文脈が1件の場合は、回答の文と文脈の照合も2つのMetricで同じ呼び出しになる
+    assert baseline_calls == {"statements": 3, "verdicts": 4}
+    assert calls == {"statements": 2, "verdicts": 3}
+
+
+def test_shares_prompts_replaced_after_construction():
+    baseline_scores, _ = evaluate(CONTEXTS, replace_prompts=True)
+    scores, calls = evaluate(CONTEXTS, ArtifactCache(), replace_prompts=True)
+
+    assert scores == baseline_scores
+    assert calls == {"statements": 2, "verdicts": 6}
+
+
+def test_failed_calls_are_not_cached():
+    cache = ArtifactCache()
+
+    async def fail():
+        raise RuntimeError("judge failed")
+
+    async def run():
+        for _ in range(2):
+            try:
+                await cache.get_or_create("key", fail)
+            except RuntimeError:
+                pass
+        return await cache.get_or_create("key", lambda: asyncio.sleep(0, result="ok"))
+
+    assert asyncio.run(run()) == "ok"
+    assert (cache.hits, cache.misses) == (0, 3)
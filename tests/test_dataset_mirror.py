@@ -0,0 +1,142 @@
+import os
+
+import pytest
+from langsmith.utils import LangSmithConnectionError, LangSmithError
+
+from rag_common.dataset_mirror import DatasetMirror
+from rag_common.fakes import FakeLangSmithClient
+
+DATASET = "syugyo-kisoku"
+
+
+@pytest.fixture
+def client() -> FakeLangSmithClient:
+    client = FakeLangSmithClient()
+    client.create_dataset(DATASET)
+    client.create_examples(
+        inputs=[{"user_input": f"質問{i}"} for i in range(3)],
+        outputs=[{"reference": f"回答{i}"} for i in range(3)],
+        metadata=[{"synthesizer_name": "single_hop"} for _ in range(3)],
+        ids=[f"00000000-0000-0000-0000-00000000000{i}" for i in range(3)],
+        dataset_name=DATASET,
+    )
+    return client
+
+
+@pytest.fixture
+def mirror(client, tmp_path) -> DatasetMirror:
+    return DatasetMirror(DATASET, client=client, path=str(tmp_path / "mirror"))
+
+
+def by_id(examples) -> dict:
+    return {str(e.id): e for e in examples}
+
+
+class ListCounter:
+    # list_examplesで取得したExampleの数を数える
+    def __init__(self, client: FakeLangSmithClient, monkeypatch):
+        self.fetched = 0
+        list_examples = client.list_examples
+
+        def counted(*args, **kwargs):
+            for example in list_examples(*args, **kwargs):
+                self.fetched += 1
+                yield example
+
+        monkeypatch.setattr(client, "list_examples", counted)
+
+
+def test_first_refresh_downloads_all_examples(mirror):
+    examples = mirror.examples()
+
+    assert mirror.latest["version"] == 1
+    assert [e.inputs["user_input"] for e in examples] == ["質問0", "質問1", "質問2"]
+    assert examples[0].outputs == {"reference": "回答0"}
+    assert examples[0].metadata == {"synthesizer_name": "single_hop"}
+
+
+def test_refresh_applies_added_modified_and_removed_examples(client, mirror, monkeypatch):
+    mirror.refresh()
+    ids = list(by_id(mirror.examples(refresh=False)))
+
+    client.create_examples(inputs=[{"user_input": "質問3"}], outputs=[{"reference": "回答3"}],
+                           dataset_name=DATASET)
+    client.update_example(ids[1], outputs={"reference": "変更した回答1"})
+    client.delete_example(ids[2])
+    counter = ListCounter(client, monkeypatch)
+
+    assert mirror.refresh() == 2
+    # 追加・変更されたExampleのみ取得する
+    assert counter.fetched == 2
+    examples = mirror.examples(refresh=False)
+    assert [e.inputs["user_input"] for e in examples] == ["質問0", "質問1", "質問3"]
+    assert by_id(examples)[ids[1]].outputs == {"reference": "変更した回答1"}
+    assert ids[2] not in by_id(examples)
+    # 前のバージョンも読み込める
+    assert len(mirror.examples(version=1)) == 3
+    assert mirror.describe()["example_count"] == 3
+
+
+def test_refresh_is_noop_when_dataset_is_unchanged(client, mirror, monkeypatch):
+    mirror.refresh()
+    counter = ListCounter(client, monkeypatch)
+    files = sorted(os.listdir(mirror.path))
+
+    assert mirror.refresh() == 1
+    assert counter.fetched == 0
+    assert len(mirror.versions) == 1
+    assert sorted(os.listdir(mirror.path)) == files
+
+
+def test_refresh_refetches_all_examples_when_diff_fails(client, mirror, monkeypatch):
+    mirror.refresh()
+    client.create_examples(inputs=[{"user_input": "質問3"}], dataset_name=DATASET)
+
+    def fail(*args, **kwargs):
+        raise LangSmithError("diff is not available")
+
+    monkeypatch.setattr(client, "diff_dataset_versions", fail)
+    counter = ListCounter(client, monkeypatch)
+
+    assert mirror.refresh() == 2
+    assert counter.fetched == 4
+    assert len(mirror.examples(refresh=False)) == 4
+
+
+def test_keep_versions_prunes_old_snapshots(client, tmp_path):
+    mirror = DatasetMirror(DATASET, client=client, path=str(tmp_path / "mirror"), keep_versions=2)
+    for i in range(4):
+        client.create_examples(inputs=[{"user_input": f"追加{i}"}], dataset_name=DATASET)
+        mirror.refresh()
+
+    assert [v["version"] for v in mirror.versions] == [3, 4]
+    assert sorted(f for f in os.listdir(mirror.path) if f.endswith(".parquet")) == ["v00003.parquet", "v00004.parquet"]
+    with pytest.raises(ValueError):
+        mirror.examples(version=1)
+    # マニフェストから同じバージョンの一覧を読み込める
+    assert DatasetMirror(DATASET, client=client, path=mirror.path).versions == mirror.versions
+
+
+def test_offline_falls_back_to_latest_snapshot(client, mirror, monkeypatch):
+    mirror.refresh()
+    client.create_examples(inputs=[{"user_input": "質問3"}], dataset_name=DATASET)
+
+    def offline(*args, **kwargs):
+        raise LangSmithConnectionError("offline")
+
+    monkeypatch.setattr(client, "read_dataset", offline)
+
+    assert len(mirror.examples()) == 3
+    assert mirror.latest["version"] == 1
+
+
+def test_offline_without_snapshot_raises(client, mirror, monkeypatch):
+    def offline(*args, **kwargs):
+        raise LangSmithConnectionError("offline")
+
+    monkeypatch.setattr(client, "read_dataset", offline)
+
+    with pytest.raises(LangSmithConnectionError):
+        mirror.examples()
+    with pytest.raises(ValueError):
+        mirror.examples(refresh=False)
@@ -0,0 +1,45 @@
+import os
+
+from rag_common.document_intelligence import analyze_document
+from rag_common.fakes import FakeDocumentIntelligenceClient
+
+SAMPLE_PDF = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "rag_source_docs", "syugyo-kisoku.pdf")
+
+
+def test_second_call_hits_cache():
+    client = FakeDocumentIntelligenceClient(content="# 就業規則\n\n第1条")
+    first = analyze_document(SAMPLE_PDF, output_content_format="markdown", client=client)
+    second = analyze_document(SAMPLE_PDF, output_content_format="markdown", client=client)
+
+    assert client.calls == 1
+    assert second.content == first.content
+
+
+def test_different_settings_miss_cache():
+    client = FakeDocumentIntelligenceClient(content="本文")
+    analyze_document(SAMPLE_PDF, output_content_format="markdown", client=client)
+    analyze_document(SAMPLE_PDF, client=client)
+    analyze_document(SAMPLE_PDF, model_id="prebuilt-read", output_content_format="markdown", client=client)
+
+    assert client.calls == 3
+
+
+def test_use_cache_false_calls_service():
+    client = FakeDocumentIntelligenceClient(content="本文")
+    analyze_document(SAMPLE_PDF, client=client)
+    analyze_document(SAMPLE_PDF, client=client, use_cache=False)
+
+    assert client.calls == 2
+
+
+def test_cached_result_round_trips_whole_analyze_result():
+    client = FakeDocumentIntelligenceClient()
+    fresh = analyze_document(SAMPLE_PDF, output_content_format="markdown", client=client)
+    cached = analyze_document(SAMPLE_PDF, output_content_format="markdown", client=client)
+
+    assert client.calls == 1
+    assert cached.as_dict() == fresh.as_dict()
+    assert cached.model_id == fresh.model_id
+    assert cached.content_format == "markdown"
+    assert [page.page_number for page in cached.pages] == [page.page_number for page in fresh.pages]
+    assert cached.pages[-1].spans[0].offset == fresh.pages[-1].spans[0].offset
@@ -0,0 +1,28 @@
+from ragas import SingleTurnSample
+from ragas.metrics import Faithfulness
+
+from rag_common.score_cache import ScoreCache
+
+
+def test_key_changes_when_prompts_are_replaced(tmp_path):
+    cache = ScoreCache(str(tmp_path / "scores.sqlite"))
+    metric = Faithfulness()
+    sample = SingleTurnSample(user_input="q", response="r", retrieved_contexts=["c"])
+    before = cache.key(metric, sample)
+    assert cache.key(metric, sample) == before
+
+    prompt = metric.get_prompts()["n_l_i_statement_prompt"]
+    prompt.instruction = "与えられた文脈に基づいて各文の忠実性を判定してください。"
+    metric.set_prompts(n_l_i_statement_prompt=prompt)
+
+    assert cache.key(metric, sample) != before
+
+
+def test_cached_score_round_trip(tmp_path):
+    cache = ScoreCache(str(tmp_path / "scores.sqlite"))
+    cache.set("key", "faithfulness", 0.5)
+    cache.set("nan", "faithfulness", float("nan"))
+
+    assert cache.get("key") == 0.5
+    assert cache.get("nan") is None
+    assert (cache.hits, cache.misses) == (1, 1)
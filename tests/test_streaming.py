@@ -0,0 +1,67 @@
+import os
+import random
+
+import pytest
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from pypdf import PdfReader
+
+from rag_common.streaming import iter_pdf_pages, split_stream
+
+SAMPLE_PDF = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "rag_source_docs", "syugyo-kisoku.pdf")
+SEPARATORS = ["\n\n", "\n", "。", "、", " ", ""]
+SETTINGS = [(500, 128), (500, 0), (1000, 128), (200, 50)]
+
+
+def split_text(text: str, chunk_size: int, chunk_overlap: int) -> list[str]:
+    splitter = RecursiveCharacterTextSplitter(separators=SEPARATORS, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    return splitter.split_text(text)
+
+
+@pytest.fixture(scope="module")
+def sample_pages() -> list[str]:
+    return [page.extract_text() for page in PdfReader(SAMPLE_PDF).pages]
+
+
+@pytest.mark.parametrize("chunk_size, chunk_overlap", SETTINGS)
+def test_matches_split_text_on_sample_pdf(sample_pages, chunk_size, chunk_overlap):
+    chunks = list(split_stream(sample_pages, SEPARATORS, chunk_size, chunk_overlap))
+    assert chunks == split_text("".join(sample_pages), chunk_size, chunk_overlap)
+
+
+def test_iter_pdf_pages_returns_pages_in_order(sample_pages):
+    assert list(iter_pdf_pages(SAMPLE_PDF, workers=2)) == sample_pages
+
+
+def random_pages(seed: int) -> list[str]:
+    rng = random.Random(seed)
+    sentences = ["第{}条 従業員は就業規則を遵守しなければならない。".format(i) for i in range(50)]
+    paragraphs = []
+    for _ in range(200):
+        lines = ["、".join(rng.choices(sentences, k=rng.randint(1, 4))) for _ in range(rng.randint(1, 12))]
+        paragraphs.append("\n".join(lines))
+    text = "\n\n".join(paragraphs)
+    cuts = sorted(rng.sample(range(1, len(text)), 60))
+    return [text[i:j] for i, j in zip([0, *cuts], [*cuts, len(text)])]
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("chunk_size, chunk_overlap", SETTINGS)
+def test_matches_split_text_when_buffer_is_cut(seed, chunk_size, chunk_overlap):
+    pages = random_pages(seed)
+    chunks = list(split_stream(pages, SEPARATORS, chunk_size, chunk_overlap, buffer_size=chunk_size))
+    assert chunks == split_text("".join(pages), chunk_size, chunk_overlap)
+
+
+def test_yields_chunks_before_the_end_of_the_text():
+    pages = random_pages(0)
+    consumed = 0
+
+    def texts():
+        nonlocal consumed
+        for page in pages:
+            consumed += 1
+            yield page
+
+    stream = split_stream(texts(), SEPARATORS, 200, 50, buffer_size=200)
+    next(stream)
+    assert consumed < len(pages)
@@ -0,0 +1,89 @@
+import json
+
+import pytest
+
+from rag_common.fakes import FakeSearchClient
+from rag_common.uploader import BulkUploader, IndexingResult
+
+
+class ScriptedSearchClient:
+    # キーごとに返すステータスコードを順に指定できるSearchClientのスタンドイン(指定が尽きた後は成功)
+    def __init__(self, statuses: dict[str, list[int]] = None, error: Exception = None):
+        self.statuses = {key: list(codes) for key, codes in (statuses or {}).items()}
+        self.error = error
+        self.requests: list[list[str]] = []
+
+    def upload_documents(self, documents: list[dict], **kwargs) -> list[IndexingResult]:
+        self.requests.append([d["id"] for d in documents])
+        if self.error is not None:
+            raise self.error
+        results = []
+        for document in documents:
+            codes = self.statuses.get(document["id"])
+            status = codes.pop(0) if codes else 200
+            results.append(IndexingResult(document["id"], status == 200, status, None if status == 200 else "error"))
+        return results
+
+
+def documents(n: int, size: int = 10) -> list[dict]:
+    return [{"id": str(i), "content": "x" * size} for i in range(n)]
+
+
+@pytest.mark.parametrize("status", [409, 422, 503])
+def test_retries_only_failed_keys(status):
+    client = ScriptedSearchClient({"1": [status], "3": [status, status]})
+    stats = BulkUploader(client, retry_backoff=0).upload(documents(5))
+
+    assert client.requests == [["0", "1", "2", "3", "4"], ["1", "3"], ["3"]]
+    assert stats.succeeded == 5
+    assert stats.failed == 0
+    assert stats.retried == 3
+
+
+def test_reports_non_retryable_failures():
+    client = ScriptedSearchClient({"1": [400], "2": [503, 503, 503, 503]})
+    stats = BulkUploader(client, max_retries=3, retry_backoff=0).upload(documents(3))
+
+    # 400は再送せず、503は再送の上限に達した時点で失敗とする
+    assert client.requests == [["0", "1", "2"], ["2"], ["2"], ["2"]]
+    assert stats.succeeded == 1
+    assert sorted(stats.failed_keys) == ["1", "2"]
+    assert stats.errors["1"].startswith("400")
+    assert stats.errors["2"].startswith("503")
+
+
+def test_reports_batch_exceptions():
+    client = ScriptedSearchClient(error=ConnectionError("unreachable"))
+    stats = BulkUploader(client, max_retries=1, retry_backoff=0).upload(documents(2))
+
+    assert len(client.requests) == 2
+    assert stats.failed_keys == ["0", "1"]
+    assert "unreachable" in stats.errors["0"]
+
+
+def test_batches_split_by_count():
+    client = ScriptedSearchClient()
+    stats = BulkUploader(client, batch_size=4, max_concurrency=1).upload(documents(10))
+
+    assert [len(r) for r in client.requests] == [4, 4, 2]
+    assert stats.batches == 3
+    assert stats.succeeded == 10
+
+
+def test_batches_split_by_payload_size():
+    docs = documents(6, size=100)
+    size = len(json.dumps(docs[0]).encode("utf-8"))
+    client = ScriptedSearchClient()
+    stats = BulkUploader(client, batch_size=1000, max_batch_bytes=size * 2 + 1, max_concurrency=1).upload(docs)
+
+    assert [len(r) for r in client.requests] == [2, 2, 2]
+    assert stats.batches == 3
+
+
+def test_fake_search_client_partial_failures_are_retried():
+    client = FakeSearchClient(failure_rate=0.3, seed=1)
+    stats = BulkUploader(client, batch_size=50, max_retries=10, retry_backoff=0).upload(documents(500))
+
+    assert stats.succeeded == 500
+    assert stats.retried > 0
+    assert len(client.documents) == 500